@@ -28,14 +28,19 @@ All timeouts are in milliseconds.
 * :class:`AdbCommands`
 
     * :meth:`AdbCommands.__reset`
+    * :meth:`AdbCommands._CheckShellV2`
     * :meth:`AdbCommands._Connect`
     * :meth:`AdbCommands._get_service_connection`
+    * :meth:`AdbCommands._PushDirectory`
+    * :meth:`AdbCommands.CachedBanner`
     * :meth:`AdbCommands.Close`
     * :meth:`AdbCommands.ConnectDevice`
     * :meth:`AdbCommands.Devices`
     * :meth:`AdbCommands.DisableVerity`
     * :meth:`AdbCommands.EnableVerity`
+    * :meth:`AdbCommands.ExecOut`
     * :meth:`AdbCommands.GetState`
+    * :meth:`AdbCommands.HasFeature`
     * :meth:`AdbCommands.Install`
     * :meth:`AdbCommands.InteractiveShell`
     * :meth:`AdbCommands.List`
@@ -47,10 +52,17 @@ All timeouts are in milliseconds.
     * :meth:`AdbCommands.Remount`
     * :meth:`AdbCommands.Root`
     * :meth:`AdbCommands.Shell`
+    * :meth:`AdbCommands.ShellPool`
+    * :meth:`AdbCommands.ShellV2`
     * :meth:`AdbCommands.Stat`
+    * :meth:`AdbCommands.StreamingExec`
+    * :meth:`AdbCommands.StreamingInteractiveShell`
     * :meth:`AdbCommands.StreamingShell`
+    * :meth:`AdbCommands.StreamingShellV2`
     * :meth:`AdbCommands.Uninstall`
 
+* :func:`ShellQuote`
+
 """
 
 import io
@@ -61,6 +73,9 @@ import posixpath
 from adb import adb_protocol
 from adb import common
 from adb import filesync_protocol
+from adb import shell_pool
+from adb import shell_protocol
+from adb import usb_exceptions
 
 try:
     file_types = (file, io.IOBase)
@@ -81,6 +96,23 @@ PROTOCOL = 0x01
 DeviceIsAvailable = common.InterfaceMatcher(CLASS, SUBCLASS, PROTOCOL)
 
 
+def ShellQuote(arg):
+    """Quote an argument for the device's shell, so that the command gets it as is.
+
+    Parameters
+    ----------
+    arg : str
+        The argument, e.g. a file name
+
+    Returns
+    -------
+    str
+        ``arg`` in single quotes, inside which the shell doesn't expand anything; each ``'`` in it becomes ``'\\''``
+
+    """
+    return "'" + arg.replace("'", "'\\''") + "'"
+
+
 class AdbCommands(object):
     """Exposes adb-like methods for use.
 
@@ -90,12 +122,18 @@ class AdbCommands(object):
 
     Attributes
     ----------
-    build_props : TODO, None
-        TODO
+    banner : adb.adb_protocol.DeviceBanner, None
+        The device's state, properties, and features, from its banner
+    build_props : str, None
+        The ``str`` of the list of ``key=value`` entries in the device's banner; ``banner.properties`` has them as a
+        dict
     filesync_handler : filesync_protocol.FilesyncProtocol
         TODO
     protocol_handler : adb_protocol.AdbMessage
         TODO
+    _banner_cache : dict
+        ``_banner_cache[serial]`` is the banner of each device that has been connected to (see
+        :meth:`AdbCommands.CachedBanner`)
     _device_state : TODO, None
         TODO
     _handle : adb.common.TcpHandle, adb.common.UsbHandle, None
@@ -107,8 +145,11 @@ class AdbCommands(object):
     """
     protocol_handler = adb_protocol.AdbMessage
     filesync_handler = filesync_protocol.FilesyncProtocol
+    shell_handler = shell_protocol.ShellV2Protocol
+    _banner_cache = {}
 
     def __init__(self):
+        self.banner = None
         self.build_props = None
         self._device_state = None
         self._handle = None
@@ -235,6 +276,8 @@ class AdbCommands(object):
                     pass
 
         if self._handle:
+            # Don't wait for the reader thread's read, which fails once the handle is closed.
+            self.protocol_handler.Multiplexer(self._handle).StopReader(wait=False)
             self._handle.Close()
 
         self.__reset()
@@ -263,15 +306,58 @@ class AdbCommands(object):
 
         conn_str = self.protocol_handler.Connect(self._handle, banner=banner, **kwargs)
 
-        # Remove banner and colons after device state (state::banner)
-        parts = conn_str.split(b'::')
-        self._device_state = parts[0]
+        self.banner = adb_protocol.ParseBanner(conn_str)
+        self._device_state = self.banner.state
+        self.build_props = str(conn_str.partition(b'::')[2].split(b';'))
 
-        # Break out the build prop info
-        self.build_props = str(parts[1].split(b';'))
+        try:
+            serial = self._handle.serial_number
+        except Exception:  # pylint: disable=broad-except
+            serial = None
+        if serial:
+            self._banner_cache[serial] = self.banner
 
         return True
 
+    @classmethod
+    def CachedBanner(cls, serial):
+        """Get the banner of a device that has been connected to, without connecting to it again.
+
+        Parameters
+        ----------
+        serial : str
+            The device's serial number, or ``host:port`` for a TCP device
+
+        Returns
+        -------
+        adb.adb_protocol.DeviceBanner, None
+            The device's state, properties, and features when it was last connected to, or ``None``
+
+        """
+        if isinstance(serial, (bytes, bytearray)):
+            serial = serial.decode('utf-8')
+        return cls._banner_cache.get(serial)
+
+    def HasFeature(self, feature):
+        """Whether the device reported ``feature`` in its banner.
+
+        This is how to choose a fast path, e.g. with ``b'stat_v2'`` or ``b'sendrecv_v2'``, without probing the device.
+        The features that this package uses itself, like ``b'shell_v2'``, are negotiated with the device (see
+        :meth:`adb.adb_protocol.AdbMessage.HasFeature`).
+
+        Parameters
+        ----------
+        feature : bytes
+            A feature, e.g. ``b'apex'``
+
+        Returns
+        -------
+        bool
+            Whether the device has ``feature``
+
+        """
+        return self.banner is not None and feature in self.banner.features
+
     @classmethod
     def Devices(cls):
         """Get a generator of :py:class:`~adb.common.UsbHandle` for devices available.
@@ -284,6 +370,29 @@ class AdbCommands(object):
         """
         return common.UsbHandle.FindDevices(DeviceIsAvailable)
 
+    def ExecOut(self, command, timeout_ms=None):
+        """Run command on the device with the ``exec:`` service, returning its raw output.
+
+        Unlike ``shell:``, ``exec:`` doesn't run the command in a terminal, so binary output such as a screenshot, a
+        tarball or a protobuf dump arrives unchanged.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.ExecOut.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Command to run on the target.
+        timeout_ms : int, None
+            Maximum time to allow the command to run.
+
+        Returns
+        -------
+        bytes
+            The command's stdout
+
+        """
+        return self.protocol_handler.RawCommand(self._handle, service=b'exec', command=command, timeout_ms=timeout_ms)
+
     def GetState(self):
         """TODO
 
@@ -396,16 +505,14 @@ class AdbCommands(object):
             Expected timeout for any part of the push.
         progress_callback : TODO, None
             Callback method that accepts filename, bytes_written and total_bytes, total_bytes will be -1 for file-like
-            objects
+            objects; for a directory, the bytes are counted for the whole tree
         st_mode : TODO, None
-            Stat mode for filename
+            Stat mode for filename, or for each file in a directory
 
         """
         if isinstance(source_file, str):
             if os.path.isdir(source_file):
-                self.Shell("mkdir " + device_filename)
-                for f in os.listdir(source_file):
-                    self.Push(os.path.join(source_file, f), device_filename + '/' + f, progress_callback=progress_callback)
+                self._PushDirectory(source_file, device_filename, mtime, timeout_ms, progress_callback, st_mode)
                 return
 
             source_file = open(source_file, "rb")
@@ -418,6 +525,45 @@ class AdbCommands(object):
             self.filesync_handler.Push(connection, source_file, device_filename, mtime=int(mtime), progress_callback=progress_callback, **kwargs)
         connection.Close()
 
+    def _PushDirectory(self, source_dir, device_dir, mtime, timeout_ms, progress_callback, st_mode):
+        """Push a directory tree to the device over one ``sync:`` stream.
+
+        The device creates the directories that files are pushed to, so only the empty ones need a ``mkdir``, and they
+        all share one shell command.
+
+        .. image:: _static/adb.adb_commands.AdbCommands._PushDirectory.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands.AdbCommands._PushDirectory.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        source_dir : str
+            The local directory
+        device_dir : str
+            Where to push it on the device
+        mtime : str
+            Modification time to set on the files
+        timeout_ms : int, None
+            Expected timeout for any part of the push.
+        progress_callback : TODO, None
+            Callback method that accepts filename, bytes_written and total_bytes, for the whole tree
+        st_mode : TODO, None
+            Stat mode for the files
+
+        """
+        files, empty_dirs = filesync_protocol.WalkLocalTree(source_dir, device_dir)
+        if empty_dirs:
+            self.Shell('mkdir -p ' + ' '.join(ShellQuote(path) for path in empty_dirs), timeout_ms=timeout_ms)
+        if not files:
+            return
+
+        connection = self.protocol_handler.Open(self._handle, destination=b'sync:', timeout_ms=timeout_ms)
+        kwargs = {}
+        if st_mode is not None:
+            kwargs['st_mode'] = st_mode
+        self.filesync_handler.PushFiles(connection, files, mtime=int(mtime), progress_callback=progress_callback, **kwargs)
+        connection.Close()
+
     def Pull(self, device_filename, dest_file=None, timeout_ms=None, progress_callback=None):
         """Pull a file from the device.
 
@@ -581,6 +727,11 @@ class AdbCommands(object):
     def Shell(self, command, timeout_ms=None):
         """Run command on the device, returning the output.
 
+        If the device has the ``shell_v2`` feature, the command runs with the shell protocol v2, and its stdout and
+        stderr are returned together, in the order they were sent.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.Shell.CALL_GRAPH.svg
+
         .. image:: _static/adb.adb_commands.AdbCommands.Shell.CALLER_GRAPH.svg
 
         Parameters
@@ -596,11 +747,38 @@ class AdbCommands(object):
             TODO
 
         """
+        if self.protocol_handler.HasFeature(self._handle, b'shell_v2'):
+            return ''.join(self.StreamingShell(command, timeout_ms))
         return self.protocol_handler.Command(self._handle, service=b'shell', command=command, timeout_ms=timeout_ms)
 
+    def ShellPool(self, size=shell_pool.DEFAULT_POOL_SIZE, timeout_ms=None):
+        """Get a pool of long-lived shells, for running many short commands without opening a stream for each.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.ShellPool.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        size : int
+            The maximum number of shells
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        adb.shell_pool.ShellPool
+            The pool; close it with :meth:`adb.shell_pool.ShellPool.Close` before closing this connection
+
+        """
+        return shell_pool.ShellPool(self._handle, size, timeout_ms, self.protocol_handler)
+
     def StreamingShell(self, command, timeout_ms=None):
         """Run command on the device, yielding each line of output.
 
+        If the device has the ``shell_v2`` feature, the command runs with the shell protocol v2, and its stdout and
+        stderr are yielded in the order they were sent.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.StreamingShell.CALL_GRAPH.svg
+
         .. image:: _static/adb.adb_commands.AdbCommands.StreamingShell.CALLER_GRAPH.svg
 
         Parameters
@@ -616,8 +794,82 @@ class AdbCommands(object):
             The responses from the shell command.
 
         """
+        if self.protocol_handler.HasFeature(self._handle, b'shell_v2'):
+            return adb_protocol.DecodeChunks(chunk.data for chunk in self.StreamingShellV2(command, timeout_ms) if chunk.id != shell_protocol.ID_EXIT)
         return self.protocol_handler.StreamingCommand(self._handle, service=b'shell', command=command, timeout_ms=timeout_ms)
 
+    def ShellV2(self, command, timeout_ms=None, stdin=None):
+        """Run command on the device with the shell protocol v2, returning its stdout, stderr, and exit code.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.ShellV2.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Shell command to run
+        timeout_ms : int, None
+            Maximum time to allow the command to run.
+        stdin : bytes, None
+            If not ``None``, the command's input
+
+        Returns
+        -------
+        adb.shell_protocol.ShellV2Result
+            The command's stdout and stderr, as ``str``, and its exit code
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            The device doesn't have the ``shell_v2`` feature.
+
+        """
+        self._CheckShellV2()
+        return self.shell_handler.Command(self._handle, command, timeout_ms, stdin, self.protocol_handler)
+
+    def StreamingShellV2(self, command, timeout_ms=None, stdin=None):
+        """Run command on the device with the shell protocol v2, yielding its output as it arrives.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.StreamingShellV2.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands.AdbCommands.StreamingShellV2.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Shell command to run
+        timeout_ms : int, None
+            Maximum time to allow the command to run.
+        stdin : bytes, None
+            If not ``None``, the command's input; otherwise, its stdin is left open
+
+        Returns
+        -------
+        generator
+            :class:`adb.shell_protocol.ShellChunk` objects with data from stdout or stderr, and then the exit code
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            The device doesn't have the ``shell_v2`` feature.
+
+        """
+        self._CheckShellV2()
+        return self.shell_handler.StreamingCommand(self._handle, command, timeout_ms, stdin, self.protocol_handler)
+
+    def _CheckShellV2(self):
+        """Make sure that the device has the ``shell_v2`` feature.
+
+        .. image:: _static/adb.adb_commands.AdbCommands._CheckShellV2.CALLER_GRAPH.svg
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            The device doesn't have the ``shell_v2`` feature.
+
+        """
+        if not self.protocol_handler.HasFeature(self._handle, b'shell_v2'):
+            raise usb_exceptions.AdbCommandFailureException('The device does not support the shell protocol v2')
+
     def Logcat(self, options, timeout_ms=None):
         """Run ``shell logcat`` and stream the output to stdout.
 
@@ -664,3 +916,52 @@ class AdbCommands(object):
         conn = self._get_service_connection(b'shell:')
 
         return self.protocol_handler.InteractiveShellCommand(conn, cmd=cmd, strip_cmd=strip_cmd, delim=delim, strip_delim=strip_delim)
+
+    def StreamingExec(self, command, timeout_ms=None, copy=True):
+        """Run command on the device with the ``exec:`` service, yielding its raw output as it arrives.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.StreamingExec.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Command to run on the target.
+        timeout_ms : int, None
+            Maximum time to allow the command to run.
+        copy : bool
+            If ``False``, yield views of the receive buffer instead of ``bytes``; each one is only valid until the
+            next one is yielded, so it must be written out or copied right away
+
+        Returns
+        -------
+        generator
+            The command's stdout, as ``bytes`` or ``memoryview`` objects
+
+        """
+        return self.protocol_handler.StreamingRawCommand(self._handle, service=b'exec', command=command, timeout_ms=timeout_ms, copy=copy)
+
+    def StreamingInteractiveShell(self, cmd, strip_cmd=True, delim=None):
+        """Run a command in the currently open interactive shell, yielding its output as it arrives.
+
+        .. image:: _static/adb.adb_commands.AdbCommands.StreamingInteractiveShell.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        cmd : str, bytes
+            Command to run on the target.
+        strip_cmd : bool
+            Don't yield the echo of the command.
+        delim : str, bytes, None
+            Delimiter to look for in the output to know when to stop expecting more output (usually the shell prompt);
+            if ``None``, only one packet is read
+
+        Yields
+        ------
+        bytes
+            The stdout, one or more lines at a time, with the backspaces applied and lines ending in ``\\n``
+
+        """
+        conn = self._get_service_connection(b'shell:')
+
+        for output in self.protocol_handler.StreamingInteractiveShellCommand(conn, cmd=cmd, strip_cmd=strip_cmd, delim=delim):
+            yield output
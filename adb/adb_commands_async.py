@@ -0,0 +1,952 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An asyncio version of :mod:`adb.adb_commands`.
+
+:class:`AsyncAdbCommands` drives an :class:`adb.sansio.AdbTransport` from an asyncio event loop. One thread can
+therefore talk to many devices, and the commands sent to one device run concurrently, each on its own stream. TCP
+devices are reached with asyncio streams, and USB devices with libusb's asynchronous transfers, whose file descriptors
+are watched by the event loop (see :mod:`adb.async_io`).
+
+This module requires Python 3.6 or later.
+
+::
+
+    device = await AsyncAdbCommands().ConnectDevice(serial='192.168.0.10:5555', rsa_keys=[signer])
+    print(await device.Shell('getprop ro.product.model'))
+    async for line in device.StreamingShell('logcat -d'):
+        ...
+    await device.Close()
+
+All timeouts are in milliseconds.
+
+
+.. rubric:: Contents
+
+* :class:`AsyncAdbCommands`
+
+    * :meth:`AsyncAdbCommands._Dispatch`
+    * :meth:`AsyncAdbCommands._Fail`
+    * :meth:`AsyncAdbCommands._Open`
+    * :meth:`AsyncAdbCommands._PushDirectory`
+    * :meth:`AsyncAdbCommands._ReadLoop`
+    * :meth:`AsyncAdbCommands._ReverseCommand`
+    * :meth:`AsyncAdbCommands._Send`
+    * :meth:`AsyncAdbCommands._ServeReverse`
+    * :meth:`AsyncAdbCommands._StreamingService`
+    * :meth:`AsyncAdbCommands.Close`
+    * :meth:`AsyncAdbCommands.ConnectDevice`
+    * :meth:`AsyncAdbCommands.ExecOut`
+    * :meth:`AsyncAdbCommands.Forward`
+    * :meth:`AsyncAdbCommands.GetState`
+    * :meth:`AsyncAdbCommands.Install`
+    * :meth:`AsyncAdbCommands.List`
+    * :meth:`AsyncAdbCommands.Pull`
+    * :meth:`AsyncAdbCommands.Push`
+    * :meth:`AsyncAdbCommands.RemoveReverse`
+    * :meth:`AsyncAdbCommands.Reverse`
+    * :meth:`AsyncAdbCommands.Shell`
+    * :meth:`AsyncAdbCommands.Stat`
+    * :meth:`AsyncAdbCommands.StreamingExec`
+    * :meth:`AsyncAdbCommands.StreamingShell`
+
+"""
+
+import asyncio
+import codecs
+import io
+import os
+import posixpath
+import socket
+
+from adb import adb_commands
+from adb import adb_protocol
+from adb import async_io
+from adb import common
+from adb import filesync_protocol
+from adb import filesync_protocol_async
+from adb import forwarding
+from adb import sansio
+from adb import usb_exceptions
+
+
+class AsyncAdbCommands(object):
+    """Exposes ADB commands as coroutines, like :class:`adb.adb_commands.AdbCommands`.
+
+    Attributes
+    ----------
+    banner : adb.adb_protocol.DeviceBanner, None
+        The device's state, properties, and features, from its banner
+    build_props : str, None
+        The ``str`` of the list of ``key=value`` entries in the device's banner; ``banner.properties`` has them as a
+        dict
+    _connected : asyncio.Future, None
+        Resolved when the device accepts the connection
+    _device_state : bytes, None
+        The device's state, e.g. ``b'device'``
+    _error : Exception, None
+        The error that ended the connection
+    _forward_servers : list[adb.forwarding.ForwardServer]
+        The servers started by :meth:`AsyncAdbCommands.Forward`
+    _io : adb.async_io.TcpIO, adb.async_io.UsbIO, None
+        Sends and receives the bytes
+    _public_key_sent : asyncio.Event, None
+        Set when the device is showing the dialog to accept our public key
+    _read_task : asyncio.Task, None
+        Runs :meth:`AsyncAdbCommands._ReadLoop`
+    _reverse_tasks : set
+        The tasks that run :meth:`AsyncAdbCommands._ServeReverse`
+    _reverses : dict
+        ``_reverses[remote]`` is the local ``tcp:<port>`` for each socket on the device that
+        :meth:`AsyncAdbCommands.Reverse` forwards to the host
+    _streams : dict
+        ``_streams[local_id]`` is the :class:`adb.async_io.AsyncConnection` for each open stream
+    _timeout_ms : int, None
+        The default timeout
+    _transport : adb.sansio.AdbTransport, None
+        The state of the connection
+
+    """
+    def __init__(self):
+        self.banner = None
+        self.build_props = None
+        self._connected = None
+        self._device_state = None
+        self._error = None
+        self._forward_servers = []
+        self._io = None
+        self._public_key_sent = None
+        self._read_task = None
+        self._reverse_tasks = set()
+        self._reverses = {}
+        self._streams = {}
+        self._timeout_ms = None
+        self._transport = None
+
+    async def ConnectDevice(self, port_path=None, serial=None, default_timeout_ms=None, banner=None, rsa_keys=None, auth_timeout_ms=100, handle=None):
+        """Connect to a device over USB or TCP, like :meth:`adb.adb_commands.AdbCommands.ConnectDevice`.
+
+        Parameters
+        ----------
+        port_path : list, None
+            The USB port path of the device
+        serial : str, bytes, None
+            The serial number of the device. If it is a TCP address ``host:port``, a TCP connection is used.
+        default_timeout_ms : int, None
+            The default timeout
+        banner : bytes, None
+            A string to send as a host identifier; by default, the host name
+        rsa_keys : list[adb.adb_protocol.AuthSigner], None
+            Signers to authenticate with (see :meth:`adb.adb_protocol.AdbMessage.Connect`)
+        auth_timeout_ms : int
+            How long to wait for the user to accept our public key on the device
+        handle : adb.common.UsbHandle, None
+            An open USB handle to use instead of looking for the device
+
+        Returns
+        -------
+        self : AsyncAdbCommands
+            This object, once it is connected
+
+        Raises
+        ------
+        adb.usb_exceptions.DeviceAuthError
+            The device didn't accept our keys.
+        asyncio.TimeoutError
+            The device didn't answer in time.
+
+        """
+        if isinstance(serial, (bytes, bytearray)):
+            serial = serial.decode('utf-8')
+
+        if handle is not None:
+            self._io = async_io.UsbIO(handle)
+        elif serial and ':' in serial:
+            self._io = await async_io.TcpIO.Open(serial, default_timeout_ms)
+        else:
+            handle = common.UsbHandle.FindAndOpen(adb_commands.DeviceIsAvailable, port_path=port_path, serial=serial, timeout_ms=default_timeout_ms)
+            self._io = async_io.UsbIO(handle)
+
+        if not serial:
+            try:
+                serial = handle.serial_number
+            except Exception:  # pylint: disable=broad-except
+                serial = None
+
+        # Start with the key that the device accepted last time; finding it may read the file where it was saved.
+        preferred_key = await async_io.InExecutor(adb_protocol.AdbMessage.AcceptedKey, serial, rsa_keys or [])
+
+        loop = asyncio.get_event_loop()
+        self._connected = loop.create_future()
+        self._public_key_sent = asyncio.Event()
+        self._timeout_ms = default_timeout_ms
+        self._transport = sansio.AdbTransport(banner or socket.gethostname().encode(), rsa_keys, auto_ack=False, accept_opens=True,
+                                              preferred_key=preferred_key)
+        self._read_task = loop.create_task(self._ReadLoop())
+
+        self._transport.Connect()
+        await self._Send()
+
+        key_sent = loop.create_task(self._public_key_sent.wait())
+        try:
+            done, _ = await asyncio.wait([self._connected, key_sent], timeout=async_io.Seconds(default_timeout_ms or common.DEFAULT_TIMEOUT_MS),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if self._connected not in done:
+                if not self._public_key_sent.is_set():
+                    raise asyncio.TimeoutError()
+                # The device is showing a dialog; give the user some time to accept our key.
+                try:
+                    await asyncio.wait_for(asyncio.shield(self._connected), async_io.Seconds(auth_timeout_ms))
+                except asyncio.TimeoutError:
+                    raise usb_exceptions.DeviceAuthError('Accept auth key on device, then retry.')
+            banner = self._connected.result()
+        except BaseException:
+            await self.Close()
+            raise
+        finally:
+            key_sent.cancel()
+
+        if self._transport.accepted_key is not None:
+            await async_io.InExecutor(adb_protocol.AdbMessage.RememberAcceptedKey, serial, self._transport.accepted_key)
+
+        self.banner = adb_protocol.ParseBanner(banner)
+        self._device_state = self.banner.state
+        self.build_props = str(banner.partition(b'::')[2].split(b';'))
+        if serial:
+            adb_commands.AdbCommands._banner_cache[serial] = self.banner  # pylint: disable=protected-access
+        return self
+
+    async def Close(self):
+        """Close the connection to the device, and stop forwarding ports."""
+        for server in self._forward_servers:
+            await server.Close()
+        for task in self._reverse_tasks:
+            task.cancel()
+        if self._reverse_tasks:
+            await asyncio.wait(self._reverse_tasks)
+        if self._read_task is not None:
+            self._read_task.cancel()
+            try:
+                await self._read_task
+            except asyncio.CancelledError:
+                pass
+        if self._io is not None:
+            await self._io.Close()
+        self.__init__()
+
+    async def Forward(self, local, remote, timeout_ms=None):
+        """Forward a local TCP port to a service on the device, like ``adb forward``.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Forward.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        local : str, bytes
+            The local port, as ``tcp:<port>``; ``tcp:0`` picks a free port
+        remote : str, bytes
+            The service on the device, e.g. ``tcp:8080``, ``localabstract:<name>``, or ``jdwp:<pid>``
+        timeout_ms : int, None
+            Timeout for the device to accept each connection
+
+        Returns
+        -------
+        adb.forwarding.ForwardServer
+            The server; its ``port`` attribute is the local port
+
+        Raises
+        ------
+        ValueError
+            ``local`` isn't ``tcp:<port>``.
+
+        """
+        server = forwarding.ForwardServer(self, remote, timeout_ms)
+        await server.Start(forwarding._ParseTcpSpec(local))  # pylint: disable=protected-access
+        self._forward_servers.append(server)
+        return server
+
+    async def Reverse(self, remote, local, timeout_ms=None):
+        """Forward a socket on the device to a local TCP port, like ``adb reverse``.
+
+        Each connection to ``remote`` on the device becomes a stream that the device opens, which is copied to a new
+        connection to ``local``.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Reverse.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        remote : str, bytes
+            The socket on the device, e.g. ``tcp:8080``, ``tcp:0`` to pick a free port, or ``localabstract:<name>``
+        local : str, bytes
+            The local port, as ``tcp:<port>``
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        int, None
+            The port that the device picked, if ``remote`` is ``tcp:0``
+
+        Raises
+        ------
+        ValueError
+            ``local`` isn't ``tcp:<port>``.
+        adb.usb_exceptions.AdbCommandFailureException
+            The device couldn't listen on ``remote``.
+
+        """
+        if not isinstance(remote, bytes):
+            remote = remote.encode('utf8')
+        if not isinstance(local, bytes):
+            local = local.encode('utf8')
+        forwarding._ParseTcpSpec(local)  # pylint: disable=protected-access
+
+        previous = self._reverses.get(remote)
+        # The device may open a stream as soon as it listens, before its reply arrives.
+        self._reverses[remote] = local
+        try:
+            port = await self._ReverseCommand(b'forward:' + remote + b';' + local, timeout_ms)
+        except BaseException:
+            if previous is None:
+                self._reverses.pop(remote, None)
+            else:
+                self._reverses[remote] = previous
+            raise
+
+        return int(port) if port else None
+
+    async def RemoveReverse(self, remote=None, timeout_ms=None):
+        """Stop forwarding a socket on the device, like ``adb reverse --remove``.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.RemoveReverse.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        remote : str, bytes, None
+            The socket given to :meth:`AsyncAdbCommands.Reverse`; if ``None``, stop forwarding all of them
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            ``remote`` wasn't forwarded.
+
+        """
+        if remote is None:
+            await self._ReverseCommand(b'killforward-all', timeout_ms)
+            self._reverses.clear()
+            return
+
+        if not isinstance(remote, bytes):
+            remote = remote.encode('utf8')
+        await self._ReverseCommand(b'killforward:' + remote, timeout_ms)
+        self._reverses.pop(remote, None)
+
+    def GetState(self):
+        """Get the device's state.
+
+        Returns
+        -------
+        bytes, None
+            The state from the device's banner, e.g. ``b'device'``
+
+        """
+        return self._device_state
+
+    async def Shell(self, command, timeout_ms=None):
+        """Run a command on the device, returning the output.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Shell.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Shell command to run
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        str
+            The output
+
+        """
+        return ''.join([output async for output in self.StreamingShell(command, timeout_ms)])
+
+    async def StreamingShell(self, command, timeout_ms=None):
+        """Run a command on the device, yielding its output as it arrives.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.StreamingShell.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.StreamingShell.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Shell command to run
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Yields
+        ------
+        str
+            The output, in the chunks that the device sent; a character that is split between two chunks is yielded
+            with the second one
+
+        """
+        decoder = codecs.getincrementaldecoder('utf8')()
+        async for data in self._StreamingService(b'shell:', command, timeout_ms):
+            text = decoder.decode(data)
+            if text:
+                yield text
+
+        text = decoder.decode(b'', True)
+        if text:
+            yield text
+
+    async def ExecOut(self, command, timeout_ms=None):
+        """Run a command on the device with the ``exec:`` service, returning its raw output.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.ExecOut.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Command to run
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        bytes
+            The command's stdout
+
+        """
+        return b''.join([data async for data in self.StreamingExec(command, timeout_ms)])
+
+    async def StreamingExec(self, command, timeout_ms=None):
+        """Run a command on the device with the ``exec:`` service, yielding its raw output as it arrives.
+
+        Unlike ``shell:``, ``exec:`` doesn't run the command in a terminal, so binary output arrives unchanged.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.StreamingExec.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.StreamingExec.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            Command to run
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Yields
+        ------
+        bytes
+            The command's stdout, in the chunks that the device sent
+
+        """
+        async for data in self._StreamingService(b'exec:', command, timeout_ms):
+            yield data
+
+    async def _StreamingService(self, service, command, timeout_ms=None):
+        """Open a stream to ``service`` + ``command`` and yield what the device sends until it closes the stream.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._StreamingService.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._StreamingService.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        service : bytes
+            The service, e.g. ``b'shell:'``
+        command : str, bytes
+            The command
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Yields
+        ------
+        bytes
+            The data
+
+        """
+        if not isinstance(command, bytes):
+            command = command.encode('utf8')
+
+        connection = await self._Open(service + command, timeout_ms)
+        try:
+            while True:
+                data = await connection.Read()
+                if data is None:
+                    return
+                yield data
+        finally:
+            await connection.Close()
+
+    async def Stat(self, device_filename, timeout_ms=None):
+        """Get a file's ``stat()`` information.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Stat.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Stat.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        device_filename : str
+            The file on the device
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        mode : int
+            The mode of the file
+        size : int
+            The size of the file
+        mtime : int
+            The time of last modification for the file
+
+        """
+        connection = await self._Open(b'sync:', timeout_ms)
+        try:
+            return await filesync_protocol_async.AsyncFilesyncProtocol.Stat(connection, device_filename)
+        finally:
+            await connection.Close()
+
+    async def List(self, device_path, timeout_ms=None):
+        """Get a directory listing.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.List.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        device_path : str
+            The directory on the device
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        files : list[adb.filesync_protocol.DeviceFile]
+            The files in the directory
+
+        """
+        connection = await self._Open(b'sync:', timeout_ms)
+        try:
+            return await filesync_protocol_async.AsyncFilesyncProtocol.List(connection, device_path)
+        finally:
+            await connection.Close()
+
+    async def Pull(self, device_filename, dest_file=None, timeout_ms=None, progress_callback=None):
+        """Pull a file from the device.
+
+        ``dest_file`` is opened, written and closed in the event loop's default executor, so a slow disk doesn't block
+        the loop.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Pull.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        device_filename : str
+            The file on the device
+        dest_file : str, io.IOBase, None
+            If set, a filename or writable file-like object
+        timeout_ms : int, None
+            Timeout for each packet
+        progress_callback : function, None
+            Callback method that accepts ``filename``, ``bytes_written``, and ``total_bytes``
+
+        Returns
+        -------
+        bytes, bool
+            The file's contents if ``dest_file`` is not set; otherwise, ``True``
+
+        Raises
+        ------
+        adb.filesync_protocol.PullFailedError
+            The device couldn't send the file.
+        ValueError
+            ``dest_file`` is of unknown type.
+
+        """
+        if not dest_file:
+            dest_file = io.BytesIO()
+        elif isinstance(dest_file, str):
+            dest_file = await async_io.InExecutor(open, dest_file, 'wb')
+        elif not isinstance(dest_file, io.IOBase):
+            raise ValueError('dest_file is of unknown type')
+
+        connection = await self._Open(b'sync:', timeout_ms)
+        try:
+            await filesync_protocol_async.AsyncFilesyncProtocol.Pull(connection, device_filename, dest_file, progress_callback)
+        finally:
+            await connection.Close()
+
+        if isinstance(dest_file, io.BytesIO):
+            return dest_file.getvalue()
+        await async_io.InExecutor(dest_file.close)
+        return True
+
+    async def Push(self, source_file, device_filename, mtime=0, timeout_ms=None, progress_callback=None, st_mode=filesync_protocol.DEFAULT_PUSH_MODE):
+        """Push a file or directory to the device.
+
+        Local files are opened and read in the event loop's default executor, so a slow disk doesn't block the loop.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Push.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Push.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        source_file : str, io.IOBase
+            A filename, a directory, or a readable file-like object
+        device_filename : str
+            The destination on the device
+        mtime : int
+            The modification time to set; by default, now
+        timeout_ms : int, None
+            Timeout for each packet
+        progress_callback : function, None
+            Callback method that accepts ``filename``, ``bytes_written``, and ``total_bytes``; ``total_bytes`` is -1
+            for file-like objects
+        st_mode : int
+            The mode of the file on the device
+
+        Raises
+        ------
+        adb.filesync_protocol.PushFailedError
+            The device couldn't write the file.
+
+        """
+        if isinstance(source_file, str):
+            if await async_io.InExecutor(os.path.isdir, source_file):
+                await self._PushDirectory(source_file, device_filename, mtime, timeout_ms, progress_callback, st_mode)
+                return
+
+            total_bytes = await async_io.InExecutor(os.path.getsize, source_file)
+            source_file = await async_io.InExecutor(open, source_file, 'rb')
+        else:
+            total_bytes = -1
+
+        with source_file:
+            connection = await self._Open(b'sync:', timeout_ms)
+            try:
+                await filesync_protocol_async.AsyncFilesyncProtocol.Push(connection, source_file, device_filename, st_mode, mtime, progress_callback, total_bytes)
+            finally:
+                await connection.Close()
+
+    async def _PushDirectory(self, source_dir, device_dir, mtime, timeout_ms, progress_callback, st_mode):
+        """Push a directory tree over one ``sync:`` stream, like :meth:`adb.adb_commands.AdbCommands.Push`.
+
+        The requests for each file are sent without waiting for the device to confirm the previous files, up to
+        :const:`adb.filesync_protocol.MAX_PENDING_PUSHES` files ahead. The device creates the directories that files
+        are pushed to, so only the empty ones need a ``mkdir``.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._PushDirectory.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._PushDirectory.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        source_dir : str
+            The local directory
+        device_dir : str
+            Where to push it on the device
+        mtime : int
+            The modification time to set; by default, now
+        timeout_ms : int, None
+            Timeout for each packet
+        progress_callback : function, None
+            Callback method that accepts ``filename``, ``bytes_written``, and ``total_bytes``, for the whole tree
+        st_mode : int
+            The mode of the files on the device
+
+        Raises
+        ------
+        adb.filesync_protocol.PushFailedError
+            The device couldn't write a file.
+
+        """
+        files, empty_dirs = await async_io.InExecutor(filesync_protocol.WalkLocalTree, source_dir, device_dir)
+        if empty_dirs:
+            await self.Shell('mkdir -p ' + ' '.join(adb_commands.ShellQuote(path) for path in empty_dirs), timeout_ms)
+        if not files:
+            return
+
+        connection = await self._Open(b'sync:', timeout_ms)
+        try:
+            await filesync_protocol_async.AsyncFilesyncProtocol.PushFiles(connection, files, st_mode, mtime, progress_callback)
+        finally:
+            await connection.Close()
+
+    async def Install(self, apk_path, destination_dir='', replace_existing=True, grant_permissions=False, timeout_ms=None, transfer_progress_callback=None):
+        """Install an apk on the device, like :meth:`adb.adb_commands.AdbCommands.Install`.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands.Install.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        apk_path : str
+            Local path to the apk
+        destination_dir : str
+            Where to push the apk; by default, ``/data/local/tmp/``
+        replace_existing : bool
+            Whether to replace an existing application
+        grant_permissions : bool
+            If ``True``, grant all permissions to the app specified in its manifest
+        timeout_ms : int, None
+            Timeout for each packet
+        transfer_progress_callback : function, None
+            Callback method that accepts ``filename``, ``bytes_written``, and ``total_bytes`` of the apk's transfer
+
+        Returns
+        -------
+        str
+            The ``pm install`` output
+
+        """
+        destination_path = posixpath.join(destination_dir or '/data/local/tmp/', os.path.basename(apk_path))
+        await self.Push(apk_path, destination_path, timeout_ms=timeout_ms, progress_callback=transfer_progress_callback)
+
+        cmd = ['pm install']
+        if grant_permissions:
+            cmd.append('-g')
+        if replace_existing:
+            cmd.append('-r')
+        cmd.append('"{}"'.format(destination_path))
+
+        try:
+            return await self.Shell(' '.join(cmd), timeout_ms)
+        finally:
+            await self.Shell('rm ' + destination_path, timeout_ms)
+
+    async def _Open(self, destination, timeout_ms=None):
+        """Open a stream to a service on the device.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._Open.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._Open.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        destination : bytes
+            The service, e.g. ``b'sync:'``
+        timeout_ms : int, None
+            Timeout for each packet; by default, the one given to :meth:`AsyncAdbCommands.ConnectDevice`
+
+        Returns
+        -------
+        adb.async_io.AsyncConnection
+            The stream
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            The device refused to open the stream.
+
+        """
+        if self._error is not None:
+            raise self._error
+
+        timeout_ms = timeout_ms or self._timeout_ms
+        local_id = self._transport.Open(destination)
+        connection = self._streams[local_id] = async_io.AsyncConnection(self, local_id, timeout_ms)
+        await self._Send(timeout_ms)
+        try:
+            await asyncio.wait_for(asyncio.shield(connection.opened), async_io.Seconds(timeout_ms))
+        except BaseException:
+            await connection.Close()
+            raise
+        return connection
+
+    async def _ReverseCommand(self, command, timeout_ms=None):
+        """Send a command to the device's ``reverse:`` service.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._ReverseCommand.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._ReverseCommand.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : bytes
+            The command, e.g. ``b'killforward-all'``
+        timeout_ms : int, None
+            Timeout for each packet
+
+        Returns
+        -------
+        bytes
+            What the device sent after ``OKAY``, e.g. the port that it picked
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The device's reply is neither ``OKAY`` nor ``FAIL``.
+        adb.usb_exceptions.AdbCommandFailureException
+            The device replied with ``FAIL``.
+
+        """
+        response = b''.join([data async for data in self._StreamingService(b'reverse:', command, timeout_ms)])
+        status, length, message = response[:4], response[4:8], response[8:]
+        if length:
+            message = message[:int(length, 16)]
+
+        if status == b'FAIL':
+            raise usb_exceptions.AdbCommandFailureException('reverse:%s failed: %s' % (command.decode('utf8'), message.decode('utf8', 'replace')))
+        if status != b'OKAY':
+            raise adb_protocol.InvalidResponseError('Unexpected reply to reverse:%s: %r' % (command.decode('utf8'), response))
+        return message
+
+    async def _Send(self, timeout_ms=None):
+        """Send the packets that the transport has queued.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._Send.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        timeout_ms : int, None
+            Timeout for the write; by default, the one given to :meth:`AsyncAdbCommands.ConnectDevice`
+
+        """
+        data = self._transport.DataToSend()
+        if data:
+            await self._io.Write(data, timeout_ms or self._timeout_ms)
+
+    async def _ReadLoop(self):
+        """Feed the received bytes to the transport until the connection fails.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._ReadLoop.CALL_GRAPH.svg
+
+        """
+        try:
+            while True:
+                data = await self._io.Read()
+                for event in self._transport.ReceiveData(data):
+                    self._Dispatch(event)
+                await self._Send()
+        except Exception as e:  # pylint: disable=broad-except
+            # Before Python 3.8, ``asyncio.CancelledError`` is an ``Exception``; cancelling isn't a failure.
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._Fail(e)
+
+    def _Dispatch(self, event):
+        """Pass a transport event to the connection or the stream that waits for it.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._Dispatch.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        event : tuple
+            An event from :meth:`adb.sansio.AdbTransport.ReceiveData`
+
+        """
+        if isinstance(event, sansio.Connected):
+            if not self._connected.done():
+                self._connected.set_result(event.banner)
+            return
+
+        if isinstance(event, sansio.PublicKeySent):
+            self._public_key_sent.set()
+            return
+
+        if isinstance(event, sansio.StreamRequested):
+            # Only streams to the ports given to ``Reverse`` are accepted.
+            if event.destination in self._reverses.values():
+                task = asyncio.ensure_future(self._ServeReverse(event.remote_id, event.destination))
+                self._reverse_tasks.add(task)
+                task.add_done_callback(self._reverse_tasks.discard)
+            else:
+                self._transport.Reject(event.remote_id)
+            return
+
+        connection = self._streams.get(event.local_id)
+        if connection is None:
+            return
+
+        if isinstance(event, sansio.StreamOpened):
+            connection.opened.set_result(True)
+        elif isinstance(event, sansio.StreamData):
+            connection.received.put_nowait(event.data)
+        elif isinstance(event, sansio.StreamWritable):
+            connection.writable.set()
+        else:
+            del self._streams[event.local_id]
+            connection.closed = True
+            connection.writable.set()
+            if isinstance(event, sansio.StreamRejected):
+                connection.opened.set_exception(usb_exceptions.AdbCommandFailureException('The device refused to open stream %d' % event.local_id))
+            else:
+                connection.received.put_nowait(None)
+
+    async def _ServeReverse(self, remote_id, local):
+        """Connect a stream that the device opened to a local port, and copy the data both ways.
+
+        The stream is only accepted once the local port accepts the connection.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._ServeReverse.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._ServeReverse.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream
+        local : bytes
+            The local port, as ``tcp:<port>``
+
+        """
+        try:
+            reader, writer = await asyncio.open_connection('127.0.0.1', forwarding._ParseTcpSpec(local))  # pylint: disable=protected-access
+        except OSError:
+            self._transport.Reject(remote_id)
+            await self._Send()
+            return
+
+        try:
+            local_id = self._transport.Accept(remote_id)
+        except KeyError:
+            # The device gave up, or the connection failed.
+            writer.close()
+            return
+
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = self._streams[local_id] = async_io.AsyncConnection(self, local_id, None)
+        connection.opened.set_result(True)
+        await self._Send()
+        await forwarding._Pipe(connection, reader, writer)  # pylint: disable=protected-access
+
+    def _Fail(self, error):
+        """Fail the connection and every stream with ``error``.
+
+        .. image:: _static/adb.adb_commands_async.AsyncAdbCommands._Fail.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        error : Exception
+            Why the connection failed
+
+        """
+        self._error = error
+        if not self._connected.done():
+            self._connected.set_exception(error)
+
+        for connection in self._streams.values():
+            connection.closed = True
+            connection.writable.set()
+            if not connection.opened.done():
+                connection.opened.set_exception(error)
+            connection.received.put_nowait(None)
+        self._streams = {}
@@ -35,23 +35,15 @@ import time
 
 from adb import adb_commands
 from adb import common_cli
+from adb import sign_auto
 
 try:
-    from adb import sign_cryptography
+    # Load each key with the fastest signer backend that is installed; this only imports that one.
+    sign_auto._LoadBackend()  # pylint: disable=protected-access
 
-    rsa_signer = sign_cryptography.CryptographySigner
+    rsa_signer = sign_auto.GetSigner
 except ImportError:
-    try:
-        from adb import sign_pythonrsa
-
-        rsa_signer = sign_pythonrsa.PythonRSASigner.FromRSAKeyPath
-    except ImportError:
-        try:
-            from adb import sign_pycryptodome
-
-            rsa_signer = sign_pycryptodome.PycryptodomeAuthSigner
-        except ImportError:
-            rsa_signer = None
+    rsa_signer = None
 
 
 def Devices(args):
@@ -17,30 +17,80 @@
 Implements the ADB protocol as seen in android's adb/adbd binaries, but only the
 host side.
 
+The protocol's state (the handshake, stream ids, acks and flow control) is kept by an
+:class:`adb.sansio.AdbTransport`; :meth:`AdbMessage.Connect` and :class:`_StreamMultiplexer` do the blocking I/O for
+it.
+
 
 .. rubric:: Contents
 
 * :class:`_AdbConnection`
 
-    * :meth:`_AdbConnection._Send`
+    * :meth:`_AdbConnection._ReadUntil`
     * :meth:`_AdbConnection.Close`
     * :meth:`_AdbConnection.Okay`
     * :meth:`_AdbConnection.ReadUntil`
     * :meth:`_AdbConnection.ReadUntilClose`
+    * :meth:`_AdbConnection.ReadUntilView`
+    * :meth:`_AdbConnection.send_window`
     * :meth:`_AdbConnection.Write`
+    * :meth:`_AdbConnection.WriteFile`
+
+* :func:`_BulkWriteV`
+* :class:`_FilePayload`
+* :func:`_HostBanner`
+* :func:`_KeyFingerprint`
+* :func:`_NegotiatedInfo`
+* :func:`_PartialDelimiter`
+* :class:`_StreamMultiplexer`
+
+    * :meth:`_StreamMultiplexer._AckLength`
+    * :meth:`_StreamMultiplexer._Fail`
+    * :meth:`_StreamMultiplexer._HandlePacket`
+    * :meth:`_StreamMultiplexer._ReaderLoop`
+    * :meth:`_StreamMultiplexer._SendPackets`
+    * :meth:`_StreamMultiplexer._Wait`
+    * :meth:`_StreamMultiplexer._WaitUntilWritable`
+    * :meth:`_StreamMultiplexer.Acknowledge`
+    * :meth:`_StreamMultiplexer.Close`
+    * :meth:`_StreamMultiplexer.Open`
+    * :meth:`_StreamMultiplexer.Read`
+    * :meth:`_StreamMultiplexer.StartReader`
+    * :meth:`_StreamMultiplexer.StopReader`
+    * :meth:`_StreamMultiplexer.Unregister`
+    * :meth:`_StreamMultiplexer.Write`
 
 * :class:`AdbMessage`
 
     * :meth:`AdbMessage.CalculateChecksum`
+    * :meth:`AdbMessage._AcceptedKeys`
+    * :meth:`AdbMessage._InteractiveShellChunks`
+    * :meth:`AdbMessage._ReceivePacket`
+    * :meth:`AdbMessage._SendPackets`
+    * :meth:`AdbMessage.AcceptedKey`
+    * :meth:`AdbMessage.Banner`
     * :meth:`AdbMessage.checksum`
     * :meth:`AdbMessage.Command`
     * :meth:`AdbMessage.Connect`
+    * :meth:`AdbMessage.DelayedAck`
+    * :meth:`AdbMessage.HasFeature`
     * :meth:`AdbMessage.InteractiveShellCommand`
+    * :meth:`AdbMessage.MaxData`
+    * :meth:`AdbMessage.Multiplexer`
     * :meth:`AdbMessage.Open`
+    * :meth:`AdbMessage.data`
     * :meth:`AdbMessage.Pack`
+    * :meth:`AdbMessage.PackInto`
+    * :meth:`AdbMessage.RawCommand`
     * :meth:`AdbMessage.Read`
+    * :meth:`AdbMessage.ReadHeader`
+    * :meth:`AdbMessage.ReadPayload`
+    * :meth:`AdbMessage.RememberAcceptedKey`
     * :meth:`AdbMessage.Send`
+    * :meth:`AdbMessage.SkipsChecksum`
     * :meth:`AdbMessage.StreamingCommand`
+    * :meth:`AdbMessage.StreamingInteractiveShellCommand`
+    * :meth:`AdbMessage.StreamingRawCommand`
     * :meth:`AdbMessage.Unpack`
 
 * :class:`AuthSigner`
@@ -48,26 +98,61 @@ host side.
     * :meth:`AuthSigner.GetPublicKey`
     * :meth:`AuthSigner.Sign`
 
+* :func:`DecodeChunks`
+* :class:`DeviceBanner`
 * :func:`find_backspace_runs`
 * :class:`InterleavedDataError`
 * :class:`InvalidChecksumError`
 * :class:`InvalidCommandError`
 * :class:`InvalidResponseError`
 * :func:`MakeWireIDs`
+* :func:`ParseBanner`
+* :func:`SplitPackets`
 
 """
 
+import codecs
+import collections
+import hashlib
+import io
+import json
+import os
 import struct
+import tempfile
+import threading
 import time
-from io import BytesIO
+import weakref
+from adb import checksum
+from adb import terminal
 from adb import usb_exceptions
 
 
-#: Maximum amount of data in an ADB packet.
+#: Maximum amount of data in an ADB packet, used when the device doesn't report a bigger size.
 MAX_ADB_DATA = 4096
 
+#: Maximum amount of data in an ADB packet that we offer when connecting; the device may lower it.
+HOST_MAX_ADB_DATA = 1024 * 1024
+
 #: ADB protocol version.
-VERSION = 0x01000000
+VERSION = 0x01000001
+
+#: The first ADB protocol version without checksums; they are sent as 0 and not checked.
+VERSION_SKIP_CHECKSUM = 0x01000001
+
+#: The features that we offer when connecting; those that the device also reports are used.
+HOST_FEATURES = (b'delayed_ack', b'shell_v2')
+
+#: With the ``delayed_ack`` feature, how many bytes the device can send on a stream before we ack them, unless the
+#: stream asks for another window (see :meth:`adb.sansio.AdbTransport.Open`).
+DELAYED_ACK_WINDOW = 32 * 1024 * 1024
+
+#: How many bytes of data a stream of the blocking API can hold before it has been read, counting what the device can
+#: still send without waiting for an ack; with the ``delayed_ack`` feature, it is also the window that the streams
+#: advertise (see :meth:`_StreamMultiplexer.StartReader`).
+READER_QUEUE_BYTES = 4 * 1024 * 1024
+
+#: The payload of ``OKAY`` packets with the ``delayed_ack`` feature, and of the device's ``OKAY`` for an ``OPEN``
+_UINT32 = struct.Struct(b'<I')
 
 #: AUTH constants for arg0.
 AUTH_TOKEN = 1
@@ -112,45 +197,76 @@ class InvalidChecksumError(Exception):
 class InterleavedDataError(Exception):
     """We only support command sent serially.
 
+    No longer raised, since streams are multiplexed (see :class:`_StreamMultiplexer`).
+
     .. image:: _static/adb.adb_protocol.InterleavedDataError.CALL_GRAPH.svg
 
     """
 
 
+def DecodeChunks(chunks, encoding='utf8'):
+    """Decode a stream of bytes as it arrives, even if characters are split between chunks.
+
+    .. image:: _static/adb.adb_protocol.DecodeChunks.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    chunks : iterable
+        The stream, as ``bytes`` or ``memoryview`` objects
+    encoding : str
+        The encoding
+
+    Yields
+    ------
+    str
+        The text; a character that is split between chunks is yielded with the chunk that ends it
+
+    Raises
+    ------
+    UnicodeDecodeError
+        The stream isn't valid in ``encoding``, e.g. it ends in the middle of a character.
+
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for data in chunks:
+        text = decoder.decode(data)
+        if text:
+            yield text
+
+    text = decoder.decode(b'', True)
+    if text:
+        yield text
+
+
 def find_backspace_runs(stdout_bytes, start_pos):
-    """TODO
+    """Find the first run of backspaces in the output of a terminal.
 
-    .. image:: _static/adb.adb_protocol.find_backspace_runs.CALLER_GRAPH.svg
+    .. seealso:: :class:`adb.terminal.TerminalOutputCleaner`, which applies the backspaces as the output arrives
 
     Parameters
     ----------
-    stdout_bytes : TODO
-        TODO
-    start_pos : TODO
-        TODO
+    stdout_bytes : bytes
+        The output
+    start_pos : int
+        Where to start looking
 
     Returns
     -------
     int
-        The index/position of the first backspace.
+        The index/position of the first backspace, or -1 if there are none.
     num_backspaces : int
-        TODO
+        The number of backspaces in the run
 
     """
-    first_backspace_pos = stdout_bytes[start_pos:].find(b'\x08')
+    first_backspace_pos = stdout_bytes.find(b'\x08', start_pos)
     if first_backspace_pos == -1:
         return -1, 0
 
-    end_backspace_pos = (start_pos + first_backspace_pos) + 1
-    while True:
-        if chr(stdout_bytes[end_backspace_pos]) == '\b':
-            end_backspace_pos += 1
-        else:
-            break
-
-    num_backspaces = end_backspace_pos - (start_pos + first_backspace_pos)
+    end_backspace_pos = first_backspace_pos + 1
+    while stdout_bytes[end_backspace_pos:end_backspace_pos + 1] == b'\x08':
+        end_backspace_pos += 1
 
-    return (start_pos + first_backspace_pos), num_backspaces
+    return first_backspace_pos, end_backspace_pos - first_backspace_pos
 
 
 def MakeWireIDs(ids):
@@ -174,6 +290,32 @@ def MakeWireIDs(ids):
     return id_to_wire, wire_to_id
 
 
+def SplitPackets(data):
+    """Split whole ADB packets into their headers and payloads, e.g. to send them in separate USB transfers.
+
+    .. image:: _static/adb.adb_protocol.SplitPackets.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    data : bytes
+        Whole ADB packets, e.g. from :meth:`adb.sansio.AdbTransport.DataToSend`
+
+    Yields
+    ------
+    header : bytes
+        A packet's header
+    payload : bytes
+        Its payload, which may be empty
+
+    """
+    header_size = AdbMessage.header_struct.size
+    start = 0
+    while start < len(data):
+        length = AdbMessage.header_struct.unpack_from(data, start)[3]
+        yield data[start:start + header_size], data[start + header_size:start + header_size + length]
+        start += header_size + length
+
+
 class AuthSigner(object):
     """Signer for use with authenticated ADB, introduced in 4.4.x/KitKat."""
 
@@ -205,325 +347,1240 @@ class AuthSigner(object):
         raise NotImplementedError()
 
 
-class _AdbConnection(object):
-    """ADB Connection.
+#: The banner of a device (see :func:`ParseBanner`): its state, e.g. ``b'device'`` or ``b'recovery'``; a dict of its
+#: properties, e.g. ``b'ro.product.model'``; and the frozenset of its features, e.g. ``b'shell_v2'`` or ``b'stat_v2'``
+DeviceBanner = collections.namedtuple('DeviceBanner', ['state', 'properties', 'features'])
+
+#: What was negotiated with the device by :meth:`AdbMessage.Connect`; ``features`` are those that both sides have,
+#: while ``banner.features`` are all those of the device
+_TransportInfo = collections.namedtuple('_TransportInfo', ['version', 'max_data', 'features', 'banner'])
+
+#: What we assume about a transport before :meth:`AdbMessage.Connect` has negotiated with the device
+_DEFAULT_TRANSPORT_INFO = _TransportInfo(version=0x01000000, max_data=MAX_ADB_DATA, features=frozenset(),
+                                         banner=DeviceBanner(b'', {}, frozenset()))
 
-    .. image:: _static/adb.adb_protocol._AdbConnection.__init__.CALLER_GRAPH.svg
+
+def ParseBanner(banner):
+    """Parse the banner of a device, i.e., the payload of its ``CNXN`` message.
+
+    The banner looks like ``device::ro.product.name=x;ro.product.model=y;ro.product.device=z;features=shell_v2,cmd``.
+
+    .. image:: _static/adb.adb_protocol.ParseBanner.CALLER_GRAPH.svg
 
     Parameters
     ----------
-    usb : adb.common.UsbHandle
-        TODO
-    local_id : TODO
-        TODO
-    remote_id : TODO
-        TODO
-    timeout_ms : int
-        Timeout in milliseconds for USB packets.
+    banner : bytes
+        The payload of the ``CNXN`` message
 
-    Attributes
-    ----------
-    local_id : TODO
-        The ID for the sender
-    remote_id : TODO
-        The ID for the recipient
-    timeout_ms : int
-        Timeout in milliseconds for USB packets.
-    usb : adb.common.UsbHandle
-        TODO
+    Returns
+    -------
+    DeviceBanner
+        The device's state, its properties, and its features
 
     """
-    def __init__(self, usb, local_id, remote_id, timeout_ms):
-        self.usb = usb
-        self.local_id = local_id
-        self.remote_id = remote_id
-        self.timeout_ms = timeout_ms
+    state, _, rest = bytes(banner).rstrip(b'\0').partition(b'::')
+    properties = {}
+    features = frozenset()
+    for prop in rest.split(b';'):
+        key, _, value = prop.partition(b'=')
+        if key == b'features':
+            features = frozenset(feature for feature in value.split(b',') if feature)
+        elif key:
+            properties[key] = value
 
-    def _Send(self, command, arg0, arg1, data=b''):
-        """TODO
+    return DeviceBanner(state, properties, features)
 
-        .. image:: _static/adb.adb_protocol._AdbConnection._Send.CALLER_GRAPH.svg
 
-        Parameters
-        ----------
-        command : TODO
-            TODO
-        arg0 : TODO
-            TODO
-        arg1 : TODO
-            TODO
-        data : bytes
-            TODO
+def _BulkWriteV(usb, buffers, timeout_ms=None):
+    """Write several buffers, e.g. an ADB header and its payload, with ``usb.BulkWriteV`` if ``usb`` has it.
 
-        """
-        message = AdbMessage(command, arg0, arg1, data)
-        message.Send(self.usb, self.timeout_ms)
+    Handles that only have ``BulkWrite`` get one call per buffer, like before ``BulkWriteV`` existed.
 
-    def Write(self, data):
-        """Write a packet and expect an Ack.
+    .. image:: _static/adb.adb_protocol._BulkWriteV.CALLER_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.Write.CALL_GRAPH.svg
+    Parameters
+    ----------
+    usb : adb.common.TcpHandle, adb.common.UsbHandle
+        The transport
+    buffers : list, tuple
+        The buffers to write, in order
+    timeout_ms : int, None
+        Timeout in milliseconds for USB packets.
 
-        Parameters
-        ----------
-        data : TODO
-            TODO
+    """
+    if hasattr(usb, 'BulkWriteV'):
+        usb.BulkWriteV(buffers, timeout_ms)
+        return
 
-        Returns
-        -------
-        int
-            ``len(data)``
+    for data in buffers:
+        usb.BulkWrite(data, timeout_ms)
 
-        Raises
-        ------
-        usb_exceptions.AdbCommandFailureException
-            The command failed.
-        adb.adb_protocol.InvalidCommandError
-            Expected an OKAY in response to a WRITE, got something else.
 
-        """
-        self._Send(b'WRTE', arg0=self.local_id, arg1=self.remote_id, data=data)
+def _HostBanner(banner):
+    """Make the payload of our ``CNXN`` packet, which lists :const:`HOST_FEATURES`.
 
-        # Expect an ack in response.
-        cmd, okay_data = self.ReadUntil(b'OKAY')
-        if cmd != b'OKAY':
-            if cmd == b'FAIL':
-                raise usb_exceptions.AdbCommandFailureException('Command failed.', okay_data)
+    .. image:: _static/adb.adb_protocol._HostBanner.CALLER_GRAPH.svg
 
-            raise InvalidCommandError('Expected an OKAY in response to a WRITE, got {0} ({1})'.format(cmd, okay_data), cmd, okay_data)
+    Parameters
+    ----------
+    banner : str, bytes
+        A string to send as a host identifier
 
-        return len(data)
+    Returns
+    -------
+    bytes
+        ``host::<banner>;features=<features>\\0``
 
-    def Okay(self):
-        """TODO
+    """
+    # In py3, convert unicode to bytes. In py2, convert str to bytes.
+    # It's later joined into a byte string, so in py2, this ends up kind of being a no-op.
+    if isinstance(banner, str):
+        banner = bytearray(banner, 'utf-8')
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.Okay.CALL_GRAPH.svg
+    return b'host::%s;features=%s\0' % (banner, b','.join(HOST_FEATURES))
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.Okay.CALLER_GRAPH.svg
 
-        """
-        self._Send(b'OKAY', arg0=self.local_id, arg1=self.remote_id)
+def _KeyFingerprint(rsa_key):
+    """Get a value that identifies a key, for remembering which key a device accepted.
 
-    def ReadUntil(self, *expected_cmds):
-        """Read a packet, Ack any write packets.
+    .. image:: _static/adb.adb_protocol._KeyFingerprint.CALLER_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntil.CALL_GRAPH.svg
+    Parameters
+    ----------
+    rsa_key : AuthSigner
+        The key
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntil.CALLER_GRAPH.svg
+    Returns
+    -------
+    str, int
+        The SHA-256 digest of its public key or, if it doesn't have one, its ``id()``
 
-        Parameters
-        ----------
-        *expected_cmds : TODO
-            TODO
+    """
+    public_key = rsa_key.GetPublicKey()
+    if not public_key:
+        return id(rsa_key)
 
-        Returns
-        -------
-        cmd : TODO
-            TODO
-        data : TODO
-            TODO
+    if not isinstance(public_key, bytes):
+        public_key = public_key.encode('utf-8')
+    return hashlib.sha256(public_key).hexdigest()
 
-        Raises
-        ------
-        adb.adb_protocol.InterleavedDataError
-            We don't support multiple streams...
-        adb.adb_protocol.InvalidResponseError
-            Incorrect remote id.
 
-        """
-        cmd, remote_id, local_id, data = AdbMessage.Read(self.usb, expected_cmds, self.timeout_ms)
+def _NegotiatedInfo(version, max_data, banner):
+    """Work out what to use with a device from its ``CNXN`` packet.
 
-        if local_id not in (0, self.local_id):
-            raise InterleavedDataError("We don't support multiple streams...")
+    .. image:: _static/adb.adb_protocol._NegotiatedInfo.CALL_GRAPH.svg
 
-        if remote_id not in (0, self.remote_id):
-            raise InvalidResponseError('Incorrect remote id, expected {0} got {1}'.format(self.remote_id, remote_id))
+    .. image:: _static/adb.adb_protocol._NegotiatedInfo.CALLER_GRAPH.svg
 
-        # Ack write packets.
-        if cmd == b'WRTE':
-            self.Okay()
+    Parameters
+    ----------
+    version : int
+        The ADB protocol version reported by the device (``arg0`` of its ``CNXN`` message)
+    max_data : int
+        The maximum amount of data in an ADB packet reported by the device (``arg1`` of its ``CNXN`` message)
+    banner : bytes
+        The device's banner (the payload of its ``CNXN`` message), which lists its features
 
-        return cmd, data
+    Returns
+    -------
+    _TransportInfo
+        The lower of the two versions, the lower of the two maximum payload sizes, the features that both sides
+        have, and the parsed banner
 
-    def ReadUntilClose(self):
-        """Yield packets until a ``b'CLSE'`` packet is received.
+    """
+    max_data = min(max_data, HOST_MAX_ADB_DATA) if max_data else MAX_ADB_DATA
+    device_banner = ParseBanner(banner)
+    features = device_banner.features.intersection(HOST_FEATURES)
+    return _TransportInfo(version=min(version, VERSION), max_data=max_data, features=features, banner=device_banner)
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntilClose.CALL_GRAPH.svg
 
-        Yields
-        ------
-        data : TODO
-            TODO
+def _PartialDelimiter(delim):
+    """Get the part of a shell prompt that doesn't change with the user or the working directory.
 
-        """
-        while True:
-            cmd, data = self.ReadUntil(b'CLSE', b'WRTE')
+    A prompt like ``shell@hammerhead:/ $`` may become ``root@hammerhead:/data/local/tmp #``, so only ``@hammerhead:``
+    is looked for.
 
-            if cmd == b'CLSE':
-                self._Send(b'CLSE', arg0=self.local_id, arg1=self.remote_id)
-                break
+    .. image:: _static/adb.adb_protocol._PartialDelimiter.CALLER_GRAPH.svg
 
-            if cmd != b'WRTE':
-                if cmd == b'FAIL':
-                    raise usb_exceptions.AdbCommandFailureException('Command failed.', data)
+    Parameters
+    ----------
+    delim : bytes, None
+        The prompt
 
-                raise InvalidCommandError('Expected a WRITE or a CLOSE, got {0} ({1})'.format(cmd, data), cmd, data)
+    Returns
+    -------
+    bytes, None
+        What to look for in the output
 
-            yield data
+    """
+    if delim:
+        user_pos = delim.find(b'@')
+        dir_pos = delim.rfind(b':/')
+        if user_pos != -1 and dir_pos != -1:
+            return delim[user_pos:dir_pos + 1]  # e.g. @hammerhead:
 
-    def Close(self):
-        """TODO
+    return delim
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.Close.CALL_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol._AdbConnection.Close.CALLER_GRAPH.svg
+class _FilePayload(object):
+    """The payload of a ``WRTE`` packet whose end is sent straight from a file (see :meth:`_AdbConnection.WriteFile`).
 
-        Raises
-        ------
-        usb_exceptions.AdbCommandFailureException
-            Command failed.
-        adb.adb_protocol.InvalidCommandError
-            Expected a ``CLSE`` response but received something else.
+    It is written to the :class:`adb.sansio.AdbTransport` as it is, and :meth:`_StreamMultiplexer._SendPackets` sends it
+    with ``usb.SendFile``.
 
-        """
-        self._Send(b'CLSE', arg0=self.local_id, arg1=self.remote_id)
-        cmd, data = self.ReadUntil(b'CLSE')
-        if cmd != b'CLSE':
-            if cmd == b'FAIL':
-                raise usb_exceptions.AdbCommandFailureException('Command failed.', data)
-            raise InvalidCommandError('Expected a CLSE response, got {0} ({1})'.format(cmd, data), cmd, data)
+    Parameters
+    ----------
+    data : bytes
+        The start of the payload
+    fd : int
+        The file descriptor of a regular file
+    offset : int
+        Where ``region`` starts in the file
+    region : memoryview
+        A memory map of the part of the file that is sent, used for the checksum
 
+    Attributes
+    ----------
+    data : bytes
+        The start of the payload
+    fd : int
+        The file descriptor of a regular file
+    offset : int
+        Where ``region`` starts in the file
+    region : memoryview
+        A memory map of the part of the file that is sent, used for the checksum
 
-class AdbMessage(object):
-    """ADB Protocol and message class.
+    """
+    __slots__ = ('data', 'fd', 'offset', 'region')
 
-    .. rubric:: local_id/remote_id
+    def __init__(self, data, fd, offset, region):
+        self.data = data
+        self.fd = fd
+        self.offset = offset
+        self.region = region
 
-    Turns out the documentation is host/device ambidextrous, so ``local_id`` is the id for 'the sender' and
-    ``remote_id`` is for 'the recipient'. So since we're only on the host, we'll re-document with host_id and device_id:
+    def __len__(self):
+        return len(self.data) + len(self.region)
 
-    ::
 
-      OPEN(host_id, 0, 'shell:XXX')
-      READY/OKAY(device_id, host_id, '')
-      WRITE(0, host_id, 'data')
-      CLOSE(device_id, host_id, '')
+class _StreamMultiplexer(object):
+    """Drives the :class:`adb.sansio.AdbTransport` of a connected transport from blocking calls.
 
+    The state machine keeps track of the streams, their ids and their flow control; this just moves its packets and
+    hands its events to the :class:`_AdbConnection` of each stream. By default there is no reader thread: whichever
+    stream needs a packet reads one from the transport while the others wait, passes it to the state machine, and
+    queues the events for the streams that they are for, until it has what it was waiting for. A stream's ``WRTE``
+    packets are acked when the stream consumes them, or when the stream reads them itself.
 
-    .. image:: _static/adb.adb_protocol.AdbMessage.__init__.CALLER_GRAPH.svg
+    After :meth:`_StreamMultiplexer.StartReader`, a background thread does all of the reading instead, and acks ``WRTE``
+    packets as soon as they are queued, so the device can keep sending while the streams are busy.
+
+    Either way, data is only acked while the stream has room for everything that the device could send next, so no
+    stream ever holds more than ``max_queued`` bytes that haven't been read. With the ``delayed_ack`` feature, the
+    streams advertise a window of ``max_queued`` bytes, so they are acked as they are consumed. Without it, the device
+    sends one packet at a time, which is acked as long as there is room for one more.
+
+    .. image:: _static/adb.adb_protocol._StreamMultiplexer.__init__.CALLER_GRAPH.svg
 
     Parameters
     ----------
-    command : bytes, None
-        One of: ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``
-    arg0 : TODO, None
-        TODO
-    arg1 : TODO, None
-        TODO
-    data : bytes
-        TODO
+    transport : adb.sansio.AdbTransport
+        The state machine, which must not ack ``WRTE`` packets by itself
 
     Attributes
     ----------
-    command : int
-        The value in :const:`AdbMessage.commands` that corresponds to the ``command`` parameter
-    commands : dict
-        A dictionary with keys ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``.
-    connections : int
-        TODO
-    constants : dict
-        A dictionary with values ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``.
-    format : bytes
-        The format for unpacking the ADB message.
-    ids : list[bytes]
-        ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``
+    _cond : threading.Condition
+        Protects the attributes below and ``transport``, and is notified when an event is queued or the transport is
+        free
+    _error : Exception, None
+        The error that stopped the reader thread
+    _max_queued : int
+        How many bytes of data a stream can hold before it has been read, counting what the device can still send;
+        with the ``delayed_ack`` feature, it is the window of new streams
+    _reading : bool
+        Whether a stream is reading from the transport
+    _streams : dict
+        ``_streams[local_id]`` is the :class:`_AdbConnection` that gets the events for each stream until it is closed
+    _thread : threading.Thread, None
+        The reader thread, if it is running
+    header_buffer : bytearray
+        The header of the packet being written, packed while ``write_lock`` is held
+    transport : adb.sansio.AdbTransport
+        The state machine
+    write_lock : threading.Lock
+        Held while the state machine's packets are taken and written, so that they are sent in order and packets from
+        different streams are not interleaved; it is taken before ``_cond``
 
     """
+    def __init__(self, transport):
+        self._cond = threading.Condition(threading.Lock())
+        self._error = None
+        self._max_queued = READER_QUEUE_BYTES
+        self._reading = False
+        self._streams = {}
+        self._thread = None
+        self.header_buffer = bytearray(AdbMessage.header_struct.size)
+        self.transport = transport
+        self.write_lock = threading.Lock()
 
-    ids = [b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']
-    commands, constants = MakeWireIDs(ids)
-    # An ADB message is 6 words in little-endian.
-    format = b'<6I'
-
-    connections = 0
-
-    def __init__(self, command=None, arg0=None, arg1=None, data=b''):
-        self.command = self.commands[command]
-        self.magic = self.command ^ 0xFFFFFFFF
-        self.arg0 = arg0
-        self.arg1 = arg1
-        self.data = data
+    def Open(self, usb, connection, destination, timeout_ms=None):
+        """Open a stream and wait for the device to accept it.
 
-    @property
-    def checksum(self):
-        """TODO
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Open.CALL_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol.AdbMessage.checksum.CALL_GRAPH.svg
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Open.CALLER_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol.AdbMessage.checksum.CALLER_GRAPH.svg
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            Gets the stream's local id and events
+        destination : bytes
+            The service, e.g. ``b'shell:ls'``
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
 
         Returns
         -------
-        TODO
-            TODO
+        bool
+            Whether the device accepted the stream
 
         """
-        return self.CalculateChecksum(self.data)
-
-    @staticmethod
-    def CalculateChecksum(data):
-        """TODO
+        with self.write_lock:
+            with self._cond:
+                if b'delayed_ack' in self.transport.info.features:
+                    connection.window = self._max_queued
+                connection.local_id = self.transport.Open(destination, connection.window)
+                self._streams[connection.local_id] = connection
+                packets = self.transport.PacketsToSend()
+            try:
+                self._SendPackets(usb, packets, timeout_ms)
+            except Exception:
+                self.Unregister(connection)
+                raise
 
-        .. image:: _static/adb.adb_protocol.AdbMessage.CalculateChecksum.CALLER_GRAPH.svg
+        try:
+            cmd, _ = self.Read(usb, connection, timeout_ms)
+        except Exception:
+            self.Unregister(connection)
+            raise
+        return cmd == b'OKAY'
 
-        Returns
-        -------
-        TODO
-            TODO
+    def Write(self, usb, connection, data, timeout_ms=None):
+        """Write data to a stream once the device's flow control allows it.
 
-        """
-        # The checksum is just a sum of all the bytes. I swear.
-        if isinstance(data, bytearray):
-            total = sum(data)
-        elif isinstance(data, bytes):
-            if data and isinstance(data[0], bytes):
-                # Python 2 bytes (str) index as single-character strings.
-                total = sum(map(ord, data))
-            else:
-                # Python 3 bytes index as numbers (and PY2 empty strings sum() to 0)
-                total = sum(data)
-        else:
-            # Unicode strings (should never see?)
-            total = sum(map(ord, data))
-        return total & 0xFFFFFFFF
+        Without the ``delayed_ack`` feature, this also waits for the device's ``OKAY`` for the packet.
 
-    def Pack(self):
-        """Returns this message in an over-the-wire format.
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Write.CALL_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol.AdbMessage.Pack.CALL_GRAPH.svg
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Write.CALLER_GRAPH.svg
 
-        .. image:: _static/adb.adb_protocol.AdbMessage.Pack.CALLER_GRAPH.svg
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            The stream
+        data : bytes, bytearray, memoryview, _FilePayload
+            The data; if it fits in one packet, which a :class:`_FilePayload` must, it is sent without being copied
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
 
-        Returns
-        -------
-        bytes
-            TODO
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed before the packet could be sent, or before the device acked it.
 
         """
-        return struct.pack(self.format, self.command, self.arg0, self.arg1, len(self.data), self.checksum, self.magic)
+        local_id = connection.local_id
+        self._WaitUntilWritable(usb, connection, timeout_ms)
+        with self.write_lock:
+            with self._cond:
+                if self._streams.get(local_id) is not connection:
+                    raise InvalidCommandError('Expected an OKAY in response to a WRITE, got CLSE', b'CLSE', b'')
+                self.transport.Write(local_id, data, copy=False)
+                packets = self.transport.PacketsToSend()
+            self._SendPackets(usb, packets, timeout_ms)
 
-    @classmethod
-    def Unpack(cls, message):
-        """TODO
+        if self.transport.SendWindow(local_id) is None:
+            self._WaitUntilWritable(usb, connection, timeout_ms)
 
-        .. image:: _static/adb.adb_protocol.AdbMessage.Unpack.CALLER_GRAPH.svg
+    def _WaitUntilWritable(self, usb, connection, timeout_ms):
+        """Wait until the state machine would send a packet written to a stream right away.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._WaitUntilWritable.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._WaitUntilWritable.CALLER_GRAPH.svg
 
         Parameters
         ----------
-        message : TODO
-            TODO
-
-        Returns
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            The stream
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed.
+
+        """
+        local_id = connection.local_id
+
+        def Ready():
+            return self.transport.Writable(local_id) or self._streams.get(local_id) is not connection
+
+        self._Wait(usb, connection, Ready, timeout_ms)
+        if self._streams.get(local_id) is not connection:
+            raise InvalidCommandError('Expected an OKAY in response to a WRITE, got CLSE', b'CLSE', b'')
+
+    def Acknowledge(self, usb, connection, length, timeout_ms=None):
+        """Ack data that a stream consumed.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Acknowledge.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Acknowledge.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            The stream
+        length : int
+            The number of bytes to ack
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        """
+        with self.write_lock:
+            with self._cond:
+                self.transport.Acknowledge(connection.local_id, length)
+                packets = self.transport.PacketsToSend()
+            self._SendPackets(usb, packets, timeout_ms)
+
+    def Close(self, usb, connection, timeout_ms=None):
+        """Send a ``CLSE`` packet for a stream, unless the device already closed it.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Close.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Close.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            The stream
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        """
+        with self.write_lock:
+            with self._cond:
+                if self._streams.get(connection.local_id) is connection:
+                    self.transport.Close(connection.local_id)
+                packets = self.transport.PacketsToSend()
+            self._SendPackets(usb, packets, timeout_ms)
+
+    def Unregister(self, connection):
+        """Stop giving a stream the events for its local id; events that arrive for it afterwards are dropped.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Unregister.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : _AdbConnection
+            The stream
+
+        """
+        with self._cond:
+            if self._streams.get(connection.local_id) is connection:
+                del self._streams[connection.local_id]
+
+    def StartReader(self, usb, max_queued=None, timeout_ms=None):
+        """Start a background thread that reads all packets from the transport.
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        max_queued : int, None
+            How many bytes of data a stream can hold before it has been read, counting what the device can still send;
+            defaults to :const:`READER_QUEUE_BYTES`. With the ``delayed_ack`` feature, it is the window of the streams
+            that are opened afterwards.
+        timeout_ms : int, None
+            Timeout in milliseconds for each read; the thread checks whether it should stop this often
+
+        """
+        with self._cond:
+            if self._thread is not None:
+                return
+
+            self._max_queued = max_queued or READER_QUEUE_BYTES
+            self._error = None
+            self._thread = threading.Thread(target=self._ReaderLoop, args=(usb, timeout_ms), name='adb-reader')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def StopReader(self, wait=True):
+        """Stop the reader thread; streams go back to reading from the transport themselves.
+
+        Parameters
+        ----------
+        wait : bool
+            Whether to wait for the thread's current read to finish
+
+        """
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _ReaderLoop(self, usb, timeout_ms):
+        """Read packets and queue their events until :meth:`_StreamMultiplexer.StopReader` is called.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._ReaderLoop.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        timeout_ms : int, None
+            Timeout in milliseconds for each read
+
+        """
+        me = threading.current_thread()
+        while self._thread is me:
+            # A timed out header read consumed nothing, so it is retried.  Once the header is in, the payload has to
+            # follow: giving up on it would leave the rest of the payload to be read as the next header.
+            try:
+                command, arg0, arg1, data_length, data_checksum = AdbMessage.ReadHeader(usb, timeout_ms)
+            except usb_exceptions.TcpTimeoutException:
+                continue
+            except usb_exceptions.ReadFailedError as e:
+                if getattr(e.usb_error, 'value', None) == -7:  # Timeout.
+                    continue
+                self._Fail(me, e)
+                return
+            except Exception as e:  # pylint: disable=broad-except
+                self._Fail(me, e)
+                return
+
+            try:
+                data = AdbMessage.ReadPayload(usb, data_length, data_checksum, timeout_ms)
+                self._HandlePacket(usb, (command, arg0, arg1, data), None, timeout_ms)
+            except Exception as e:  # pylint: disable=broad-except
+                self._Fail(me, e)
+                return
+
+    def _Fail(self, thread, error):
+        """Stop the reader thread because of an error, which is raised to the streams waiting for packets.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._Fail.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        thread : threading.Thread
+            The reader thread
+        error : Exception
+            The error
+
+        """
+        with self._cond:
+            if self._thread is thread:
+                self._error = error
+            self._cond.notify_all()
+
+    def Read(self, usb, connection, timeout_ms=None, buffer=None):
+        """Get the next event for a stream, reading from the transport if necessary.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Read.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer.Read.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            The stream
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+        buffer : bytearray, None
+            Where to read the payload of a packet that this stream reads from the transport itself (see
+            :meth:`AdbMessage.Read`)
+
+        Returns
+        -------
+        cmd : bytes
+            ``b'OKAY'`` when the device accepted the stream, ``b'WRTE'`` for data, and ``b'CLSE'`` when the stream
+            was refused or closed
+        data : bytes, memoryview
+            The data; it may be a memoryview of ``buffer``
+
+        Raises
+        ------
+        adb.usb_exceptions.ReadFailedError
+            Timed out waiting for the reader thread, or it stopped because of this error.
+
+        """
+        events = connection.events
+        self._Wait(usb, connection, lambda: events, timeout_ms, buffer)
+
+        with self._cond:
+            cmd, data = events.popleft()
+            if cmd == b'WRTE':
+                connection.queued -= len(data)
+            ack = self._AckLength(connection)
+            connection.unacked -= ack
+
+        if ack:
+            self.Acknowledge(usb, connection, ack, timeout_ms)
+        return cmd, data
+
+    def _AckLength(self, connection):
+        """Work out how many of a stream's bytes can be acked without it ever holding more than ``_max_queued`` bytes.
+
+        ``_cond`` must be held.
+
+        Parameters
+        ----------
+        connection : _AdbConnection
+            The stream
+
+        Returns
+        -------
+        int
+            How much of ``connection.unacked`` to ack now
+
+        """
+        if connection.window is not None:
+            # The device can still send ``window - unacked`` bytes, on top of those that are queued.
+            room = self._max_queued - connection.window + connection.unacked - connection.queued
+            return max(0, min(connection.unacked, room))
+
+        # Without the ``delayed_ack`` feature, the device sends at most one more packet after an ``OKAY``.
+        if connection.queued + self.transport.info.max_data <= self._max_queued:
+            return connection.unacked
+        return 0
+
+    def _Wait(self, usb, connection, ready, timeout_ms, buffer=None):
+        """Read packets, or wait for the stream or thread that is reading them, until ``ready()`` is true.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._Wait.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._Wait.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        connection : _AdbConnection
+            The stream that is waiting
+        ready : function
+            Called with ``_cond`` held
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+        buffer : bytearray, None
+            Where to read the payload of a packet (see :meth:`AdbMessage.Read`)
+
+        Raises
+        ------
+        adb.usb_exceptions.ReadFailedError
+            Timed out waiting for the reader thread, or it stopped because of this error.
+
+        """
+        wait_ms = usb.Timeout(timeout_ms)
+        deadline = time.time() + wait_ms / 1000.0 if wait_ms else None
+
+        while True:
+            with self._cond:
+                while not ready() and (self._reading or self._thread is not None) and self._error is None:
+                    remaining = deadline - time.time() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise usb_exceptions.ReadFailedError('Timed out waiting for a packet for stream {} (timeout {}ms)'.format(connection.local_id, wait_ms), None)
+                    self._cond.wait(remaining)
+
+                if ready():
+                    return
+                if self._error is not None:
+                    raise self._error
+                self._reading = True
+
+            try:
+                packet = AdbMessage.Read(usb, AdbMessage.ids, timeout_ms, buffer=buffer)
+            finally:
+                with self._cond:
+                    self._reading = False
+                    self._cond.notify_all()
+
+            self._HandlePacket(usb, packet, connection, timeout_ms)
+
+    def _HandlePacket(self, usb, packet, reader, timeout_ms=None):
+        """Pass a packet to the state machine, queue the events for the streams, and send what it answered.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._HandlePacket.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._HandlePacket.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        packet : tuple
+            ``(cmd, arg0, arg1, data)``
+        reader : _AdbConnection, None
+            The stream that read the packet, which also gets packets with ``arg1 == 0``; ``None`` for the reader
+            thread, which drops them
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        """
+        # Imported here because it imports this module.
+        from adb import sansio  # pylint: disable=cyclic-import,import-outside-toplevel
+
+        cmd, arg0, arg1, data = packet
+        if not arg1 and reader is not None and cmd in (b'OKAY', b'WRTE', b'CLSE'):
+            arg1 = reader.local_id
+
+        with self._cond:
+            for event in self.transport.HandlePacket(cmd, arg0, arg1, data):
+                connection = self._streams.get(getattr(event, 'local_id', None))
+                if connection is None or isinstance(event, sansio.StreamWritable):
+                    continue
+
+                if isinstance(event, sansio.StreamData):
+                    if isinstance(event.data, memoryview) and (connection is not reader or connection.events):
+                        # The reader's buffer will be reused before this is consumed.
+                        connection.events.append((b'WRTE', event.data.tobytes()))
+                    else:
+                        connection.events.append((b'WRTE', event.data))
+
+                    # With the ``delayed_ack`` feature, the device doesn't wait for each ``OKAY``, so the bytes of
+                    # every ``WRTE`` that isn't acked yet add up, and one ``OKAY`` can ack them all.
+                    connection.queued += len(event.data)
+                    connection.unacked += len(event.data) if connection.window is not None else 1
+                    ack = self._AckLength(connection) if connection is reader or self._thread is not None else 0
+                    if ack:
+                        self.transport.Acknowledge(connection.local_id, ack)
+                        connection.unacked -= ack
+                elif isinstance(event, sansio.StreamOpened):
+                    connection.events.append((b'OKAY', b''))
+                else:
+                    # The state machine has already answered the device's ``CLSE``, and the local id can be reused.
+                    del self._streams[connection.local_id]
+                    connection.events.append((b'CLSE', b''))
+            self._cond.notify_all()
+
+        with self.write_lock:
+            with self._cond:
+                packets = self.transport.PacketsToSend()
+            self._SendPackets(usb, packets, timeout_ms)
+
+    def _SendPackets(self, usb, packets, timeout_ms=None):
+        """Write the packets from :meth:`adb.sansio.AdbTransport.PacketsToSend`; ``write_lock`` must be held.
+
+        .. image:: _static/adb.adb_protocol._StreamMultiplexer._SendPackets.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        packets : list
+            ``(command, arg0, arg1, data)`` for each packet; ``data`` may be a :class:`_FilePayload`
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        """
+        skip_checksum = AdbMessage.SkipsChecksum(usb)
+        header = self.header_buffer
+        for command, arg0, arg1, data in packets:
+            if not isinstance(data, _FilePayload):
+                AdbMessage(command, arg0, arg1, data).PackInto(header, 0, skip_checksum)
+                _BulkWriteV(usb, (header, data), timeout_ms)
+                continue
+
+            # The checksum covers the whole payload, so the file's part is added to that of ``data``.
+            message = AdbMessage(command, arg0, arg1, data.data)
+            data_checksum = 0 if skip_checksum else (message.checksum + AdbMessage.CalculateChecksum(data.region)) & 0xFFFFFFFF
+            AdbMessage.header_struct.pack_into(header, 0, message.command, arg0, arg1, len(data), data_checksum, message.magic)
+            _BulkWriteV(usb, (header, data.data), timeout_ms)
+            usb.SendFile(data.fd, data.offset, len(data.region), timeout_ms)
+
+
+class _AdbConnection(object):
+    """ADB Connection.
+
+    .. image:: _static/adb.adb_protocol._AdbConnection.__init__.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    usb : adb.common.UsbHandle
+        TODO
+    timeout_ms : int
+        Timeout in milliseconds for USB packets.
+    max_data : int
+        The maximum amount of data in an ADB packet, as negotiated by :meth:`AdbMessage.Connect`
+    multiplexer : _StreamMultiplexer, None
+        The multiplexer for ``usb``; by default, the one from :meth:`AdbMessage.Multiplexer`
+
+    Attributes
+    ----------
+    closed : bool
+        Whether the ``CLSE`` for the stream has been read
+    events : collections.deque
+        ``(cmd, data)`` for each event of the stream that hasn't been read yet (see :meth:`_StreamMultiplexer.Read`)
+    local_id : int, None
+        The ID for the sender, once :meth:`_StreamMultiplexer.Open` has been called
+    max_data : int
+        The maximum amount of data in an ADB packet, as negotiated by :meth:`AdbMessage.Connect`
+    multiplexer : _StreamMultiplexer
+        Drives the state machine that runs the stream
+    queued : int
+        How many bytes of data are in ``events``
+    _recv_buffer : bytearray, None
+        The buffer that :meth:`_AdbConnection.ReadUntilView` reads payloads into, allocated on first use
+    timeout_ms : int
+        Timeout in milliseconds for USB packets.
+    unacked : int
+        With the ``delayed_ack`` feature, how many bytes of data the device sent that haven't been acked; without it,
+        how many ``WRTE`` packets
+    usb : adb.common.UsbHandle
+        TODO
+    window : int, None
+        With the ``delayed_ack`` feature, how many bytes the device can send before they are acked, which the stream
+        advertised when it was opened
+
+    """
+    def __init__(self, usb, timeout_ms, max_data=MAX_ADB_DATA, multiplexer=None):
+        self.usb = usb
+        self.local_id = None
+        self.timeout_ms = timeout_ms
+        self.max_data = max_data
+        self.multiplexer = multiplexer or AdbMessage.Multiplexer(usb)
+        self.closed = False
+        self.events = collections.deque()
+        self.queued = 0
+        self.unacked = 0
+        self.window = None
+        self._recv_buffer = None
+
+    @property
+    def send_window(self):
+        """How many more bytes can be written before waiting for the device's ``OKAY`` packets.
+
+        Returns
+        -------
+        int, None
+            The stream's window in the state machine; ``None`` without the ``delayed_ack`` feature, in which case each
+            ``WRTE`` waits for its ``OKAY``
+
+        """
+        return self.multiplexer.transport.SendWindow(self.local_id)
+
+    def Write(self, data):
+        """Write a packet and expect an Ack.
+
+        With the ``delayed_ack`` feature, the packet is sent as soon as the device has room for it, and its ``OKAY`` is
+        read later.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.Write.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        data : bytes, bytearray, memoryview
+            At most :attr:`max_data` bytes, which must not change while this runs
+
+        Returns
+        -------
+        int
+            ``len(data)``
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed before the device acked the packet.
+
+        """
+        self.multiplexer.Write(self.usb, self, data, self.timeout_ms)
+        return len(data)
+
+    def WriteFile(self, data, fd, offset, region):
+        """Write a packet made of ``data`` followed by a region of a file and expect an Ack.
+
+        The file's bytes go straight from ``fd`` to the transport with ``self.usb.SendFile`` (see
+        :meth:`adb.common.TcpHandle.SendFile`) instead of being read into Python.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.WriteFile.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        data : bytes
+            The start of the packet's payload
+        fd : int
+            The file descriptor of a regular file
+        offset : int
+            Where ``region`` starts in the file
+        region : memoryview
+            A memory map of the part of the file that will be sent, used for the checksum
+
+        Returns
+        -------
+        int
+            The length of the packet's payload
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed before the device acked the packet.
+
+        """
+        payload = _FilePayload(data, fd, offset, region)
+        self.multiplexer.Write(self.usb, self, payload, self.timeout_ms)
+        return len(payload)
+
+    def Okay(self):
+        """Send an ``OKAY`` packet that acks no data.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.Okay.CALL_GRAPH.svg
+
+        """
+        self.multiplexer.Acknowledge(self.usb, self, 0, self.timeout_ms)
+
+    def ReadUntil(self, *expected_cmds):
+        """Read a packet, Ack any write packets.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntil.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntil.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        *expected_cmds : bytes
+            ``b'WRTE'`` and/or ``b'CLSE'``
+
+        Returns
+        -------
+        cmd : bytes
+            The command, one of ``expected_cmds``
+        data : bytes
+            The payload
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed while waiting for data.
+
+        """
+        return self._ReadUntil(expected_cmds, None)
+
+    def ReadUntilView(self, *expected_cmds):
+        """Like :meth:`_AdbConnection.ReadUntil`, but without copying the payload out of the receive buffer.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntilView.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntilView.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        *expected_cmds : bytes
+            The commands to wait for
+
+        Returns
+        -------
+        cmd : bytes
+            The command, one of ``expected_cmds``
+        data : bytes, memoryview
+            The payload. It is usually a view of this connection's receive buffer, so it is only valid until the next
+            read; copy it if it needs to live longer.
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed while waiting for data.
+
+        """
+        if self._recv_buffer is None:
+            self._recv_buffer = bytearray(self.max_data)
+        return self._ReadUntil(expected_cmds, self._recv_buffer)
+
+    def _ReadUntil(self, expected_cmds, buffer):
+        """Read a packet for :meth:`_AdbConnection.ReadUntil` and :meth:`_AdbConnection.ReadUntilView`.
+
+        Data is dropped (and acked) if ``b'WRTE'`` isn't expected.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection._ReadUntil.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        expected_cmds : tuple[bytes]
+            The commands to wait for
+        buffer : bytearray, None
+            Where to read the payload (see :meth:`AdbMessage.Read`)
+
+        Returns
+        -------
+        cmd : bytes
+            The command, one of ``expected_cmds``
+        data : bytes, memoryview
+            The payload
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            The stream was closed while waiting for data.
+
+        """
+        while True:
+            if self.closed:
+                cmd, data = b'CLSE', b''
+            else:
+                cmd, data = self.multiplexer.Read(self.usb, self, self.timeout_ms, buffer)
+                self.closed = cmd == b'CLSE'
+
+            if cmd in expected_cmds:
+                return cmd, data
+
+            if self.closed:
+                raise InvalidCommandError('Expected one of {0}, got CLSE'.format(expected_cmds), cmd, data)
+
+    def ReadUntilClose(self, copy=True):
+        """Yield packets until a ``b'CLSE'`` packet is received.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.ReadUntilClose.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        copy : bool
+            If ``False``, read with :meth:`_AdbConnection.ReadUntilView`, so each payload is only valid until the next
+            one is read
+
+        Yields
+        ------
+        data : bytes, memoryview
+            The payload of each ``WRTE`` packet
+
+        """
+        read = self.ReadUntil if copy else self.ReadUntilView
+        while True:
+            cmd, data = read(b'CLSE', b'WRTE')
+            if cmd == b'CLSE':
+                # The state machine has already sent our ``CLSE``.
+                break
+
+            yield data
+
+    def Close(self):
+        """Close the stream and wait for the device to confirm, dropping any data that still arrives.
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.Close.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol._AdbConnection.Close.CALLER_GRAPH.svg
+
+        """
+        try:
+            self.multiplexer.Close(self.usb, self, self.timeout_ms)
+            self.ReadUntil(b'CLSE')
+        finally:
+            self.multiplexer.Unregister(self)
+
+
+class AdbMessage(object):
+    """ADB Protocol and message class.
+
+    .. rubric:: local_id/remote_id
+
+    Turns out the documentation is host/device ambidextrous, so ``local_id`` is the id for 'the sender' and
+    ``remote_id`` is for 'the recipient'. So since we're only on the host, we'll re-document with host_id and device_id:
+
+    ::
+
+      OPEN(host_id, 0, 'shell:XXX')
+      READY/OKAY(device_id, host_id, '')
+      WRITE(0, host_id, 'data')
+      CLOSE(device_id, host_id, '')
+
+
+    .. image:: _static/adb.adb_protocol.AdbMessage.__init__.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    command : bytes, None
+        One of: ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``
+    arg0 : TODO, None
+        TODO
+    arg1 : TODO, None
+        TODO
+    data : bytes
+        TODO
+
+    Attributes
+    ----------
+    accepted_keys_path : str, None
+        The JSON file where the fingerprint of the key that each device accepted is saved (see
+        :meth:`AdbMessage.AcceptedKey`), next to the default key; if ``None``, they are only remembered in memory
+    command : int
+        The value in :const:`AdbMessage.commands` that corresponds to the ``command`` parameter
+    commands : dict
+        A dictionary with keys ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``.
+    connections : int
+        TODO
+    constants : dict
+        A dictionary with values ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``.
+    format : bytes
+        The format for unpacking the ADB message.
+    header_struct : struct.Struct
+        The compiled ``format``
+    ids : list[bytes]
+        ``[b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']``
+
+    """
+
+    ids = [b'SYNC', b'CNXN', b'AUTH', b'OPEN', b'OKAY', b'CLSE', b'WRTE']
+    commands, constants = MakeWireIDs(ids)
+    # An ADB message is 6 words in little-endian.
+    format = b'<6I'
+    header_struct = struct.Struct(format)
+
+    # Thousands of these are created per second, so they don't get a `__dict__`.
+    __slots__ = ('command', 'magic', 'arg0', 'arg1', '_data', '_checksum')
+
+    connections = 0
+
+    # What was negotiated with the device for each transport, see `AdbMessage.MaxData`
+    _transport_info = weakref.WeakKeyDictionary()
+
+    # The stream multiplexer for each transport, see `AdbMessage.Multiplexer`
+    _multiplexers = weakref.WeakKeyDictionary()
+    _multiplexers_lock = threading.Lock()
+
+    accepted_keys_path = os.path.join(os.path.expanduser('~'), '.android', 'adb_accepted_keys.json')
+
+    # The fingerprint of the key that each device accepted, by serial number, see `AdbMessage.AcceptedKey`; it is
+    # loaded from `accepted_keys_path` the first time that it is needed
+    _accepted_keys = None
+    _accepted_keys_lock = threading.Lock()
+
+    def __init__(self, command=None, arg0=None, arg1=None, data=b''):
+        self.command = self.commands[command]
+        self.magic = self.command ^ 0xFFFFFFFF
+        self.arg0 = arg0
+        self.arg1 = arg1
+        self._data = data
+        self._checksum = None
+
+    @property
+    def data(self):
+        """The payload; setting it clears the cached :attr:`AdbMessage.checksum`.
+
+        Returns
+        -------
+        bytes, bytearray, memoryview
+            The payload
+
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._checksum = None
+
+    @property
+    def checksum(self):
+        """The checksum of the payload, computed once.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.checksum.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.checksum.CALLER_GRAPH.svg
+
+        Returns
+        -------
+        int
+            The sum of the bytes of :attr:`AdbMessage.data`, modulo 2**32
+
+        """
+        if self._checksum is None:
+            self._checksum = self.CalculateChecksum(self._data)
+        return self._checksum
+
+    @staticmethod
+    def CalculateChecksum(data):
+        """Compute the checksum of an ADB payload with the current engine (see :mod:`adb.checksum`).
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.CalculateChecksum.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        data : bytes, bytearray, memoryview
+            The payload
+
+        Returns
+        -------
+        int
+            The sum of the bytes of ``data``, modulo 2**32
+
+        """
+        # The checksum is just a sum of all the bytes. I swear.
+        return checksum.Calculate(data)
+
+    def Pack(self, skip_checksum=False):
+        """Returns this message in an over-the-wire format.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.Pack.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.Pack.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        skip_checksum : bool
+            Send 0 instead of computing the checksum (see :const:`VERSION_SKIP_CHECKSUM`)
+
+        Returns
+        -------
+        bytes
+            TODO
+
+        """
+        data_checksum = 0 if skip_checksum else self.checksum
+        return self.header_struct.pack(self.command, self.arg0, self.arg1, len(self._data), data_checksum, self.magic)
+
+    def PackInto(self, buffer, offset=0, skip_checksum=False):
+        """Pack this message's header into ``buffer``, like :meth:`AdbMessage.Pack` but without creating a new object.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.PackInto.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        buffer : bytearray
+            Where to put the header
+        offset : int
+            Where the header starts in ``buffer``
+        skip_checksum : bool
+            Send 0 instead of computing the checksum (see :const:`VERSION_SKIP_CHECKSUM`)
+
+        """
+        data_checksum = 0 if skip_checksum else self.checksum
+        self.header_struct.pack_into(buffer, offset, self.command, self.arg0, self.arg1, len(self._data), data_checksum, self.magic)
+
+    @classmethod
+    def Unpack(cls, message):
+        """TODO
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.Unpack.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        message : TODO
+            TODO
+
+        Returns
         -------
         cmd : TODO
             TODO
@@ -545,7 +1602,7 @@ class AdbMessage(object):
 
         """
         try:
-            cmd, arg0, arg1, data_length, data_checksum, unused_magic = struct.unpack(cls.format, message)
+            cmd, arg0, arg1, data_length, data_checksum, unused_magic = cls.header_struct.unpack(message)
         except struct.error as e:
             raise ValueError('Unable to unpack ADB command.', cls.format, message, e)
 
@@ -564,13 +1621,19 @@ class AdbMessage(object):
             Timeout in milliseconds for USB packets.
 
         """
-        usb.BulkWrite(self.Pack(), timeout_ms)
-        usb.BulkWrite(self.data, timeout_ms)
+        skip_checksum = self.SkipsChecksum(usb)
+        multiplexer = self.Multiplexer(usb)
+        with multiplexer.write_lock:
+            self.PackInto(multiplexer.header_buffer, 0, skip_checksum)
+            _BulkWriteV(usb, (multiplexer.header_buffer, self._data), timeout_ms)
 
     @classmethod
-    def Read(cls, usb, expected_cmds, timeout_ms=None, total_timeout_ms=None):
+    def Read(cls, usb, expected_cmds, timeout_ms=None, total_timeout_ms=None, buffer=None):
         """Receive a response from the device.
 
+        The payload is read straight into one buffer with ``usb.BulkReadInto``, if ``usb`` has it. If ``buffer`` is
+        given, that buffer is ``buffer`` and the payload is returned as a memoryview of it, without any more copies.
+
         .. image:: _static/adb.adb_protocol.AdbMessage.Read.CALL_GRAPH.svg
 
         .. image:: _static/adb.adb_protocol.AdbMessage.Read.CALLER_GRAPH.svg
@@ -585,6 +1648,8 @@ class AdbMessage(object):
             Timeout in milliseconds for USB packets.
         total_timeout_ms : int, None
             The total time to wait for a command in ``expected_cmds``
+        buffer : bytearray, None
+            Where to put the payload; a bigger payload gets a buffer of its own
 
         Returns
         -------
@@ -594,8 +1659,8 @@ class AdbMessage(object):
             TODO
         arg1 : TODO
             TODO
-        bytes
-            TODO
+        bytes, memoryview
+            The payload; a memoryview if ``buffer`` was given
 
         Raises
         ------
@@ -609,38 +1674,118 @@ class AdbMessage(object):
         start = time.time()
 
         while True:
-            msg = usb.BulkRead(24, timeout_ms)
-            cmd, arg0, arg1, data_length, data_checksum = cls.Unpack(msg)
-            command = cls.constants.get(cmd)
-            if not command:
-                raise InvalidCommandError('Unknown command: %x' % cmd, cmd, (arg0, arg1))
-
+            command, arg0, arg1, data_length, data_checksum = cls.ReadHeader(usb, timeout_ms)
             if command in expected_cmds:
                 break
 
             if time.time() - start > total_timeout_ms:
-                raise InvalidCommandError('Never got one of the expected responses (%s)' % expected_cmds, cmd, (timeout_ms, total_timeout_ms))
+                raise InvalidCommandError('Never got one of the expected responses (%s)' % expected_cmds, cls.commands[command], (timeout_ms, total_timeout_ms))
+
+        return command, arg0, arg1, cls.ReadPayload(usb, data_length, data_checksum, timeout_ms, buffer)
+
+    @classmethod
+    def ReadHeader(cls, usb, timeout_ms=None):
+        """Receive the header of the next message from the device.
+
+        A read that times out consumes nothing, so it can be retried. Once this returns, the payload must be read with
+        :meth:`AdbMessage.ReadPayload` before anything else is read from ``usb``.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.ReadHeader.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        Returns
+        -------
+        command : bytes
+            The command
+        arg0 : int
+            The first argument
+        arg1 : int
+            The second argument
+        data_length : int
+            The length of the payload
+        data_checksum : int
+            The checksum of the payload
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            Unknown command.
+
+        """
+        msg = usb.BulkRead(24, timeout_ms)
+        cmd, arg0, arg1, data_length, data_checksum = cls.Unpack(msg)
+        command = cls.constants.get(cmd)
+        if not command:
+            raise InvalidCommandError('Unknown command: %x' % cmd, cmd, (arg0, arg1))
+
+        return command, arg0, arg1, data_length, data_checksum
+
+    @classmethod
+    def ReadPayload(cls, usb, data_length, data_checksum, timeout_ms=None, buffer=None):
+        """Receive the payload of a message whose header was read by :meth:`AdbMessage.ReadHeader`.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.ReadPayload.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        data_length : int
+            The length of the payload, from the header
+        data_checksum : int
+            The checksum of the payload, from the header
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+        buffer : bytearray, None
+            Where to put the payload; a bigger payload gets a buffer of its own
+
+        Returns
+        -------
+        bytes, memoryview
+            The payload; a memoryview if ``buffer`` was given
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidChecksumError
+            Received checksum does not match the expected checksum.
 
+        """
         if data_length > 0:
-            data = bytearray()
-            while data_length > 0:
-                temp = usb.BulkRead(data_length, timeout_ms)
-                if len(temp) != data_length:
-                    print("Data_length {} does not match actual number of bytes read: {}".format(data_length, len(temp)))
-                data += temp
-
-                data_length -= len(temp)
-
-            actual_checksum = cls.CalculateChecksum(data)
-            if actual_checksum != data_checksum:
-                raise InvalidChecksumError('Received checksum {0} != {1}'.format(actual_checksum, data_checksum))
+            if buffer is not None and len(buffer) >= data_length:
+                data = memoryview(buffer)[:data_length]
+            else:
+                data = memoryview(bytearray(data_length))
+
+            received = 0
+            if hasattr(usb, 'BulkReadInto'):
+                while received < data_length:
+                    received += usb.BulkReadInto(data[received:], timeout_ms)
+            else:
+                while received < data_length:
+                    temp = usb.BulkRead(data_length - received, timeout_ms)
+                    data[received:received + len(temp)] = temp
+                    received += len(temp)
+
+            if not cls.SkipsChecksum(usb) and not checksum.IsTransportTrusted():
+                actual_checksum = cls.CalculateChecksum(data)
+                # Until the version has been negotiated, the device may already be sending 0 instead of checksums.
+                if actual_checksum != data_checksum and (data_checksum or usb in cls._transport_info):
+                    raise InvalidChecksumError('Received checksum {0} != {1}'.format(actual_checksum, data_checksum))
+            if buffer is None:
+                data = data.tobytes()
         else:
             data = b''
 
-        return command, arg0, arg1, bytes(data)
+        return data
 
     @classmethod
-    def Connect(cls, usb, banner=b'notadb', rsa_keys=None, auth_timeout_ms=100):
+    def Connect(cls, usb, banner=b'notadb', rsa_keys=None, auth_timeout_ms=100, reader_thread=False):
         """Establish a new connection to the device.
 
         .. image:: _static/adb.adb_protocol.AdbMessage.Connect.CALL_GRAPH.svg
@@ -663,6 +1808,9 @@ class AdbMessage(object):
             quickly; while in interactive settings it should be high to allow
             users to accept the dialog. We default to automation here, so it's low
             by default.
+        reader_thread : bool
+            Whether to start a background thread that reads all packets and acks ``WRTE`` packets right away (see
+            :meth:`_StreamMultiplexer.StartReader`)
 
         Returns
         -------
@@ -680,45 +1828,352 @@ class AdbMessage(object):
             TODO
 
         """
-        # In py3, convert unicode to bytes. In py2, convert str to bytes.
-        # It's later joined into a byte string, so in py2, this ends up kind of being a no-op.
-        if isinstance(banner, str):
-            banner = bytearray(banner, 'utf-8')
-
-        msg = cls(command=b'CNXN', arg0=VERSION, arg1=MAX_ADB_DATA, data=b'host::%s\0' % banner)
-        msg.Send(usb)
-        cmd, arg0, arg1, banner = cls.Read(usb, [b'CNXN', b'AUTH'])
-        if cmd == b'AUTH':
-            if not rsa_keys:
-                raise usb_exceptions.DeviceAuthError('Device authentication required, no keys available.')
-
-            # Loop through our keys, signing the last 'banner' or token.
-            for rsa_key in rsa_keys:
-                if arg0 != AUTH_TOKEN:
-                    raise InvalidResponseError('Unknown AUTH response: %s %s %s' % (arg0, arg1, banner))
-
-                # Do not mangle the banner property here by converting it to a string
-                signed_token = rsa_key.Sign(banner)
-                msg = cls(command=b'AUTH', arg0=AUTH_SIGNATURE, arg1=0, data=signed_token)
-                msg.Send(usb)
-                cmd, arg0, unused_arg1, banner = cls.Read(usb, [b'CNXN', b'AUTH'])
-                if cmd == b'CNXN':
-                    return banner
-
-            # None of the keys worked, so send a public key.
-            msg = cls(command=b'AUTH', arg0=AUTH_RSAPUBLICKEY, arg1=0, data=rsa_keys[0].GetPublicKey() + b'\0')
-            msg.Send(usb)
+        # Forget what was negotiated for a previous connection, and its streams.
+        cls._transport_info.pop(usb, None)
+        with cls._multiplexers_lock:
+            multiplexer = cls._multiplexers.pop(usb, None)
+        if multiplexer is not None:
+            multiplexer.StopReader()
+
+        # Imported here because it imports this module.
+        from adb import sansio  # pylint: disable=cyclic-import,import-outside-toplevel
+
+        # The serial number is only needed to remember which key the device accepted.
+        serial = None
+        if rsa_keys:
+            try:
+                serial = usb.serial_number
+            except Exception:  # pylint: disable=broad-except
+                pass
+
+        # The handshake itself is run by the sans-I/O state machine, which tries our keys in order (starting with the
+        # one that worked last time) and then sends a public key; this just moves its packets.
+        transport = sansio.AdbTransport(banner, rsa_keys, auto_ack=False, preferred_key=cls.AcceptedKey(serial, rsa_keys or []))
+        transport.Connect()
+        timeout_ms = None
+        while not transport.connected:
+            cls._SendPackets(usb, transport.DataToSend())
             try:
-                cmd, arg0, unused_arg1, banner = cls.Read(usb, [b'CNXN'], timeout_ms=auth_timeout_ms)
+                events = cls._ReceivePacket(usb, transport, timeout_ms)
             except usb_exceptions.ReadFailedError as e:
-                if e.usb_error.value == -7:  # Timeout.
+                if timeout_ms is not None and e.usb_error.value == -7:  # Timeout.
                     raise usb_exceptions.DeviceAuthError('Accept auth key on device, then retry.')
 
                 raise
 
-            # This didn't time-out, so we got a CNXN response.
-            return banner
-        return banner
+            if any(isinstance(event, sansio.PublicKeySent) for event in events):
+                # The device is showing a dialog; give the user this long to accept our key.
+                timeout_ms = auth_timeout_ms
+
+        cls._SendPackets(usb, transport.DataToSend())
+        if transport.accepted_key is not None:
+            cls.RememberAcceptedKey(serial, transport.accepted_key)
+
+        # The streams are run on the same state machine.
+        cls._transport_info[usb] = transport.info
+        with cls._multiplexers_lock:
+            cls._multiplexers[usb] = _StreamMultiplexer(transport)
+        if reader_thread:
+            cls.Multiplexer(usb).StartReader(usb)
+
+        return transport.device_banner
+
+    @staticmethod
+    def _SendPackets(usb, data):
+        """Send the packets queued by an :class:`adb.sansio.AdbTransport`.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage._SendPackets.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage._SendPackets.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        data : bytes
+            Whole ADB packets, from :meth:`adb.sansio.AdbTransport.DataToSend`
+
+        """
+        for header, payload in SplitPackets(data):
+            _BulkWriteV(usb, (header, payload))
+
+    @classmethod
+    def _ReceivePacket(cls, usb, transport, timeout_ms=None):
+        """Read one packet and pass it to an :class:`adb.sansio.AdbTransport`.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage._ReceivePacket.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage._ReceivePacket.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        transport : adb.sansio.AdbTransport
+            The state machine
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        Returns
+        -------
+        events : list
+            The events caused by the packet (see :meth:`adb.sansio.AdbTransport.ReceiveData`)
+
+        """
+        header = bytes(usb.BulkRead(cls.header_struct.size, timeout_ms))
+        events = transport.ReceiveData(header)
+
+        remaining = cls.Unpack(header)[3]
+        while remaining > 0:
+            data = usb.BulkRead(remaining, timeout_ms)
+            remaining -= len(data)
+            events += transport.ReceiveData(data)
+
+        return events
+
+    @classmethod
+    def _AcceptedKeys(cls):
+        """Get the fingerprint of the key that each device accepted, loading them from ``accepted_keys_path`` the first time.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage._AcceptedKeys.CALLER_GRAPH.svg
+
+        Returns
+        -------
+        dict
+            ``_accepted_keys[serial]`` is the fingerprint of the key that the device accepted last (see
+            :func:`_KeyFingerprint`)
+
+        """
+        if cls._accepted_keys is not None:
+            return cls._accepted_keys
+
+        accepted_keys = {}
+        if cls.accepted_keys_path:
+            try:
+                with io.open(cls.accepted_keys_path, encoding='utf-8') as f:
+                    accepted_keys = json.load(f)
+            except (IOError, OSError, ValueError):
+                # Nothing was saved yet, or the file can't be used; the keys are just tried in order.
+                pass
+
+        if not isinstance(accepted_keys, dict):
+            accepted_keys = {}
+        cls._accepted_keys = accepted_keys
+        return accepted_keys
+
+    @classmethod
+    def AcceptedKey(cls, serial, rsa_keys):
+        """Find the key that a device accepted last time, so that it can be tried first and the keys it rejects aren't tried again.
+
+        Each key that is tried costs an RSA signature and a round trip, which adds up with several keys when devices
+        reconnect.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.AcceptedKey.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.AcceptedKey.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        serial : str, None
+            The device's serial number, or ``host:port`` for a TCP device
+        rsa_keys : list[AuthSigner]
+            The keys
+
+        Returns
+        -------
+        AuthSigner, None
+            The key in ``rsa_keys`` that ``serial`` accepted last, if any
+
+        """
+        if not serial:
+            return None
+
+        with cls._accepted_keys_lock:
+            fingerprint = cls._AcceptedKeys().get(serial)
+        if fingerprint is None:
+            return None
+
+        for rsa_key in rsa_keys:
+            if _KeyFingerprint(rsa_key) == fingerprint:
+                return rsa_key
+        return None
+
+    @classmethod
+    def RememberAcceptedKey(cls, serial, rsa_key):
+        """Remember which key a device accepted, for :meth:`AdbMessage.AcceptedKey`.
+
+        The fingerprints are saved to ``accepted_keys_path``, so that they are also used by later processes.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.RememberAcceptedKey.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.RememberAcceptedKey.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        serial : str, None
+            The device's serial number, or ``host:port`` for a TCP device; if ``None``, nothing is remembered
+        rsa_key : AuthSigner
+            The key that it accepted
+
+        """
+        if not serial:
+            return
+
+        fingerprint = _KeyFingerprint(rsa_key)
+        with cls._accepted_keys_lock:
+            accepted_keys = cls._AcceptedKeys()
+            if accepted_keys.get(serial) == fingerprint:
+                return
+
+            accepted_keys[serial] = fingerprint
+            if not cls.accepted_keys_path:
+                return
+
+            # Keys without a public key are identified by their `id()`, which means nothing to another process.
+            saved = json.dumps({key: value for key, value in accepted_keys.items() if not isinstance(value, int)}, indent=2, sort_keys=True)
+            if isinstance(saved, bytes):
+                saved = saved.decode('utf-8')
+
+            temp_path = None
+            try:
+                directory = os.path.dirname(cls.accepted_keys_path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+
+                # Another process may be reading the file, so it is replaced at once rather than rewritten in place.
+                fd, temp_path = tempfile.mkstemp(prefix='.adb_accepted_keys', suffix='.tmp', dir=directory or None)
+                with io.open(fd, 'w', encoding='utf-8') as f:
+                    f.write(saved)
+                os.rename(temp_path, cls.accepted_keys_path)
+            except (IOError, OSError):
+                # Remembering the key only saves time when reconnecting.
+                if temp_path is not None and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    @classmethod
+    def Banner(cls, usb):
+        """Get the banner that the device sent when ``usb`` was connected.
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+
+        Returns
+        -------
+        DeviceBanner
+            The device's state, properties, and features; they are empty before :meth:`AdbMessage.Connect`
+
+        """
+        return cls._transport_info.get(usb, _DEFAULT_TRANSPORT_INFO).banner
+
+    @classmethod
+    def DelayedAck(cls, usb):
+        """Whether the ``delayed_ack`` feature was negotiated for ``usb``.
+
+        Streams then have a window of bytes that can be written before waiting for ``OKAY`` packets, and ``OKAY``
+        packets say how many bytes they ack.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.DelayedAck.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.DelayedAck.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+
+        Returns
+        -------
+        bool
+            Whether both the device and :const:`HOST_FEATURES` have ``delayed_ack``
+
+        """
+        return cls.HasFeature(usb, b'delayed_ack')
+
+    @classmethod
+    def HasFeature(cls, usb, feature):
+        """Whether ``feature`` was negotiated for ``usb``.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.HasFeature.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+        feature : bytes
+            A feature from :const:`HOST_FEATURES`, e.g. ``b'shell_v2'``
+
+        Returns
+        -------
+        bool
+            Whether both the device and :const:`HOST_FEATURES` have ``feature``
+
+        """
+        return feature in cls._transport_info.get(usb, _DEFAULT_TRANSPORT_INFO).features
+
+    @classmethod
+    def MaxData(cls, usb):
+        """Get the maximum amount of data in an ADB packet sent over ``usb``.
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+
+        Returns
+        -------
+        int
+            The size negotiated by :meth:`AdbMessage.Connect`, or :const:`MAX_ADB_DATA` if ``usb`` hasn't been connected
+
+        """
+        return cls._transport_info.get(usb, _DEFAULT_TRANSPORT_INFO).max_data
+
+    @classmethod
+    def Multiplexer(cls, usb):
+        """Get the object that shares ``usb`` between ADB streams.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.Multiplexer.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+
+        Returns
+        -------
+        _StreamMultiplexer
+            The multiplexer that :meth:`AdbMessage.Connect` made for ``usb`` or, if ``usb`` hasn't been connected, one
+            with a new state machine, which is created the first time
+
+        """
+        # Imported here because it imports this module.
+        from adb import sansio  # pylint: disable=cyclic-import,import-outside-toplevel
+
+        with cls._multiplexers_lock:
+            multiplexer = cls._multiplexers.get(usb)
+            if multiplexer is None:
+                multiplexer = cls._multiplexers[usb] = _StreamMultiplexer(sansio.AdbTransport(auto_ack=False))
+            return multiplexer
+
+    @classmethod
+    def SkipsChecksum(cls, usb):
+        """Whether the ADB protocol version negotiated for ``usb`` does without checksums.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.SkipsChecksum.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            The transport
+
+        Returns
+        -------
+        bool
+            Whether the negotiated version is at least :const:`VERSION_SKIP_CHECKSUM`
+
+        """
+        return cls._transport_info.get(usb, _DEFAULT_TRANSPORT_INFO).version >= VERSION_SKIP_CHECKSUM
 
     @classmethod
     def Open(cls, usb, destination, timeout_ms=None):
@@ -746,31 +2201,17 @@ class AdbMessage(object):
 
         Raises
         ------
-        adb.adb_protocol.InvalidResponseError
-            Wrong local_id sent to us.
         adb.adb_protocol.InvalidCommandError
             Didn't get a ready response.
 
         """
-        local_id = 1
-        msg = cls(command=b'OPEN', arg0=local_id, arg1=0, data=destination + b'\0')
-        msg.Send(usb, timeout_ms)
-        cmd, remote_id, their_local_id, _ = cls.Read(usb, [b'CLSE', b'OKAY'], timeout_ms=timeout_ms)
-
-        if local_id != their_local_id:
-            raise InvalidResponseError('Expected the local_id to be {}, got {}'.format(local_id, their_local_id))
-
-        if cmd == b'CLSE':
-            # Some devices seem to be sending CLSE once more after a request, this *should* handle it
-            cmd, remote_id, their_local_id, _ = cls.Read(usb, [b'CLSE', b'OKAY'], timeout_ms=timeout_ms)
+        multiplexer = cls.Multiplexer(usb)
+        connection = _AdbConnection(usb, timeout_ms, cls.MaxData(usb), multiplexer)
+        if not multiplexer.Open(usb, connection, destination, timeout_ms):
             # Device doesn't support this service.
-            if cmd == b'CLSE':
-                return None
+            return None
 
-        if cmd != b'OKAY':
-            raise InvalidCommandError('Expected a ready response, got {}'.format(cmd), cmd, (remote_id, their_local_id))
-
-        return _AdbConnection(usb, local_id, remote_id, timeout_ms)
+        return connection
 
     @classmethod
     def Command(cls, usb, service, command='', timeout_ms=None):
@@ -800,21 +2241,46 @@ class AdbMessage(object):
 
         Raises
         ------
-        adb.adb_protocol.InterleavedDataError
-            Multiple streams running over usb.
         adb.adb_protocol.InvalidCommandError
             Got an unexpected response command.
 
         """
-        return ''.join(cls.StreamingCommand(usb, service, command, timeout_ms))
+        return cls.RawCommand(usb, service, command, timeout_ms).decode('utf8')
+
+    @classmethod
+    def RawCommand(cls, usb, service, command='', timeout_ms=None):
+        """Like :meth:`AdbMessage.Command`, but return the response as bytes, without decoding it.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.RawCommand.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.RawCommand.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            A :class:`adb.common.TcpHandle` or :class:`adb.common.UsbHandle` instance with ``BulkRead`` and ``BulkWrite`` methods.
+        service : bytes
+            The service on the device to talk to.
+        command : str, bytes
+            The command to send to the service.
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+
+        Returns
+        -------
+        bytes
+            The response from the service.
+
+        """
+        return b''.join(cls.StreamingRawCommand(usb, service, command, timeout_ms))
 
     @classmethod
     def StreamingCommand(cls, usb, service, command='', timeout_ms=None):
         """One complete set of USB packets for a single command.
 
-        Sends ``service:command`` in a new connection, reading the data for the
-        response. All the data is held in memory, large responses will be slow and
-        can fill up memory.
+        Sends ``service:command`` in a new connection, yielding the response as it
+        arrives, decoded as UTF-8. A character that is split between two packets is
+        yielded with the second one.
 
         .. image:: _static/adb.adb_protocol.AdbMessage.StreamingCommand.CALL_GRAPH.svg
 
@@ -838,8 +2304,41 @@ class AdbMessage(object):
 
         Raises
         ------
-        adb.adb_protocol.InterleavedDataError
-            Multiple streams running over usb.
+        adb.adb_protocol.InvalidCommandError
+            Got an unexpected response command.
+
+        """
+        for text in DecodeChunks(cls.StreamingRawCommand(usb, service, command, timeout_ms, copy=False)):
+            yield text
+
+    @classmethod
+    def StreamingRawCommand(cls, usb, service, command='', timeout_ms=None, copy=True):
+        """Like :meth:`AdbMessage.StreamingCommand`, but yield the response as bytes, without decoding it.
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.StreamingRawCommand.CALL_GRAPH.svg
+
+        .. image:: _static/adb.adb_protocol.AdbMessage.StreamingRawCommand.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            A :class:`adb.common.TcpHandle` or :class:`adb.common.UsbHandle` instance with ``BulkRead`` and ``BulkWrite`` methods.
+        service : bytes
+            The service on the device to talk to.
+        command : str, bytes
+            The command to send to the service.
+        timeout_ms : int, None
+            Timeout in milliseconds for USB packets.
+        copy : bool
+            If ``False``, yield views of the receive buffer, which are only valid until the next one is yielded
+
+        Yields
+        ------
+        bytes, memoryview
+            The payload of each packet of the response
+
+        Raises
+        ------
         adb.adb_protocol.InvalidCommandError
             Got an unexpected response command.
 
@@ -848,13 +2347,12 @@ class AdbMessage(object):
             command = command.encode('utf8')
 
         connection = cls.Open(usb, destination=b'%s:%s' % (service, command), timeout_ms=timeout_ms)
-        for data in connection.ReadUntilClose():
-            yield data.decode('utf8')
+        for data in connection.ReadUntilClose(copy):
+            yield data
 
     @classmethod
     def InteractiveShellCommand(cls, conn, cmd=None, strip_cmd=True, delim=None, strip_delim=True, clean_stdout=True):
         """Retrieves stdout of the current InteractiveShell and sends a shell command if provided
-        TODO: Should we turn this into a yield based function so we can stream all output?
 
         .. image:: _static/adb.adb_protocol.AdbMessage.InteractiveShellCommand.CALL_GRAPH.svg
 
@@ -862,125 +2360,124 @@ class AdbMessage(object):
         ----------
         conn : AdbConnection
             Instance of AdbConnection
-        cmd : str, None
+        cmd : str, bytes, None
             Command to run on the target.
         strip_cmd : bool
             Strip command name from stdout.
-        delim : TODO
+        delim : str, bytes, None
             Delimiter to look for in the output to know when to stop expecting more output (usually the shell prompt)
         strip_delim : bool
             Strip the provided delimiter from the output
         clean_stdout : bool
-            Cleanup the stdout stream of any backspaces and the characters that were deleted by the backspace
+            Cleanup the stdout stream of any backspaces and the characters that were deleted by the backspace, and
+            end lines with ``\\n``
 
         Returns
         -------
-        stdout : TODO
+        stdout : bytes
             The stdout from the shell command.
 
         """
         if delim is not None and not isinstance(delim, bytes):
             delim = delim.encode('utf-8')
-
-        # Delimiter may be shell@hammerhead:/ $
-        # The user or directory could change, making the delimiter somthing like root@hammerhead:/data/local/tmp $
-        # Handle a partial delimiter to search on and clean up
-        if delim:
-            user_pos = delim.find(b'@')
-            dir_pos = delim.rfind(b':/')
-            if user_pos != -1 and dir_pos != -1:
-                partial_delim = delim[user_pos:dir_pos + 1]  # e.g. @hammerhead:
-            else:
-                partial_delim = delim
-        else:
-            partial_delim = None
+        if cmd is not None and not isinstance(cmd, bytes):
+            cmd = cmd.encode('utf-8')
 
         stdout = ''
-        stdout_stream = BytesIO()
-        original_cmd = ''
 
         try:
+            chunks = cls._InteractiveShellChunks(conn, cmd, delim)
+            stdout = b''.join(terminal.CleanTerminalOutput(chunks, _PartialDelimiter(delim), clean_stdout))
 
-            if cmd:
-                original_cmd = str(cmd)
-                cmd += '\r'  # Required. Send a carriage return right after the cmd
-                cmd = cmd.encode('utf8')
-
-                # Send the cmd raw
-                conn.Write(cmd)
+            # Strip original cmd that will come back in stdout, and anything before it
+            if cmd and strip_cmd:
+                echo = cmd + (b'\n' if clean_stdout else b'\r\r\n')
+                pos = stdout.find(echo)
+                if pos >= 0:
+                    stdout = stdout[pos + len(echo):]
 
-                if delim:
-                    # Expect multiple WRTE cmds until the delim (usually terminal prompt) is detected
-
-                    data = b''
-                    while partial_delim not in data:
-                        cmd, data = conn.ReadUntil(b'WRTE')
-                        stdout_stream.write(data)
-
-                else:
-                    # Otherwise, expect only a single WRTE
-                    cmd, data = conn.ReadUntil(b'WRTE')
+            # Strip delim if requested
+            # TODO: Handling stripping partial delims here - not a deal breaker the way we're handling it now
+            if delim and strip_delim:
+                stdout = stdout.replace(delim, b'')
 
-                    # WRTE cmd from device will follow with stdout data
-                    stdout_stream.write(data)
+            stdout = stdout.rstrip()
 
-            else:
+        except Exception as e:  # pylint: disable=broad-except
+            print("InteractiveShell exception (most likely timeout): {}".format(e))
 
-                # No cmd provided means we should just expect a single line from the terminal. Use this sparingly
-                cmd, data = conn.ReadUntil(b'WRTE')
-                if cmd == b'WRTE':
-                    # WRTE cmd from device will follow with stdout data
-                    stdout_stream.write(data)
-                else:
-                    print("Unhandled cmd: {}".format(cmd))
+        return stdout
 
-            cleaned_stdout_stream = BytesIO()
-            if clean_stdout:
-                stdout_bytes = stdout_stream.getvalue()
+    @classmethod
+    def StreamingInteractiveShellCommand(cls, conn, cmd=None, strip_cmd=True, delim=None):
+        """Send a shell command to the current InteractiveShell and yield the cleaned up stdout as it arrives.
 
-                bsruns = {}  # Backspace runs tracking
-                next_start_pos = 0
-                last_run_pos, last_run_len = find_backspace_runs(stdout_bytes, next_start_pos)
+        .. image:: _static/adb.adb_protocol.AdbMessage.StreamingInteractiveShellCommand.CALL_GRAPH.svg
 
-                if last_run_pos != -1 and last_run_len != 0:
-                    bsruns.update({last_run_pos: last_run_len})
-                    cleaned_stdout_stream.write(stdout_bytes[next_start_pos:(last_run_pos - last_run_len)])
-                    next_start_pos += last_run_pos + last_run_len
+        .. image:: _static/adb.adb_protocol.AdbMessage.StreamingInteractiveShellCommand.CALLER_GRAPH.svg
 
-                while last_run_pos != -1:
-                    last_run_pos, last_run_len = find_backspace_runs(stdout_bytes[next_start_pos:], next_start_pos)
+        Parameters
+        ----------
+        conn : AdbConnection
+            Instance of AdbConnection
+        cmd : str, bytes, None
+            Command to run on the target.
+        strip_cmd : bool
+            Don't yield the echo of the command.
+        delim : str, bytes, None
+            Delimiter to look for in the output to know when to stop expecting more output (usually the shell prompt)
 
-                    if last_run_pos != -1:
-                        bsruns.update({last_run_pos: last_run_len})
-                        cleaned_stdout_stream.write(stdout_bytes[next_start_pos:(last_run_pos - last_run_len)])
-                        next_start_pos += last_run_pos + last_run_len
+        Yields
+        ------
+        bytes
+            The stdout, one or more lines at a time, with the backspaces applied and lines ending in ``\\n``; the last
+            piece is the line with the delimiter
 
-                cleaned_stdout_stream.write(stdout_bytes[next_start_pos:])
+        """
+        if delim is not None and not isinstance(delim, bytes):
+            delim = delim.encode('utf-8')
+        if cmd is not None and not isinstance(cmd, bytes):
+            cmd = cmd.encode('utf-8')
 
-            else:
-                cleaned_stdout_stream.write(stdout_stream.getvalue())
+        echo = cmd if cmd and strip_cmd else None
+        for output in terminal.CleanTerminalOutput(cls._InteractiveShellChunks(conn, cmd, delim), _PartialDelimiter(delim)):
+            if echo is not None:
+                # The first line is the echo of the command, maybe after what was left of the prompt.
+                end = output.find(b'\n')
+                if end >= 0 and output[:end].endswith(echo):
+                    output = output[end + 1:]
+                echo = None
 
-            stdout = cleaned_stdout_stream.getvalue()
+            if output:
+                yield output
 
-            # Strip original cmd that will come back in stdout
-            if original_cmd and strip_cmd:
-                findstr = original_cmd.encode('utf-8') + b'\r\r\n'
-                pos = stdout.find(findstr)
-                while pos >= 0:
-                    stdout = stdout.replace(findstr, b'')
-                    pos = stdout.find(findstr)
+    @staticmethod
+    def _InteractiveShellChunks(conn, cmd, delim):
+        """Send a command to the current InteractiveShell and read its output.
 
-                if b'\r\r\n' in stdout:
-                    stdout = stdout.split(b'\r\r\n')[1]
+        .. image:: _static/adb.adb_protocol.AdbMessage._InteractiveShellChunks.CALLER_GRAPH.svg
 
-            # Strip delim if requested
-            # TODO: Handling stripping partial delims here - not a deal breaker the way we're handling it now
-            if delim and strip_delim:
-                stdout = stdout.replace(delim, b'')
+        Parameters
+        ----------
+        conn : AdbConnection
+            Instance of AdbConnection
+        cmd : bytes, None
+            Command to run on the target.
+        delim : bytes, None
+            If ``cmd`` and ``delim`` are given, keep reading until the caller stops; otherwise, read a single packet.
 
-            stdout = stdout.rstrip()
+        Yields
+        ------
+        bytes
+            The data of each ``WRTE`` packet
 
-        except Exception as e:  # pylint: disable=broad-except
-            print("InteractiveShell exception (most likely timeout): {}".format(e))
+        """
+        if cmd:
+            # Send the cmd raw, followed by the required carriage return
+            conn.Write(cmd + b'\r')
 
-        return stdout
+        while True:
+            _, data = conn.ReadUntil(b'WRTE')
+            yield data
+            if not (cmd and delim):
+                return
@@ -0,0 +1,545 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The I/O of :class:`adb.adb_commands_async.AsyncAdbCommands`.
+
+:class:`TcpIO` sends and receives bytes with asyncio streams, and :class:`UsbIO` with libusb's asynchronous transfers,
+whose file descriptors are watched by the event loop. Both have the same coroutines, ``Read``, ``Write`` and ``Close``.
+:class:`AsyncConnection` is a stream to a service on the device, over either of them.
+
+This module requires Python 3.6 or later.
+
+
+.. rubric:: Contents
+
+* :class:`AsyncConnection`
+
+    * :meth:`AsyncConnection.Close`
+    * :meth:`AsyncConnection.Read`
+    * :meth:`AsyncConnection.Write`
+
+* :func:`InExecutor`
+* :func:`Seconds`
+* :class:`TcpIO`
+
+    * :meth:`TcpIO.Close`
+    * :meth:`TcpIO.Open`
+    * :meth:`TcpIO.Read`
+    * :meth:`TcpIO.Write`
+
+* :class:`UsbIO`
+
+    * :meth:`UsbIO._AddFD`
+    * :meth:`UsbIO._HandleEvents`
+    * :meth:`UsbIO._OnReadDone`
+    * :meth:`UsbIO._OnWriteDone`
+    * :meth:`UsbIO._Poll`
+    * :meth:`UsbIO._RemoveFD`
+    * :meth:`UsbIO.Close`
+    * :meth:`UsbIO.Read`
+    * :meth:`UsbIO.Write`
+
+"""
+
+import asyncio
+import functools
+import select
+import socket
+
+import libusb1
+import usb1
+
+from adb import adb_protocol
+from adb import common
+from adb import usb_exceptions
+
+
+#: Size of the reads from a TCP connection
+TCP_READ_SIZE = common.TCP_RECV_BUFFER_SIZE
+
+#: Number of read transfers that :class:`UsbIO` keeps queued on the IN endpoint
+USB_READ_TRANSFERS = common.ASYNC_READ_TRANSFERS
+
+#: Size of each queued read transfer, in multiples of the endpoint's max packet size; adbd doesn't send zero-length
+#: packets, so a bigger transfer would wait for more data after a payload that is a multiple of the max packet size
+USB_READ_PACKETS = common.ASYNC_READ_PACKETS
+
+#: How often libusb's events are handled, in seconds, if its file descriptors can't be watched (e.g., on Windows)
+USB_POLL_INTERVAL = 0.005
+
+
+def Seconds(timeout_ms):
+    """Convert a timeout to seconds for :func:`asyncio.wait_for`.
+
+    Parameters
+    ----------
+    timeout_ms : int, float, None
+        A timeout in milliseconds, or ``None`` for no timeout
+
+    Returns
+    -------
+    float, None
+        The timeout in seconds
+
+    """
+    return timeout_ms / 1000.0 if timeout_ms else None
+
+
+async def InExecutor(func, *args):
+    """Run a blocking call, such as file I/O, in the event loop's default executor.
+
+    Parameters
+    ----------
+    func : function
+        The blocking function
+    *args
+        Its arguments
+
+    Returns
+    -------
+    object
+        What ``func`` returned
+
+    """
+    return await asyncio.get_event_loop().run_in_executor(None, functools.partial(func, *args))
+
+
+class AsyncConnection(object):
+    """A stream to a service on the device, like :class:`adb.adb_protocol._AdbConnection`.
+
+    Parameters
+    ----------
+    commands : adb.adb_commands_async.AsyncAdbCommands
+        The connection to the device
+    local_id : int
+        Our id for the stream
+    timeout_ms : int, None
+        Timeout for each read and write
+
+    Attributes
+    ----------
+    closed : bool
+        Whether the stream was closed
+    local_id : int
+        Our id for the stream
+    max_data : int
+        The maximum size of an ADB packet's payload
+    opened : asyncio.Future
+        Resolved when the device accepts or refuses the stream
+    received : asyncio.Queue
+        The data received on the stream, followed by ``None`` once it is closed
+    timeout_ms : int, None
+        Timeout for each read and write
+    writable : asyncio.Event
+        Set when everything that was written has been sent
+    _commands : adb.adb_commands_async.AsyncAdbCommands
+        The connection to the device
+
+    """
+    def __init__(self, commands, local_id, timeout_ms):
+        self.closed = False
+        self.local_id = local_id
+        self.max_data = commands._transport.info.max_data  # pylint: disable=protected-access
+        self.opened = asyncio.get_event_loop().create_future()
+        self.received = asyncio.Queue()
+        self.timeout_ms = timeout_ms
+        self.writable = asyncio.Event()
+        self._commands = commands
+
+    async def Read(self):
+        """Read the next data that the device sent on this stream.
+
+        The data is only acked once it is read, so the device doesn't send more than this end consumes.
+
+        Returns
+        -------
+        bytes, None
+            The data, or ``None`` once the stream is closed
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            Nothing was received in time.
+
+        """
+        data = await asyncio.wait_for(self.received.get(), Seconds(self.timeout_ms))
+        if data is None:
+            self.received.put_nowait(None)
+            if self._commands._error is not None:  # pylint: disable=protected-access
+                raise self._commands._error  # pylint: disable=protected-access
+            return None
+
+        self._commands._transport.Acknowledge(self.local_id, len(data))  # pylint: disable=protected-access
+        await self._commands._Send(self.timeout_ms)  # pylint: disable=protected-access
+        return data
+
+    async def Write(self, data):
+        """Write data to this stream, and wait until the device's flow control has let all of it be sent.
+
+        Parameters
+        ----------
+        data : bytes
+            The data
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The stream was closed.
+        asyncio.TimeoutError
+            The device didn't take the data in time.
+
+        """
+        if self.closed:
+            raise adb_protocol.InvalidResponseError('Stream %d is closed' % self.local_id)
+
+        transport = self._commands._transport  # pylint: disable=protected-access
+        transport.Write(self.local_id, data)
+        await self._commands._Send(self.timeout_ms)  # pylint: disable=protected-access
+        while transport.PendingBytes(self.local_id) and not self.closed:
+            self.writable.clear()
+            await asyncio.wait_for(self.writable.wait(), Seconds(self.timeout_ms))
+
+        if self._commands._error is not None:  # pylint: disable=protected-access
+            raise self._commands._error  # pylint: disable=protected-access
+
+    async def Close(self):
+        """Close this stream."""
+        if not self.closed:
+            self._commands._transport.Close(self.local_id)  # pylint: disable=protected-access
+            await self._commands._Send(self.timeout_ms)  # pylint: disable=protected-access
+
+
+class TcpIO(object):
+    """Send and receive bytes over TCP with asyncio streams.
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        The reading end of the connection
+    writer : asyncio.StreamWriter
+        The writing end of the connection
+
+    Attributes
+    ----------
+    _reader : asyncio.StreamReader
+        The reading end of the connection
+    _writer : asyncio.StreamWriter
+        The writing end of the connection
+
+    """
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def Open(cls, serial, timeout_ms=None):
+        """Connect to a device.
+
+        Parameters
+        ----------
+        serial : str
+            ``host`` or ``host:port``, like for :class:`adb.common.TcpHandle`
+        timeout_ms : int, None
+            Timeout for the connection
+
+        Returns
+        -------
+        TcpIO
+            The connection
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            The connection timed out.
+
+        """
+        host, _, port = serial.partition(':')
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, int(port or 5555)), Seconds(timeout_ms))
+        except asyncio.TimeoutError:
+            raise usb_exceptions.TcpTimeoutException('Connecting to %s timed out (%s ms)' % (serial, timeout_ms))
+
+        writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return cls(reader, writer)
+
+    async def Read(self):
+        """Receive the next bytes from the device.
+
+        Returns
+        -------
+        bytes
+            The received bytes
+
+        Raises
+        ------
+        adb.usb_exceptions.ReadFailedError
+            The device closed the connection.
+
+        """
+        data = await self._reader.read(TCP_READ_SIZE)
+        if not data:
+            raise usb_exceptions.ReadFailedError('Could not read from the device', 'connection closed')
+        return data
+
+    async def Write(self, data, timeout_ms=None):
+        """Send bytes to the device.
+
+        The data is queued before this awaits anything, so concurrent writes are sent in the order they were made.
+
+        Parameters
+        ----------
+        data : bytes
+            Whole ADB packets
+        timeout_ms : int, None
+            How long to wait for the socket's buffer to drain
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            The device didn't take the data in time.
+
+        """
+        self._writer.write(data)
+        await asyncio.wait_for(self._writer.drain(), Seconds(timeout_ms))
+
+    async def Close(self):
+        """Close the connection."""
+        self._writer.close()
+
+
+class UsbIO(object):
+    """Send and receive bytes over USB with libusb's asynchronous transfers.
+
+    libusb's file descriptors are watched by the event loop, so the transfers' callbacks run in its thread. Where libusb
+    doesn't expose them, its events are handled every :const:`USB_POLL_INTERVAL` seconds instead.
+
+    Parameters
+    ----------
+    handle : adb.common.UsbHandle
+        An open handle, found with a ``usb1.USBContext`` (see :meth:`adb.common.UsbHandle.FindAndOpen`)
+
+    Attributes
+    ----------
+    _context : usb1.USBContext
+        The context that ``handle`` was found in
+    _fds : set
+        The file descriptors that are watched by the event loop
+    _handle : adb.common.UsbHandle
+        The USB handle
+    _loop : asyncio.AbstractEventLoop
+        The event loop
+    _poll : asyncio.TimerHandle, None
+        The next call to :meth:`UsbIO._Poll`, if the file descriptors can't be watched
+    _read_transfers : list[usb1.USBTransfer]
+        The queued read transfers
+    _received : asyncio.Queue
+        The data of the completed read transfers, or the errors that they failed with
+    _writes : dict
+        ``_writes[transfer]`` is the future for each write transfer that is in flight
+
+    """
+    def __init__(self, handle):
+        self._context = handle._context  # pylint: disable=protected-access
+        self._fds = set()
+        self._handle = handle
+        self._loop = asyncio.get_event_loop()
+        self._poll = None
+        self._read_transfers = []
+        self._received = asyncio.Queue()
+        self._writes = {}
+
+        try:
+            for fd, events in self._context.getPollFDList():
+                self._AddFD(fd, events)
+            self._context.setPollFDNotifiers(self._AddFD, self._RemoveFD)
+        except NotImplementedError:
+            self._poll = self._loop.call_later(USB_POLL_INTERVAL, self._Poll)
+
+        for _ in range(USB_READ_TRANSFERS):
+            transfer = handle._handle.getTransfer()  # pylint: disable=protected-access
+            transfer.setBulk(handle._read_endpoint, handle._max_read_packet_len * USB_READ_PACKETS, callback=self._OnReadDone, timeout=0)  # pylint: disable=protected-access
+            transfer.submit()
+            self._read_transfers.append(transfer)
+
+    def _AddFD(self, fd, events, user_data=None):  # pylint: disable=unused-argument
+        """Watch one of libusb's file descriptors.
+
+        Parameters
+        ----------
+        fd : int
+            The file descriptor
+        events : int
+            ``select.POLLIN`` and/or ``select.POLLOUT``
+        user_data : None
+            Unused
+
+        """
+        self._fds.add(fd)
+        if events & select.POLLIN:
+            self._loop.add_reader(fd, self._HandleEvents)
+        if events & select.POLLOUT:
+            self._loop.add_writer(fd, self._HandleEvents)
+
+    def _RemoveFD(self, fd, user_data=None):  # pylint: disable=unused-argument
+        """Stop watching one of libusb's file descriptors.
+
+        Parameters
+        ----------
+        fd : int
+            The file descriptor
+        user_data : None
+            Unused
+
+        """
+        self._fds.discard(fd)
+        self._loop.remove_reader(fd)
+        self._loop.remove_writer(fd)
+
+    def _HandleEvents(self):
+        """Let libusb run the callbacks of the transfers that completed."""
+        self._context.handleEventsTimeout(0)
+
+    def _Poll(self):
+        """Handle libusb's events, and schedule the next call."""
+        self._HandleEvents()
+        self._poll = self._loop.call_later(USB_POLL_INTERVAL, self._Poll)
+
+    def _OnReadDone(self, transfer):
+        """Queue the data of a completed read transfer and resubmit it.
+
+        Parameters
+        ----------
+        transfer : usb1.USBTransfer
+            The transfer that completed
+
+        """
+        status = transfer.getStatus()
+        if status == usb1.TRANSFER_CANCELLED:
+            return
+
+        if status != usb1.TRANSFER_COMPLETED:
+            self._received.put_nowait(common._TRANSFER_STATUS_ERRORS.get(status, usb1.USBErrorIO)())  # pylint: disable=protected-access
+            return
+
+        self._received.put_nowait(bytes(transfer.getBuffer()[:transfer.getActualLength()]))
+        try:
+            transfer.submit()
+        except libusb1.USBError as e:
+            self._received.put_nowait(e)
+
+    def _OnWriteDone(self, transfer):
+        """Resolve the future of a completed write transfer.
+
+        Parameters
+        ----------
+        transfer : usb1.USBTransfer
+            The transfer that completed
+
+        """
+        future = self._writes.pop(transfer)
+        transfer.close()
+        if future.done():
+            return
+
+        status = transfer.getStatus()
+        if status == usb1.TRANSFER_COMPLETED:
+            future.set_result(None)
+        else:
+            error = common._TRANSFER_STATUS_ERRORS.get(status, usb1.USBErrorIO)()  # pylint: disable=protected-access
+            future.set_exception(usb_exceptions.WriteFailedError('Could not send data', error))
+
+    async def Read(self):
+        """Receive the data of the next completed read transfer.
+
+        Returns
+        -------
+        bytes
+            The received bytes
+
+        Raises
+        ------
+        adb.usb_exceptions.ReadFailedError
+            A read transfer failed.
+
+        """
+        data = await self._received.get()
+        if isinstance(data, Exception):
+            raise usb_exceptions.ReadFailedError('Could not receive data', data)
+        return data
+
+    async def Write(self, data, timeout_ms=None):
+        """Send ADB packets to the device.
+
+        Like :meth:`adb.common.UsbHandle.BulkWrite`, each packet's header and payload are sent in separate transfers.
+        They are all submitted before this awaits anything, so concurrent writes are sent in the order they were made.
+
+        Parameters
+        ----------
+        data : bytes
+            Whole ADB packets
+        timeout_ms : int, None
+            Timeout for each transfer; by default, the handle's
+
+        Raises
+        ------
+        adb.usb_exceptions.WriteFailedError
+            A write transfer failed or timed out.
+
+        """
+        chunks = [chunk for packet in adb_protocol.SplitPackets(data) for chunk in packet if chunk]
+        timeout = int(self._handle.Timeout(timeout_ms) or 0)
+
+        futures = []
+        for chunk in chunks:
+            transfer = self._handle._handle.getTransfer()  # pylint: disable=protected-access
+            transfer.setBulk(self._handle._write_endpoint, chunk, callback=self._OnWriteDone, timeout=timeout)  # pylint: disable=protected-access
+            try:
+                transfer.submit()
+            except libusb1.USBError as e:
+                transfer.close()
+                raise usb_exceptions.WriteFailedError('Could not send data', e)
+            self._writes[transfer] = self._loop.create_future()
+            futures.append(self._writes[transfer])
+
+        await asyncio.gather(*futures)
+
+    async def Close(self):
+        """Cancel the transfers, stop watching libusb's file descriptors, and close the handle."""
+        transfers = self._read_transfers + list(self._writes)
+        for transfer in transfers:
+            if transfer.isSubmitted():
+                try:
+                    transfer.cancel()
+                except libusb1.USBError:
+                    pass
+
+        # Cancellation is only reported through libusb's events.
+        for _ in range(10):
+            if not any(transfer.isSubmitted() for transfer in transfers):
+                break
+            await asyncio.sleep(USB_POLL_INTERVAL)
+            self._HandleEvents()
+
+        if self._poll is not None:
+            self._poll.cancel()
+        else:
+            self._context.setPollFDNotifiers(None, None)
+        for fd in list(self._fds):
+            self._RemoveFD(fd)
+
+        for transfer in self._read_transfers:
+            if not transfer.isSubmitted():
+                transfer.close()
+        self._read_transfers = []
+        self._handle.Close()
@@ -0,0 +1,234 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checksum engines for ADB packets.
+
+Before protocol version 0x01000001, every ADB packet carries the sum of the bytes of its payload. This module
+computes that sum with the fastest engine available (see :data:`ENGINES`), which can be changed with
+:func:`SetEngine`. Run ``python -m adb.checksum`` to compare the engines on this machine.
+
+USB and TCP already detect corrupted data, so :func:`TrustTransport` can be used to stop checking the checksums of
+received packets.
+
+
+.. rubric:: Contents
+
+* :func:`Benchmark`
+* :func:`Calculate`
+* :func:`GetEngine`
+* :func:`IsTransportTrusted`
+* :func:`main`
+* :func:`NumpyChecksum`
+* :func:`PythonChecksum`
+* :func:`SetEngine`
+* :func:`TrustTransport`
+
+"""
+
+import os
+import sys
+import timeit
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+#: Payloads shorter than this are summed by :func:`PythonChecksum` in :func:`NumpyChecksum`, which is faster for them
+NUMPY_MIN_SIZE = 512
+
+#: Payload sizes used by :func:`Benchmark`
+BENCHMARK_SIZES = (24, 512, 4096, 64 * 1024, 256 * 1024, 1024 * 1024)
+
+
+def PythonChecksum(data):
+    """Sum the bytes of ``data`` with the built-in ``sum()``.
+
+    Parameters
+    ----------
+    data : bytes, bytearray, memoryview, str
+        The payload of an ADB packet
+
+    Returns
+    -------
+    int
+        The sum of the bytes of ``data``, modulo 2**32
+
+    """
+    try:
+        return sum(data) & 0xFFFFFFFF
+    except TypeError:
+        # Python 2 strings and memoryviews and unicode strings iterate as characters.
+        return sum(map(ord, data)) & 0xFFFFFFFF
+
+
+def NumpyChecksum(data):
+    """Sum the bytes of ``data`` with ``numpy``, without copying it.
+
+    Parameters
+    ----------
+    data : bytes, bytearray, memoryview
+        The payload of an ADB packet
+
+    Returns
+    -------
+    int
+        The sum of the bytes of ``data``, modulo 2**32
+
+    """
+    if len(data) < NUMPY_MIN_SIZE:
+        return PythonChecksum(data)
+
+    try:
+        array = numpy.frombuffer(data, dtype=numpy.uint8)
+    except (AttributeError, TypeError):
+        # Unicode strings (should never see?)
+        return PythonChecksum(data)
+    return int(array.sum(dtype=numpy.uint64)) & 0xFFFFFFFF
+
+
+#: The available checksum engines, by name
+ENGINES = {'python': PythonChecksum}
+if numpy is not None:
+    ENGINES['numpy'] = NumpyChecksum
+
+#: The engine used by default: ``'numpy'`` if it is installed, else ``'python'``
+DEFAULT_ENGINE = 'numpy' if numpy is not None else 'python'
+
+_engine = ENGINES[DEFAULT_ENGINE]
+_trust_transport = False
+
+
+def Calculate(data):
+    """Compute the checksum of an ADB payload with the current engine.
+
+    Parameters
+    ----------
+    data : bytes, bytearray, memoryview
+        The payload of an ADB packet
+
+    Returns
+    -------
+    int
+        The sum of the bytes of ``data``, modulo 2**32
+
+    """
+    return _engine(data)
+
+
+def GetEngine():
+    """Get the current checksum engine.
+
+    Returns
+    -------
+    function
+        The function that :func:`Calculate` uses
+
+    """
+    return _engine
+
+
+def SetEngine(engine):
+    """Change the checksum engine.
+
+    Parameters
+    ----------
+    engine : str, function
+        The name of an engine in :data:`ENGINES`, or a function that takes a payload and returns its checksum
+
+    Raises
+    ------
+    ValueError
+        ``engine`` is not the name of an available engine.
+
+    """
+    global _engine  # pylint: disable=global-statement
+
+    if not callable(engine):
+        if engine not in ENGINES:
+            raise ValueError('Unknown checksum engine {!r}, expected one of {}'.format(engine, sorted(ENGINES)))
+        engine = ENGINES[engine]
+    _engine = engine
+
+
+def TrustTransport(trust=True):
+    """Choose whether to check the checksums of received ADB packets.
+
+    Parameters
+    ----------
+    trust : bool
+        If ``True``, received checksums are not checked; outgoing packets still have them, since the device checks them
+
+    """
+    global _trust_transport  # pylint: disable=global-statement
+    _trust_transport = trust
+
+
+def IsTransportTrusted():
+    """Whether the checksums of received ADB packets are skipped (see :func:`TrustTransport`).
+
+    Returns
+    -------
+    bool
+        ``True`` if received checksums are not checked
+
+    """
+    return _trust_transport
+
+
+def Benchmark(sizes=BENCHMARK_SIZES, number=None):
+    """Time each engine in :data:`ENGINES` on random payloads.
+
+    Parameters
+    ----------
+    sizes : list[int], tuple[int]
+        The payload sizes to try
+    number : int, None
+        How many times to compute each checksum; by default, enough to sum about 16 MiB per engine and size
+
+    Returns
+    -------
+    results : dict
+        ``results[size][name]`` is the time in seconds that engine ``name`` takes to sum a payload of ``size`` bytes
+
+    """
+    results = {}
+    for size in sizes:
+        data = os.urandom(size)
+        repeat = number or max(16 * 1024 * 1024 // size, 10)
+        results[size] = {name: timeit.timeit(lambda engine=engine, data=data: engine(data), number=repeat) / repeat for name, engine in ENGINES.items()}
+    return results
+
+
+def main():
+    """Print a table of :func:`Benchmark` results.
+
+    Returns
+    -------
+    int
+        0
+
+    """
+    results = Benchmark()
+    names = sorted(ENGINES)
+    sys.stdout.write('{:>10}'.format('bytes') + ''.join('{:>14}'.format(name) for name in names) + '\n')
+    for size in sorted(results):
+        sys.stdout.write('{:>10}'.format(size) + ''.join('{:>12.2f}us'.format(results[size][name] * 1e6) for name in names) + '\n')
+    sys.stdout.write('default engine: {}\n'.format(DEFAULT_ENGINE))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
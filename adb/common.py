@@ -19,29 +19,59 @@ Common usb browsing and usb communication.
 
 .. rubric:: Contents
 
+* :class:`_AsyncBulkReader`
+
+    * :meth:`_AsyncBulkReader._OnTransferDone`
+    * :meth:`_AsyncBulkReader.Close`
+    * :meth:`_AsyncBulkReader.Read`
+    * :meth:`_AsyncBulkReader.ReadInto`
+
+* :class:`_AsyncBulkWriter`
+
+    * :meth:`_AsyncBulkWriter._OnTransferDone`
+    * :meth:`_AsyncBulkWriter.Close`
+    * :meth:`_AsyncBulkWriter.Flush`
+    * :meth:`_AsyncBulkWriter.RaiseError`
+    * :meth:`_AsyncBulkWriter.Write`
+
 * :func:`GetInterface`
 * :func:`InterfaceMatcher`
 * :class:`TcpHandle`
 
     * :meth:`TcpHandle._connect`
+    * :meth:`TcpHandle._RecvInto`
+    * :meth:`TcpHandle._SendAll`
+    * :meth:`TcpHandle._WaitUntilWriteable`
     * :meth:`TcpHandle.BulkRead`
+    * :meth:`TcpHandle.BulkReadInto`
     * :meth:`TcpHandle.BulkWrite`
+    * :meth:`TcpHandle.BulkWriteAsync`
+    * :meth:`TcpHandle.BulkWriteV`
     * :meth:`TcpHandle.Close`
+    * :meth:`TcpHandle.FlushWrites`
+    * :meth:`TcpHandle.SendFile`
     * :meth:`TcpHandle.serial_number`
     * :meth:`TcpHandle.Timeout`
     * :meth:`TcpHandle.TimeoutSeconds`
 
 * :class:`UsbHandle`
 
+    * :meth:`UsbHandle._StopAsyncReads`
+    * :meth:`UsbHandle._StopAsyncWrites`
+    * :meth:`UsbHandle._WriteFailed`
     * :meth:`UsbHandle.BulkRead`
     * :meth:`UsbHandle.BulkReadAsync`
+    * :meth:`UsbHandle.BulkReadInto`
     * :meth:`UsbHandle.BulkWrite`
+    * :meth:`UsbHandle.BulkWriteAsync`
+    * :meth:`UsbHandle.BulkWriteV`
     * :meth:`UsbHandle.Close`
     * :meth:`UsbHandle.Find`
     * :meth:`UsbHandle.FindAndOpen`
     * :meth:`UsbHandle.FindDevices`
     * :meth:`UsbHandle.FindFirst`
     * :meth:`UsbHandle.FlushBuffers`
+    * :meth:`UsbHandle.FlushWrites`
     * :meth:`UsbHandle.Open`
     * :meth:`UsbHandle.port_path`
     * :meth:`UsbHandle.PortPathMatcher`
@@ -52,12 +82,15 @@ Common usb browsing and usb communication.
 
 """
 
+import collections
 import logging
+import os
 import platform
 import re
 import select
 import socket
 import threading
+import time
 import weakref
 
 import libusb1
@@ -75,11 +108,32 @@ from adb import usb_exceptions
 #: Default timeout
 DEFAULT_TIMEOUT_MS = 10000
 
+#: Number of read transfers :meth:`UsbHandle.BulkReadAsync` keeps queued on the IN endpoint
+ASYNC_READ_TRANSFERS = 32
+
+#: Size of each queued read transfer, in multiples of the endpoint's max packet size
+ASYNC_READ_PACKETS = 1
+
+#: Number of write transfers :meth:`UsbHandle.BulkWriteAsync` keeps queued on the OUT endpoint
+ASYNC_WRITE_TRANSFERS = 4
+
+#: Size of the buffer :meth:`TcpHandle.BulkRead` receives into
+TCP_RECV_BUFFER_SIZE = 64 * 1024
+
 SYSFS_PORT_SPLIT_RE = re.compile("[,/:.-]")
 
 _LOG = logging.getLogger('android_usb')
 
 
+#: libusb errors matching the status of a failed asynchronous transfer
+_TRANSFER_STATUS_ERRORS = {
+    usb1.TRANSFER_TIMED_OUT: usb1.USBErrorTimeout,
+    usb1.TRANSFER_STALL: usb1.USBErrorPipe,
+    usb1.TRANSFER_NO_DEVICE: usb1.USBErrorNoDevice,
+    usb1.TRANSFER_OVERFLOW: usb1.USBErrorOverflow,
+}
+
+
 def GetInterface(setting):
     """Get the class, subclass, and protocol for the given USB setting.
 
@@ -134,6 +188,316 @@ def InterfaceMatcher(clazz, subclass, protocol):
     return Matcher
 
 
+class _AsyncBulkReader(object):
+    """Keeps a pool of bulk IN transfers queued on an endpoint.
+
+    Completed transfers are resubmitted from the libusb callback, so the endpoint always has reads in flight while
+    the consumer is still busy with the data that already arrived.
+
+    Parameters
+    ----------
+    handle : usb1.USBDeviceHandle
+        The open device handle.
+    context : usb1.USBContext
+        The context the device belongs to. Its events are handled from :meth:`_AsyncBulkReader.Read`.
+    endpoint : int
+        The IN endpoint address.
+    num_transfers : int
+        Number of transfers to keep queued.
+    transfer_size : int
+        Size of each transfer. Keep this at the endpoint's max packet size unless the device ends every write with a
+        short or zero-length packet; otherwise a transfer can sit half full waiting for data the device won't send
+        until we reply.
+
+    Attributes
+    ----------
+    _completed : collections.deque
+        ``(data, ends_write)`` tuples for transfers that completed but haven't been consumed yet. ``ends_write`` is
+        ``True`` when the transfer was short, i.e. it holds the end of a write from the device.
+    _context : usb1.USBContext
+        The context the device belongs to.
+    _error : usb1.USBError, None
+        The error reported by the first transfer that failed.
+    _running : bool
+        Whether completed transfers are resubmitted.
+    _transfer_size : int
+        Size of each transfer.
+    _transfers : list[usb1.USBTransfer]
+        The pool of transfers.
+
+    """
+    def __init__(self, handle, context, endpoint, num_transfers, transfer_size):
+        self._context = context
+        self._transfer_size = transfer_size
+        self._completed = collections.deque()
+        self._error = None
+        self._running = True
+        self._transfers = []
+
+        for _ in range(num_transfers):
+            transfer = handle.getTransfer()
+            transfer.setBulk(endpoint, transfer_size, callback=self._OnTransferDone, timeout=0)
+            self._transfers.append(transfer)
+
+        for transfer in self._transfers:
+            transfer.submit()
+
+    def _OnTransferDone(self, transfer):
+        """Queue the data of a completed transfer and resubmit it.
+
+        Parameters
+        ----------
+        transfer : usb1.USBTransfer
+            The transfer that completed.
+
+        """
+        status = transfer.getStatus()
+        if status == usb1.TRANSFER_CANCELLED:
+            return
+
+        if status != usb1.TRANSFER_COMPLETED:
+            if self._error is None:
+                self._error = _TRANSFER_STATUS_ERRORS.get(status, usb1.USBErrorIO)()
+            return
+
+        length = transfer.getActualLength()
+        self._completed.append((bytearray(transfer.getBuffer()[:length]), length < self._transfer_size))
+
+        if self._running:
+            try:
+                transfer.submit()
+            except libusb1.USBError as e:
+                if self._error is None:
+                    self._error = e
+
+    def Read(self, length, timeout_ms):
+        """Read up to ``length`` bytes from the completed transfers.
+
+        Like a synchronous bulk read, this returns once ``length`` bytes are available or the device finished a write.
+
+        Parameters
+        ----------
+        length : int
+            The maximum number of bytes to return.
+        timeout_ms : int
+            Timeout in milliseconds, ``0`` to wait forever.
+
+        Returns
+        -------
+        data : bytearray
+            The data that was read.
+
+        Raises
+        ------
+        libusb1.USBError
+            A transfer failed, or no data arrived before the timeout.
+
+        """
+        data = bytearray(length)
+        view = memoryview(data)
+        received = self.ReadInto(view, timeout_ms)
+        del view
+        del data[received:]
+        return data
+
+    def ReadInto(self, view, timeout_ms):
+        """Copy up to ``len(view)`` bytes from the completed transfers into ``view``.
+
+        Like :meth:`_AsyncBulkReader.Read`, this returns once ``view`` is full or the device finished a write.
+
+        Parameters
+        ----------
+        view : memoryview
+            Where to put the data.
+        timeout_ms : int
+            Timeout in milliseconds, ``0`` to wait forever.
+
+        Returns
+        -------
+        received : int
+            The number of bytes that were copied into ``view``.
+
+        Raises
+        ------
+        libusb1.USBError
+            A transfer failed, or no data arrived before the timeout.
+
+        """
+        deadline = time.time() + timeout_ms / 1000.0 if timeout_ms else None
+        length = len(view)
+        received = 0
+
+        while received < length:
+            if self._completed:
+                chunk, ends_write = self._completed.popleft()
+                needed = length - received
+                if len(chunk) > needed:
+                    self._completed.appendleft((chunk[needed:], ends_write))
+                    chunk, ends_write = chunk[:needed], False
+
+                view[received:received + len(chunk)] = chunk
+                received += len(chunk)
+                if ends_write and received:
+                    break
+                continue
+
+            if self._error is not None:
+                raise self._error
+
+            if deadline is None:
+                self._context.handleEvents()
+                continue
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                # Keep what we got so far for the next read.
+                if received:
+                    self._completed.appendleft((bytearray(view[:received]), False))
+                raise usb1.USBErrorTimeout()
+            self._context.handleEventsTimeout(remaining)
+
+        return received
+
+    def Close(self):
+        """Cancel the queued transfers and release them."""
+        self._running = False
+        for transfer in self._transfers:
+            if transfer.isSubmitted():
+                try:
+                    transfer.cancel()
+                except libusb1.USBError:
+                    pass
+
+        # Cancellation is only reported through the event loop.
+        for _ in range(10):
+            if not any(transfer.isSubmitted() for transfer in self._transfers):
+                break
+            self._context.handleEventsTimeout(0.1)
+
+        for transfer in self._transfers:
+            if not transfer.isSubmitted():
+                transfer.close()
+        self._transfers = []
+
+
+class _AsyncBulkWriter(object):
+    """Keeps up to ``num_transfers`` bulk OUT transfers queued on an endpoint.
+
+    Writes return as soon as their transfer is submitted, and only block when every transfer is in flight. A failed
+    transfer is reported by the next call to :meth:`_AsyncBulkWriter.Write` or :meth:`_AsyncBulkWriter.Flush`.
+
+    Parameters
+    ----------
+    handle : usb1.USBDeviceHandle
+        The open device handle.
+    context : usb1.USBContext
+        The context the device belongs to.
+    endpoint : int
+        The OUT endpoint address.
+    num_transfers : int
+        Maximum number of transfers in flight.
+
+    Attributes
+    ----------
+    _context : usb1.USBContext
+        The context the device belongs to.
+    _endpoint : int
+        The OUT endpoint address.
+    _error : tuple, None
+        ``(usb_error, length)`` for the first queued write that failed since the last one was reported.
+    _idle : list[usb1.USBTransfer]
+        Transfers that can be submitted.
+    _transfers : list[usb1.USBTransfer]
+        All of the transfers.
+
+    """
+    def __init__(self, handle, context, endpoint, num_transfers):
+        self._context = context
+        self._endpoint = endpoint
+        self._error = None
+        self._transfers = [handle.getTransfer() for _ in range(num_transfers)]
+        self._idle = list(self._transfers)
+
+    def _OnTransferDone(self, transfer):
+        """Record the outcome of a transfer and make it available again.
+
+        Parameters
+        ----------
+        transfer : usb1.USBTransfer
+            The transfer that completed.
+
+        """
+        status = transfer.getStatus()
+        if status not in (usb1.TRANSFER_COMPLETED, usb1.TRANSFER_CANCELLED) and self._error is None:
+            self._error = (_TRANSFER_STATUS_ERRORS.get(status, usb1.USBErrorIO)(), transfer.getUserData())
+        self._idle.append(transfer)
+
+    def RaiseError(self):
+        """Raise the error of the first queued write that failed, if any.
+
+        Raises
+        ------
+        libusb1.USBError
+            A queued write failed. Its ``length`` attribute is the size of that write.
+
+        """
+        if self._error is None:
+            return
+        (error, length), self._error = self._error, None
+        error.length = length
+        raise error
+
+    def Write(self, data, timeout_ms):
+        """Queue ``data`` to be written, waiting for a free transfer if they are all in flight.
+
+        Parameters
+        ----------
+        data : bytes, bytearray
+            The data to write. It is copied, so the caller may reuse the buffer.
+        timeout_ms : int
+            Timeout in milliseconds for this transfer, ``0`` to wait forever.
+
+        """
+        self.RaiseError()
+        while not self._idle:
+            self._context.handleEvents()
+            self.RaiseError()
+
+        transfer = self._idle.pop()
+        transfer.setBulk(self._endpoint, bytes(data), callback=self._OnTransferDone, user_data=len(data), timeout=timeout_ms)
+        try:
+            transfer.submit()
+        except libusb1.USBError:
+            self._idle.append(transfer)
+            raise
+
+    def Flush(self):
+        """Wait for all of the queued writes to finish."""
+        while len(self._idle) < len(self._transfers):
+            self._context.handleEvents()
+        self.RaiseError()
+
+    def Close(self):
+        """Cancel the queued writes and release the transfers."""
+        for transfer in self._transfers:
+            if transfer.isSubmitted():
+                try:
+                    transfer.cancel()
+                except libusb1.USBError:
+                    pass
+
+        for _ in range(10):
+            if len(self._idle) == len(self._transfers):
+                break
+            self._context.handleEventsTimeout(0.1)
+
+        for transfer in self._transfers:
+            if not transfer.isSubmitted():
+                transfer.close()
+        self._transfers = []
+        self._idle = []
+
+
 class UsbHandle(object):
     """USB communication object. Not thread-safe.
 
@@ -145,6 +509,9 @@ class UsbHandle(object):
     * `UsbHandle.BulkRead`
     * `UsbHandle.BulkWrite(bytes data)`
 
+    When ``pipeline_writes`` is set, :meth:`UsbHandle.BulkWrite` queues its data with :meth:`UsbHandle.BulkWriteAsync`
+    instead of waiting for each transfer to finish.
+
     .. image:: _static/adb.common.UsbHandle.__init__.CALLER_GRAPH.svg
 
     Parameters
@@ -157,9 +524,21 @@ class UsbHandle(object):
         String describing the usb path/serial/device, for debugging.
     timeout_ms : TODO, None
         Timeout in milliseconds for all I/O.
+    context : usb1.USBContext, None
+        The context ``device`` was found in, needed for :meth:`UsbHandle.BulkReadAsync` and
+        :meth:`UsbHandle.BulkWriteAsync`.
 
     Attributes
     ----------
+    pipeline_writes : bool
+        Whether :meth:`UsbHandle.BulkWrite` queues writes instead of waiting for them. Errors are then reported by a
+        later write or by :meth:`UsbHandle.FlushWrites`.
+    _async_reader : _AsyncBulkReader, None
+        The pool of queued read transfers, once :meth:`UsbHandle.BulkReadAsync` has been called.
+    _async_writer : _AsyncBulkWriter, None
+        The pool of write transfers, once :meth:`UsbHandle.BulkWriteAsync` has been called.
+    _context : usb1.USBContext, None
+        The context ``device`` was found in.
     _device : TODO
         libusb_device to connect to.
     _handle : TODO
@@ -183,11 +562,15 @@ class UsbHandle(object):
     _HANDLE_CACHE = weakref.WeakValueDictionary()
     _HANDLE_CACHE_LOCK = threading.Lock()
 
-    def __init__(self, device, setting, usb_info=None, timeout_ms=None):
+    def __init__(self, device, setting, usb_info=None, timeout_ms=None, context=None):
         """Initialize USB Handle."""
         self._setting = setting
         self._device = device
+        self._context = context
         self._handle = None
+        self._async_reader = None
+        self._async_writer = None
+        self.pipeline_writes = False
 
         self._interface_number = None
         self._read_endpoint = None
@@ -303,6 +686,8 @@ class UsbHandle(object):
         """
         if self._handle is None:
             return
+        self._StopAsyncReads()
+        self._StopAsyncWrites()
         try:
             self._handle.releaseInterface(self._interface_number)
             self._handle.close()
@@ -372,6 +757,12 @@ class UsbHandle(object):
         if self._handle is None:
             raise usb_exceptions.WriteFailedError('This handle has been closed, probably due to another being opened.', None)
 
+        if self.pipeline_writes and self._context is not None:
+            return self.BulkWriteAsync(data, timeout_ms)
+
+        # Report errors from queued writes before anything written after them.
+        self.FlushWrites()
+
         try:
             return self._handle.bulkWrite(self._write_endpoint, data, timeout=self.Timeout(timeout_ms))
 
@@ -405,6 +796,9 @@ class UsbHandle(object):
         """
         if self._handle is None:
             raise usb_exceptions.ReadFailedError('This handle has been closed, probably due to another being opened.', None)
+        if self._async_reader is not None:
+            # Queued transfers would otherwise receive data before this read does.
+            return self.BulkReadAsync(length, timeout_ms)
         try:
             # python-libusb1 > 1.6 exposes bytearray()s now instead of bytes/str.
             # To support older and newer versions, we ensure everything's bytearray()
@@ -414,23 +808,214 @@ class UsbHandle(object):
             raise usb_exceptions.ReadFailedError('Could not receive data from %s (timeout %sms)' % (self.usb_info, self.Timeout(timeout_ms)), e)
 
     def BulkReadAsync(self, length, timeout_ms=None):
-        """TODO
+        """Read from the device through a pool of queued transfers.
+
+        The first call submits :const:`ASYNC_READ_TRANSFERS` reads on the IN endpoint, which are resubmitted as soon as
+        they complete, so there's no gap on the bus between one read and the next. From then on,
+        :meth:`UsbHandle.BulkRead` is served from the same pool. The pool is stopped by :meth:`UsbHandle.Close`.
 
         Parameters
         ----------
         length : int
-            TODO
-        timeout_ms : TODO, None
-            TODO
+            The maximum number of bytes to read.
+        timeout_ms : int, None
+            Timeout in milliseconds.
+
+        Returns
+        -------
+        bytearray
+            The data that was read.
+
+        Raises
+        ------
+        usb_exceptions.ReadFailedError
+            Could not receive data
+
+        """
+        if self._handle is None:
+            raise usb_exceptions.ReadFailedError('This handle has been closed, probably due to another being opened.', None)
+
+        if self._context is None:
+            # Without the context there is no way to handle the transfers' events.
+            return self.BulkRead(length, timeout_ms)
+
+        try:
+            if self._async_reader is None:
+                self._async_reader = _AsyncBulkReader(self._handle, self._context, self._read_endpoint, ASYNC_READ_TRANSFERS,
+                                                      self._max_read_packet_len * ASYNC_READ_PACKETS)
+            return self._async_reader.Read(length, self.Timeout(timeout_ms))
+        except libusb1.USBError as e:
+            if e.value != LIBUSB_ERROR_TIMEOUT:
+                self._StopAsyncReads()
+            raise usb_exceptions.ReadFailedError('Could not receive data from %s (timeout %sms)' % (self.usb_info, self.Timeout(timeout_ms)), e)
+
+    def BulkReadInto(self, view, timeout_ms=None):
+        """Read up to ``len(view)`` bytes from the device into ``view``.
+
+        When the queued transfers of :meth:`UsbHandle.BulkReadAsync` are running, their data is copied straight into
+        ``view``. Otherwise, libusb1 has no way to read into our memory, so this is :meth:`UsbHandle.BulkRead` followed
+        by a copy.
+
+        .. image:: _static/adb.common.UsbHandle.BulkReadInto.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        view : memoryview
+            Where to put the data
+        timeout_ms : int, None
+            Timeout in milliseconds.
+
+        Returns
+        -------
+        received : int
+            The number of bytes that were read, which is less than ``len(view)`` if the device wrote less
 
         Raises
         ------
-        NotImplementedError
-            This is always raised because this method is not implemented.
+        usb_exceptions.ReadFailedError
+            Could not receive data
 
         """
-        # See: https://pypi.python.org/pypi/libusb1 "Asynchronous I/O" section
-        raise NotImplementedError
+        if self._async_reader is not None:
+            try:
+                return self._async_reader.ReadInto(view, self.Timeout(timeout_ms))
+            except libusb1.USBError as e:
+                if e.value != LIBUSB_ERROR_TIMEOUT:
+                    self._StopAsyncReads()
+                raise usb_exceptions.ReadFailedError('Could not receive data from %s (timeout %sms)' % (self.usb_info, self.Timeout(timeout_ms)), e)
+
+        data = self.BulkRead(len(view), timeout_ms)
+        view[:len(data)] = data
+        return len(data)
+
+    def BulkWriteAsync(self, data, timeout_ms=None):
+        """Queue data to be written to the device.
+
+        Up to :const:`ASYNC_WRITE_TRANSFERS` writes are kept in flight, so the next chunk is already queued when the
+        previous one finishes. This only blocks when all of them are in flight. Use :meth:`UsbHandle.FlushWrites` to
+        wait for the queued writes.
+
+        Parameters
+        ----------
+        data : bytes, bytearray
+            The data to write.
+        timeout_ms : int, None
+            Timeout in milliseconds for this write.
+
+        Returns
+        -------
+        int
+            ``len(data)``
+
+        Raises
+        ------
+        adb.usb_exceptions.WriteFailedError
+            This handle has been closed, or a previously queued write failed or timed out.
+
+        """
+        if self._context is None:
+            # Without the context there is no way to handle the transfers' events.
+            return self.BulkWrite(data, timeout_ms)
+
+        if self._handle is None:
+            raise usb_exceptions.WriteFailedError('This handle has been closed, probably due to another being opened.', None)
+
+        try:
+            if self._async_writer is None:
+                self._async_writer = _AsyncBulkWriter(self._handle, self._context, self._write_endpoint, ASYNC_WRITE_TRANSFERS)
+            self._async_writer.Write(data, self.Timeout(timeout_ms))
+        except libusb1.USBError as e:
+            raise self._WriteFailed(e, timeout_ms)
+
+        return len(data)
+
+    def BulkWriteV(self, buffers, timeout_ms=None):
+        """Write several buffers (e.g., an ADB header and its payload) to the device.
+
+        Each buffer is its own bulk transfer, including empty ones, so the device sees the same packets as with separate
+        calls to :meth:`UsbHandle.BulkWrite`.
+
+        Parameters
+        ----------
+        buffers : list, tuple
+            The buffers to write, in order
+        timeout_ms : int, None
+            Timeout in milliseconds for each write
+
+        Returns
+        -------
+        total : int
+            The total number of bytes written
+
+        """
+        total = 0
+        for data in buffers:
+            self.BulkWrite(data, timeout_ms)
+            total += len(data)
+        return total
+
+    def FlushWrites(self, timeout_ms=None):
+        """Wait for the writes queued by :meth:`UsbHandle.BulkWriteAsync` to finish.
+
+        Parameters
+        ----------
+        timeout_ms : int, None
+            Only used in the error message; every queued write has its own timeout.
+
+        Raises
+        ------
+        adb.usb_exceptions.WriteFailedError
+            A queued write failed or timed out.
+
+        """
+        if self._async_writer is None:
+            return
+
+        try:
+            self._async_writer.Flush()
+        except libusb1.USBError as e:
+            raise self._WriteFailed(e, timeout_ms)
+
+    def _WriteFailed(self, usb_error, timeout_ms):
+        """Build the exception for a failed queued write.
+
+        Parameters
+        ----------
+        usb_error : libusb1.USBError
+            The error of the failed transfer.
+        timeout_ms : int, None
+            The timeout for the write.
+
+        Returns
+        -------
+        adb.usb_exceptions.WriteFailedError
+            The exception to raise.
+
+        """
+        length = getattr(usb_error, 'length', None)
+        if length is None:
+            return usb_exceptions.WriteFailedError('Could not send data to %s (timeout %sms)' % (self.usb_info, self.Timeout(timeout_ms)), usb_error)
+        return usb_exceptions.WriteFailedError('Could not send %d queued bytes to %s' % (length, self.usb_info), usb_error)
+
+    def _StopAsyncWrites(self):
+        """Cancel the transfers queued by :meth:`UsbHandle.BulkWriteAsync`, if any."""
+        if self._async_writer is None:
+            return
+        writer, self._async_writer = self._async_writer, None
+        try:
+            writer.Close()
+        except libusb1.USBError:
+            _LOG.info('USBError while cancelling writes on %s: ', self.usb_info, exc_info=True)
+
+    def _StopAsyncReads(self):
+        """Cancel the transfers queued by :meth:`UsbHandle.BulkReadAsync`, if any."""
+        if self._async_reader is None:
+            return
+        reader, self._async_reader = self._async_reader, None
+        try:
+            reader.Close()
+        except libusb1.USBError:
+            _LOG.info('USBError while cancelling reads on %s: ', self.usb_info, exc_info=True)
 
     @classmethod
     def PortPathMatcher(cls, port_path):
@@ -606,7 +1191,7 @@ class UsbHandle(object):
             if setting is None:
                 continue
 
-            handle = cls(device, setting, usb_info=usb_info, timeout_ms=timeout_ms)
+            handle = cls(device, setting, usb_info=usb_info, timeout_ms=timeout_ms, context=ctx)
             if device_matcher is None or device_matcher(handle):
                 yield handle
 
@@ -624,13 +1209,33 @@ class TcpHandle(object):
         Android device serial of the form "host" or "host:port". (Host may be an IP address or a host name.)
     timeout_ms : TODO, None
         TODO
+    nodelay : bool
+        Whether to set ``TCP_NODELAY``, so that small packets (e.g., shell commands) are sent right away
+    sndbuf : int, None
+        If not ``None``, the size of the socket's send buffer (``SO_SNDBUF``)
+    rcvbuf : int, None
+        If not ``None``, the size of the socket's receive buffer (``SO_RCVBUF``)
 
     Attributes
     ----------
     _connection : TODO, None
         TODO
+    _nodelay : bool
+        Whether to set ``TCP_NODELAY``
+    _rcvbuf : int, None
+        The size of the socket's receive buffer, or ``None`` to use the default
+    _recv_buffer : bytearray
+        Preallocated buffer that :meth:`TcpHandle.BulkRead` receives into
+    _recv_end : int
+        The end of the received data in ``_recv_buffer``
+    _recv_start : int
+        The start of the data in ``_recv_buffer`` that has not been returned by :meth:`TcpHandle.BulkRead` yet
+    _recv_view : memoryview
+        A view of ``_recv_buffer``
     _serial_number : str
         ``<host>:<port>``
+    _sndbuf : int, None
+        The size of the socket's send buffer, or ``None`` to use the default
     _timeout_ms : float, None
         TODO
     host : str, TODO
@@ -639,7 +1244,7 @@ class TcpHandle(object):
         TODO
 
     """
-    def __init__(self, serial, timeout_ms=None):
+    def __init__(self, serial, timeout_ms=None, nodelay=True, sndbuf=None, rcvbuf=None):
         # if necessary, convert serial to a unicode string
         if isinstance(serial, (bytes, bytearray)):
             serial = serial.decode('utf-8')
@@ -653,6 +1258,14 @@ class TcpHandle(object):
         self._connection = None
         self._serial_number = '%s:%s' % (self.host, self.port)
         self._timeout_ms = float(timeout_ms) if timeout_ms else None
+        self._nodelay = nodelay
+        self._sndbuf = sndbuf
+        self._rcvbuf = rcvbuf
+
+        self._recv_buffer = bytearray(TCP_RECV_BUFFER_SIZE)
+        self._recv_view = memoryview(self._recv_buffer)
+        self._recv_start = 0
+        self._recv_end = 0
 
         self._connect()
 
@@ -667,6 +1280,13 @@ class TcpHandle(object):
         if timeout:
             self._connection.setblocking(0)
 
+        if self._nodelay:
+            self._connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self._sndbuf:
+            self._connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._sndbuf)
+        if self._rcvbuf:
+            self._connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._rcvbuf)
+
     @property
     def serial_number(self):
         """TODO
@@ -682,64 +1302,352 @@ class TcpHandle(object):
         return self._serial_number
 
     def BulkWrite(self, data, timeout=None):
-        """TODO
+        """Send ``data`` to the device, looping until all of it has been sent.
 
         .. image:: _static/adb.common.TcpHandle.BulkWrite.CALL_GRAPH.svg
 
         Parameters
         ----------
-        data : TODO
-            TODO
-        timeout : TODO, None
-            TODO
+        data : bytes, bytearray, memoryview
+            The data to send
+        timeout : int, None
+            Timeout in milliseconds for the whole write
 
         Returns
         -------
-        TODO
-            TODO
+        int
+            ``len(data)``
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            Sending data timed out.
+
+        """
+        return self._SendAll((data,), timeout)
+
+    def BulkWriteV(self, buffers, timeout=None):
+        """Send several buffers (e.g., an ADB header and its payload) to the device with as few system calls as possible.
+
+        The buffers are handed to a single ``sendmsg`` call, so they usually go out in the same TCP segment.
+
+        Parameters
+        ----------
+        buffers : list, tuple
+            The ``bytes``, ``bytearray``, or ``memoryview`` buffers to send, in order
+        timeout : int, None
+            Timeout in milliseconds for the whole write
+
+        Returns
+        -------
+        int
+            The total number of bytes sent
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            Sending data timed out.
+
+        """
+        return self._SendAll(buffers, timeout)
+
+    def _SendAll(self, buffers, timeout):
+        """Send all of ``buffers``, picking up where a partial send left off.
+
+        .. image:: _static/adb.common.TcpHandle._SendAll.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        buffers : list, tuple
+            The ``bytes``, ``bytearray``, or ``memoryview`` buffers to send, in order
+        timeout : int, None
+            Timeout in milliseconds for the whole write
+
+        Returns
+        -------
+        total : int
+            The total number of bytes sent
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            Sending data timed out.
+
+        """
+        views = [memoryview(buf) for buf in buffers if len(buf)]
+        total = sum(len(view) for view in views)
+
+        t = self.TimeoutSeconds(timeout)
+        deadline = time.time() + t if t is not None else None
+        sent_total = 0
+
+        while views:
+            self._WaitUntilWriteable(deadline, t, sent_total, total)
+            if len(views) > 1 and hasattr(self._connection, 'sendmsg'):
+                sent = self._connection.sendmsg(views)
+            else:
+                sent = self._connection.send(views[0])
+            sent_total += sent
+
+            # Drop whatever was sent and retry with the rest.
+            while views and sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            if sent:
+                views[0] = views[0][sent:]
+
+        return total
+
+    def _WaitUntilWriteable(self, deadline, t, sent, total):
+        """Wait until the socket can take more data.
+
+        .. image:: _static/adb.common.TcpHandle._WaitUntilWriteable.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        deadline : float, None
+            When to give up, as returned by ``time.time()``; ``None`` waits forever
+        t : float, None
+            The timeout in seconds, for the error message
+        sent : int
+            How many bytes have been sent so far, for the error message
+        total : int
+            How many bytes are being sent, for the error message
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            The socket was not writeable before ``deadline``.
+
+        """
+        remaining = max(deadline - time.time(), 0) if deadline is not None else None
+        _, writeable, _ = select.select([], [self._connection], [], remaining)
+        if not writeable:
+            if sent:
+                msg = 'Sending data to {} timed out after {}s. Only {} of {} bytes were sent.'.format(self.serial_number, t, sent, total)
+            else:
+                msg = 'Sending data to {} timed out after {}s. No data was sent.'.format(self.serial_number, t)
+            raise usb_exceptions.TcpTimeoutException(msg)
+
+    def SendFile(self, fd, offset, count, timeout=None):
+        """Send ``count`` bytes of a file straight from its file descriptor with ``os.sendfile``, without copying them into Python.
+
+        Only available where ``os.sendfile`` is (Python 3 on Unix).
+
+        Parameters
+        ----------
+        fd : int
+            The file descriptor of a regular file
+        offset : int
+            Where to start reading the file; the file's position is not changed
+        count : int
+            The number of bytes to send
+        timeout : int, None
+            Timeout in milliseconds for the whole write
+
+        Returns
+        -------
+        count : int
+            The number of bytes sent
 
         Raises
         ------
         adb.usb_exceptions.TcpTimeoutException
-            Sending data timed out.  No data was sent.
+            Sending data timed out.
+        adb.usb_exceptions.WriteFailedError
+            The file ended before ``count`` bytes were sent.
 
         """
         t = self.TimeoutSeconds(timeout)
-        _, writeable, _ = select.select([], [self._connection], [], t)
-        if writeable:
-            return self._connection.send(data)
-        msg = 'Sending data to {} timed out after {}s. No data was sent.'.format(self.serial_number, t)
-        raise usb_exceptions.TcpTimeoutException(msg)
+        deadline = time.time() + t if t is not None else None
+        sent_total = 0
+
+        while sent_total < count:
+            self._WaitUntilWriteable(deadline, t, sent_total, count)
+            sent = os.sendfile(self._connection.fileno(), fd, offset + sent_total, count - sent_total)  # pylint: disable=no-member
+            if not sent:
+                raise usb_exceptions.WriteFailedError('The file ended after {} of {} bytes were sent to {}'.format(sent_total, count, self.serial_number), None)
+            sent_total += sent
+
+        return count
+
+    def BulkWriteAsync(self, data, timeout=None):
+        """Same as :meth:`TcpHandle.BulkWrite`, the socket's send buffer already keeps the link busy.
+
+        Parameters
+        ----------
+        data : bytes
+            The data to send.
+        timeout : int, None
+            Timeout in milliseconds.
+
+        Returns
+        -------
+        int
+            The number of bytes sent.
+
+        """
+        return self.BulkWrite(data, timeout)
+
+    def FlushWrites(self, timeout=None):
+        """Nothing to do, :meth:`TcpHandle.BulkWriteAsync` doesn't queue anything.
+
+        Parameters
+        ----------
+        timeout : int, None
+            Unused.
+
+        """
 
     def BulkRead(self, numbytes, timeout=None):
-        """TODO
+        """Read ``numbytes`` bytes from the device.
+
+        Data is received with ``recv_into`` in chunks of up to :const:`TCP_RECV_BUFFER_SIZE` bytes, so an ADB header and
+        the payload that follows it are usually served from a single system call.
 
         .. image:: _static/adb.common.TcpHandle.BulkRead.CALL_GRAPH.svg
 
         Parameters
         ----------
         numbytes : int
-            TODO
-        timeout_ms : TODO, None
-            TODO
+            The number of bytes to read
+        timeout : int, None
+            Timeout in milliseconds for the whole read
 
         Returns
         -------
-        TODO
-            TODO
+        memoryview
+            The ``numbytes`` bytes that were read.  This is a view of the receive buffer, so it is only valid until the
+            next call to :meth:`TcpHandle.BulkRead`; copy it if it needs to live longer.
 
         Raises
         ------
         adb.usb_exceptions.TcpTimeoutException
-            Reading timed out.
+            Reading timed out.  Data that was already received is kept for the next read.
+        adb.usb_exceptions.ReadFailedError
+            The connection was closed by the device.
 
         """
+        start = self._recv_start
+        available = self._recv_end - start
+        if available >= numbytes:
+            self._recv_start += numbytes
+            return self._recv_view[start:start + numbytes]
+
+        if numbytes > len(self._recv_buffer):
+            # Too big for the buffer, so receive straight into the result.
+            result = memoryview(bytearray(numbytes))
+            self.BulkReadInto(result, timeout)
+            return result
+
         t = self.TimeoutSeconds(timeout)
-        readable, _, _ = select.select([self._connection], [], [], t)
-        if readable:
-            return self._connection.recv(numbytes)
-        msg = 'Reading from {} timed out (Timeout {}s)'.format(self._serial_number, t)
-        raise usb_exceptions.TcpTimeoutException(msg)
+        deadline = time.time() + t if t is not None else None
+
+        if start + numbytes > len(self._recv_buffer):
+            # Move the leftover data to the front to make room.
+            self._recv_view[:available] = self._recv_view[start:self._recv_end]
+            self._recv_start, self._recv_end = 0, available
+
+        while self._recv_end - self._recv_start < numbytes:
+            self._recv_end += self._RecvInto(self._recv_view[self._recv_end:], deadline, t)
+
+        start = self._recv_start
+        self._recv_start += numbytes
+        if self._recv_start == self._recv_end:
+            self._recv_start = self._recv_end = 0
+        return self._recv_view[start:start + numbytes]
+
+    def BulkReadInto(self, view, timeout=None):
+        """Read exactly ``len(view)`` bytes from the device into ``view``.
+
+        Reads that fit in the receive buffer go through it, like :meth:`TcpHandle.BulkRead`. Bigger ones take what is
+        left in the receive buffer and then ``recv_into`` straight into ``view``.
+
+        .. image:: _static/adb.common.TcpHandle.BulkReadInto.CALL_GRAPH.svg
+
+        .. image:: _static/adb.common.TcpHandle.BulkReadInto.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        view : memoryview
+            Where to put the data
+        timeout : int, None
+            Timeout in milliseconds for the whole read
+
+        Returns
+        -------
+        int
+            ``len(view)``
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            Reading timed out.  Data that was already received is kept for the next read.
+        adb.usb_exceptions.ReadFailedError
+            The connection was closed by the device.
+
+        """
+        numbytes = len(view)
+        if numbytes <= len(self._recv_buffer):
+            view[:] = self.BulkRead(numbytes, timeout)
+            return numbytes
+
+        received = self._recv_end - self._recv_start
+        view[:received] = self._recv_view[self._recv_start:self._recv_end]
+        self._recv_start = self._recv_end = 0
+
+        t = self.TimeoutSeconds(timeout)
+        deadline = time.time() + t if t is not None else None
+        try:
+            while received < numbytes:
+                received += self._RecvInto(view[received:], deadline, t)
+        except usb_exceptions.TcpTimeoutException:
+            # Keep what we got so far for the next read.
+            if received > len(self._recv_buffer):
+                self._recv_buffer = bytearray(received)
+                self._recv_view = memoryview(self._recv_buffer)
+            self._recv_view[:received] = view[:received]
+            self._recv_end = received
+            raise
+
+        return numbytes
+
+    def _RecvInto(self, view, deadline, t):
+        """Receive as much data as is available into ``view``, waiting until ``deadline`` for some to arrive.
+
+        .. image:: _static/adb.common.TcpHandle._RecvInto.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        view : memoryview
+            Where to put the received data
+        deadline : float, None
+            When to give up, as returned by ``time.time()``; ``None`` waits forever
+        t : float, None
+            The timeout in seconds, for the error message
+
+        Returns
+        -------
+        received : int
+            The number of bytes received
+
+        Raises
+        ------
+        adb.usb_exceptions.TcpTimeoutException
+            Nothing was received before ``deadline``.
+        adb.usb_exceptions.ReadFailedError
+            The connection was closed by the device.
+
+        """
+        remaining = max(deadline - time.time(), 0) if deadline is not None else None
+        readable, _, _ = select.select([self._connection], [], [], remaining)
+        if not readable:
+            msg = 'Reading from {} timed out (Timeout {}s)'.format(self._serial_number, t)
+            raise usb_exceptions.TcpTimeoutException(msg)
+
+        received = self._connection.recv_into(view)
+        if not received:
+            raise usb_exceptions.ReadFailedError('Connection to {} was closed'.format(self._serial_number), None)
+        return received
 
     def Timeout(self, timeout_ms):
         """TODO
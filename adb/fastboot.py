@@ -342,14 +342,21 @@ class FastbootProtocol(object):
         if progress_callback:
             progress = self._HandleProgress(length, progress_callback)
             next(progress)
+
+        # Keep the next chunks queued while this one is on the bus, if the
+        # handle can pipeline writes; plain handles only have ``BulkWrite``.
+        write = getattr(self.usb, 'BulkWriteAsync', self.usb.BulkWrite)
         while length:
             tmp = data.read(self.chunk_kb * 1024)
             length -= len(tmp)
-            self.usb.BulkWrite(tmp)
+            write(tmp)
 
             if progress_callback and progress:
                 progress.send(len(tmp))
 
+        if hasattr(self.usb, 'FlushWrites'):
+            self.usb.FlushWrites()
+
 
 class FastbootCommands(object):
     """Encapsulates the fastboot commands.
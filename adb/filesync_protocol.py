@@ -25,28 +25,38 @@ host side.
     * :meth:`FileSyncConnection.Read`
     * :meth:`FileSyncConnection.ReadUntil`
     * :meth:`FileSyncConnection.Send`
+    * :meth:`FileSyncConnection.SendFileData`
     * :meth:`FileSyncConnection._CanAddToSendBuffer`
     * :meth:`FileSyncConnection._Flush`
     * :meth:`FileSyncConnection._ReadBuffered`
+    * :meth:`FileSyncConnection._ReserveSendBuffer`
 
 * :class:`FilesyncProtocol`
 
+    * :meth:`FilesyncProtocol._CheckPushResult`
     * :meth:`FilesyncProtocol._HandleProgress`
+    * :meth:`FilesyncProtocol._ReadPushResult`
+    * :meth:`FilesyncProtocol._SendFile`
+    * :meth:`FilesyncProtocol._SendFileSource`
     * :meth:`FilesyncProtocol.List`
     * :meth:`FilesyncProtocol.Pull`
     * :meth:`FilesyncProtocol.Push`
+    * :meth:`FilesyncProtocol.PushFiles`
     * :meth:`FilesyncProtocol.Stat`
 
 * :class:`InterleavedDataError`
 * :class:`InvalidChecksumError`
 * :class:`PullFailedError`
 * :class:`PushFailedError`
+* :func:`WalkLocalTree`
 
 """
 
 import collections
 import io
+import mmap
 import os
+import posixpath
 import stat
 import struct
 import time
@@ -65,8 +75,14 @@ except NameError:
 #: Default mode for pushed files.
 DEFAULT_PUSH_MODE = stat.S_IFREG | stat.S_IRWXU | stat.S_IRWXG
 
-#: Maximum size of a filesync DATA packet.
-MAX_PUSH_DATA = 2 * 1024
+#: Maximum size of a filesync DATA packet (``SYNC_DATA_MAX`` in adbd).
+MAX_PUSH_DATA = 64 * 1024
+
+#: How many files :meth:`FilesyncProtocol.PushFiles` sends before it waits for the device to confirm the first of them
+MAX_PENDING_PUSHES = 64
+
+#: The header of a FileSync request: its ID and a size (or mode, or mtime)
+_SYNC_HEADER = struct.Struct(b'<2I')
 
 
 class InvalidChecksumError(Exception):
@@ -239,6 +255,44 @@ class FilesyncProtocol(object):
             except Exception:  # pylint: disable=broad-except
                 continue
 
+    @staticmethod
+    def _SendFileSource(connection, datafile):
+        """Determine whether ``datafile`` can be pushed with ``os.sendfile``.
+
+        That requires a regular file, ``os.sendfile``, and a transport with a ``SendFile`` method (see
+        :meth:`adb.common.TcpHandle.SendFile`).
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._SendFileSource.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.adb_protocol._AdbConnection
+            ADB connection
+        datafile : _io.BytesIO
+            File-like object for reading from
+
+        Returns
+        -------
+        tuple, None
+            The file descriptor, the current position in the file, and the number of bytes left to push; or ``None``
+            if the file must be read into Python
+
+        """
+        if not hasattr(os, 'sendfile') or not hasattr(connection.usb, 'SendFile'):
+            return None
+
+        try:
+            fd = datafile.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return None
+
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        offset = datafile.tell()
+        return fd, offset, max(st.st_size - offset, 0)
+
     @classmethod
     def Push(cls, connection, datafile, filename,
              st_mode=DEFAULT_PUSH_MODE, mtime=0, progress_callback=None):
@@ -269,35 +323,223 @@ class FilesyncProtocol(object):
             Raised on push failure.
 
         """
-        fileinfo = ('{},{}'.format(filename, int(st_mode))).encode('utf-8')
-
         cnxn = FileSyncConnection(connection, b'<2I')
-        cnxn.Send(b'SEND', fileinfo)
 
+        progress = None
         if progress_callback:
             total_bytes = os.fstat(datafile.fileno()).st_size if isinstance(datafile, file_types) else -1
             progress = cls._HandleProgress(lambda current: progress_callback(filename, current, total_bytes))
             next(progress)
 
-        while True:
-            data = datafile.read(MAX_PUSH_DATA)
-            if data:
-                cnxn.Send(b'DATA', data)
+        cls._SendFile(cnxn, datafile, filename, st_mode, mtime, progress)
+        reason = cls._ReadPushResult(cnxn)
+        if reason is not None:
+            raise PushFailedError(reason)
 
-                if progress_callback:
-                    progress.send(len(data))
-            else:
-                break
+    @classmethod
+    def PushFiles(cls, connection, files, st_mode=DEFAULT_PUSH_MODE, mtime=0, progress_callback=None, max_pending=MAX_PENDING_PUSHES):
+        """Push many local files to the device over one FileSync session.
+
+        The requests for each file are sent without waiting for the device to confirm the previous files, up to
+        ``max_pending`` files ahead, and small files share ADB packets. The device creates the missing directories of
+        each file itself.
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol.PushFiles.CALL_GRAPH.svg
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol.PushFiles.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.adb_protocol._AdbConnection
+            ADB connection
+        files : list[tuple]
+            The local path, destination on the device, and size of each file, e.g. from :func:`WalkLocalTree`
+        st_mode : int
+            Stat mode for the files
+        mtime : int
+            Modification time; by default, now
+        progress_callback : function, None
+            Callback method that accepts the destination of the file being pushed, the bytes written for all the files
+            so far, and the total bytes of all the files
+        max_pending : int
+            How many files can be sent before the device confirms the first of them
+
+        Raises
+        ------
+        PushFailedError
+            Raised on push failure.
+
+        """
+        cnxn = FileSyncConnection(connection, b'<2I')
+
+        current = [None]
+        progress = None
+        if progress_callback:
+            total_bytes = sum(size for _, _, size in files)
+            progress = cls._HandleProgress(lambda written: progress_callback(current[0], written, total_bytes))
+            next(progress)
+
+        pending = collections.deque()
+        for local_path, filename, _ in files:
+            current[0] = filename
+            with open(local_path, 'rb') as datafile:
+                cls._SendFile(cnxn, datafile, filename, st_mode, mtime, progress)
+            pending.append(filename)
+
+            while len(pending) >= max_pending:
+                cls._CheckPushResult(cnxn, pending.popleft())
+
+        while pending:
+            cls._CheckPushResult(cnxn, pending.popleft())
+
+    @classmethod
+    def _SendFile(cls, cnxn, datafile, filename, st_mode, mtime, progress):
+        """Send the requests that push a file, without waiting for the device's response.
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._SendFile.CALL_GRAPH.svg
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._SendFile.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        cnxn : FileSyncConnection
+            FileSync connection
+        datafile : _io.BytesIO
+            File-like object for reading from
+        filename : str
+            Filename to push to
+        st_mode : int
+            Stat mode for filename
+        mtime : int
+            Modification time; 0 for now
+        progress : generator, None
+            A :meth:`FilesyncProtocol._HandleProgress` generator that is sent the size of each ``DATA`` request
+
+        """
+        fileinfo = ('{},{}'.format(filename, int(st_mode))).encode('utf-8')
+        cnxn.Send(b'SEND', fileinfo)
+
+        source = cls._SendFileSource(cnxn.adb, datafile)
+        if source:
+            # Zero-copy: only the headers are built in Python, the file's contents go straight from its descriptor
+            # to the socket.
+            fd, offset, size = source
+            if size:
+                contents = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+                try:
+                    with memoryview(contents) as view:
+                        for start in range(offset, offset + size, cnxn.max_push_data):
+                            with view[start:min(start + cnxn.max_push_data, offset + size)] as region:
+                                cnxn.SendFileData(fd, start, region)
+
+                                if progress:
+                                    progress.send(len(region))
+                finally:
+                    contents.close()
+                datafile.seek(offset + size)
+
+        else:
+            while True:
+                data = datafile.read(cnxn.max_push_data)
+                if data:
+                    cnxn.Send(b'DATA', data)
+
+                    if progress:
+                        progress.send(len(data))
+                else:
+                    break
 
         if mtime == 0:
             mtime = int(time.time())
         # DONE doesn't send data, but it hides the last bit of data in the size
         # field.
         cnxn.Send(b'DONE', size=mtime)
+
+    @staticmethod
+    def _ReadPushResult(cnxn):
+        """Read the device's response to the requests sent by :meth:`FilesyncProtocol._SendFile`.
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._ReadPushResult.CALL_GRAPH.svg
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._ReadPushResult.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        cnxn : FileSyncConnection
+            FileSync connection
+
+        Returns
+        -------
+        bytearray, None
+            Why the push failed, or ``None`` if it succeeded
+
+        """
         for cmd_id, _, data in cnxn.ReadUntil((), b'OKAY', b'FAIL'):
             if cmd_id == b'OKAY':
-                return
-            raise PushFailedError(data)
+                return None
+            return data
+
+    @classmethod
+    def _CheckPushResult(cls, cnxn, filename):
+        """Read the device's response to the push of a file, and raise an exception if it failed.
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._CheckPushResult.CALL_GRAPH.svg
+
+        .. image:: _static/adb.filesync_protocol.FilesyncProtocol._CheckPushResult.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        cnxn : FileSyncConnection
+            FileSync connection
+        filename : str
+            The file that was pushed
+
+        Raises
+        ------
+        PushFailedError
+            The device couldn't write the file.
+
+        """
+        reason = cls._ReadPushResult(cnxn)
+        if reason is not None:
+            raise PushFailedError('Unable to push file %s due to: %s' % (filename, bytes(reason).decode('utf-8', errors='ignore')))
+
+
+def WalkLocalTree(local_dir, device_dir):
+    """List the files in a local directory, and where they go on the device, for :meth:`FilesyncProtocol.PushFiles`.
+
+    .. image:: _static/adb.filesync_protocol.WalkLocalTree.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    local_dir : str
+        The local directory
+    device_dir : str
+        Where it goes on the device
+
+    Returns
+    -------
+    files : list[tuple]
+        The local path, destination on the device, and size of each file, in a stable order
+    empty_dirs : list[str]
+        The directories on the device that have no files to push, which must be created separately
+
+    """
+    files = []
+    empty_dirs = []
+    for root, dirs, filenames in os.walk(local_dir, followlinks=True):
+        dirs.sort()
+        relative = os.path.relpath(root, local_dir)
+        device_root = device_dir if relative == os.curdir else posixpath.join(device_dir, *relative.split(os.sep))
+
+        if not dirs and not filenames:
+            empty_dirs.append(device_root)
+
+        for name in sorted(filenames):
+            local_path = os.path.join(root, name)
+            files.append((local_path, posixpath.join(device_root, name), os.path.getsize(local_path)))
+
+    return files, empty_dirs
 
 
 class FileSyncConnection(object):
@@ -314,18 +556,27 @@ class FileSyncConnection(object):
     ----------
     adb : adb.adb_protocol._AdbConnection
         ADB connection
-    send_buffer : byte_array
-        ``bytearray(adb_protocol.MAX_ADB_DATA)`` (see :const:`adb.adb_protocol.MAX_ADB_DATA`)
+    max_push_data : int
+        The size of the DATA packets sent by :meth:`FilesyncProtocol.Push`: as big as fits in an ADB packet, up to
+        :const:`MAX_PUSH_DATA`
+    send_buffer : bytearray
+        The FileSync packets that have not been sent yet; it grows as packets are added, up to ``send_buffer_size``
+    send_buffer_size : int
+        ``adb_connection.max_data``, i.e., the size of the largest ADB packet
     send_idx : int
         TODO
     send_header_len : int
-        ``struct.calcsize(b'<2I')``
+        The size of a FileSync request's header, ``struct.calcsize(b'<2I')``
     recv_buffer : bytearray
         TODO
+    recv_idx : int
+        How much of ``recv_buffer`` has already been read
     recv_header_format : bytes
         TODO
     recv_header_len : int
         ``struct.calcsize(recv_header_format)``
+    recv_header_struct : struct.Struct
+        The compiled ``recv_header_format``
 
     """
 
@@ -336,15 +587,20 @@ class FileSyncConnection(object):
         self.adb = adb_connection
 
         # Sending
-        # Using a bytearray() saves a copy later when using libusb.
-        self.send_buffer = bytearray(adb_protocol.MAX_ADB_DATA)
+        # Using a bytearray() saves a copy later when using libusb.  It is grown on demand, so a
+        # connection that only runs ``Stat`` or ``List`` never holds a buffer of ``max_data`` bytes.
+        self.send_buffer = bytearray()
+        self.send_buffer_size = adb_connection.max_data
         self.send_idx = 0
-        self.send_header_len = struct.calcsize(b'<2I')
+        self.send_header_len = _SYNC_HEADER.size
+        self.max_push_data = min(MAX_PUSH_DATA, adb_connection.max_data - self.send_header_len)
 
         # Receiving
         self.recv_buffer = bytearray()
+        self.recv_idx = 0
         self.recv_header_format = recv_header_format
-        self.recv_header_len = struct.calcsize(recv_header_format)
+        self.recv_header_struct = struct.Struct(recv_header_format)
+        self.recv_header_len = self.recv_header_struct.size
 
     def Send(self, command_id, data=b'', size=0):
         """Send/buffer FileSync packets.
@@ -369,11 +625,40 @@ class FileSyncConnection(object):
                 data = data.encode('utf8')
             size = len(data)
 
-        if not self._CanAddToSendBuffer(len(data)):
+        if self.send_idx and not self._CanAddToSendBuffer(len(data)):
+            self._Flush()
+        self._ReserveSendBuffer(self.send_header_len + len(data))
+        _SYNC_HEADER.pack_into(self.send_buffer, self.send_idx, self.id_to_wire[command_id], size)
+        self.send_idx += self.send_header_len
+        self.send_buffer[self.send_idx:self.send_idx + len(data)] = data
+        self.send_idx += len(data)
+
+    def SendFileData(self, fd, offset, region):
+        """Send a DATA packet whose payload goes straight from a file descriptor to the transport.
+
+        Packets buffered by :meth:`FileSyncConnection.Send` go out in the same ADB packet, if they fit.
+
+        Parameters
+        ----------
+        fd : int
+            The file descriptor of a regular file
+        offset : int
+            Where ``region`` starts in the file
+        region : memoryview
+            A memory map of the data to send
+
+        """
+        if self.send_idx and not self._CanAddToSendBuffer(len(region)):
             self._Flush()
-        buf = struct.pack(b'<2I', self.id_to_wire[command_id], size) + data
-        self.send_buffer[self.send_idx:self.send_idx + len(buf)] = buf
-        self.send_idx += len(buf)
+
+        self._ReserveSendBuffer(self.send_header_len)
+        _SYNC_HEADER.pack_into(self.send_buffer, self.send_idx, self.id_to_wire[b'DATA'], len(region))
+        data = bytes(self.send_buffer[:self.send_idx + self.send_header_len])
+        self.send_idx = 0
+        try:
+            self.adb.WriteFile(data, fd, offset, region)
+        except libusb1.USBError as e:
+            raise usb_exceptions.WriteFailedError('Could not send data from file descriptor %s' % fd, e)
 
     def Read(self, expected_ids, read_data=True):
         """Read ADB messages and return FileSync packets.
@@ -411,15 +696,15 @@ class FileSyncConnection(object):
 
         # Read one filesync packet off the recv buffer.
         header_data = self._ReadBuffered(self.recv_header_len)
-        header = struct.unpack(self.recv_header_format, header_data)
+        header = self.recv_header_struct.unpack(header_data)
         # Header is (ID, ...).
         command_id = self.wire_to_id[header[0]]
 
         if command_id not in expected_ids:
             if command_id == b'FAIL':
                 reason = ''
-                if self.recv_buffer:
-                    reason = self.recv_buffer.decode('utf-8', errors='ignore')
+                if len(self.recv_buffer) > self.recv_idx:
+                    reason = self.recv_buffer[self.recv_idx:].decode('utf-8', errors='ignore')
 
                 raise usb_exceptions.AdbCommandFailureException('Command failed: {}'.format(reason))
 
@@ -463,7 +748,7 @@ class FileSyncConnection(object):
                 break
 
     def _CanAddToSendBuffer(self, data_len):
-        """Determine whether ``data_len`` bytes of data can be added to the send buffer without exceeding :const:`adb.adb_protocol.MAX_ADB_DATA`.
+        """Determine whether ``data_len`` bytes of data can be added to the send buffer without exceeding the maximum size of an ADB packet.
 
         .. image:: _static/adb.filesync_protocol.FileSyncConnection._CanAddToSendBuffer.CALLER_GRAPH.svg
 
@@ -475,11 +760,24 @@ class FileSyncConnection(object):
         Returns
         -------
         bool
-            Whether ``data_len`` bytes of data can be added to the send buffer without exceeding :const:`adb.adb_protocol.MAX_ADB_DATA`
+            Whether ``data_len`` bytes of data can be added to the send buffer without exceeding the maximum size of an ADB packet
 
         """
         added_len = self.send_header_len + data_len
-        return self.send_idx + added_len < adb_protocol.MAX_ADB_DATA
+        return self.send_idx + added_len <= self.send_buffer_size
+
+    def _ReserveSendBuffer(self, added_len):
+        """Grow the send buffer so that ``added_len`` more bytes fit after ``send_idx``.
+
+        Parameters
+        ----------
+        added_len : int
+            The number of bytes that are about to be written at ``send_idx``
+
+        """
+        missing = self.send_idx + added_len - len(self.send_buffer)
+        if missing > 0:
+            self.send_buffer.extend(bytes(missing))
 
     def _Flush(self):
         """TODO
@@ -501,6 +799,8 @@ class FileSyncConnection(object):
     def _ReadBuffered(self, size):
         """Read ``size`` bytes of data from ``self.recv_buffer``.
 
+        The data before ``self.recv_idx`` has already been read; it is only dropped when more data is received.
+
         .. image:: _static/adb.filesync_protocol.FileSyncConnection._ReadBuffered.CALLER_GRAPH.svg
 
         Parameters
@@ -515,10 +815,13 @@ class FileSyncConnection(object):
 
         """
         # Ensure recv buffer has enough data.
-        while len(self.recv_buffer) < size:
-            _, data = self.adb.ReadUntil(b'WRTE')
+        while len(self.recv_buffer) - self.recv_idx < size:
+            _, data = self.adb.ReadUntilView(b'WRTE')
+            if self.recv_idx:
+                del self.recv_buffer[:self.recv_idx]
+                self.recv_idx = 0
             self.recv_buffer += data
 
-        result = self.recv_buffer[:size]
-        self.recv_buffer = self.recv_buffer[size:]
+        result = self.recv_buffer[self.recv_idx:self.recv_idx + size]
+        self.recv_idx += size
         return result
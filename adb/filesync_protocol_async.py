@@ -0,0 +1,435 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The FileSync protocol over an :class:`adb.adb_commands_async.AsyncAdbCommands` stream.
+
+These are the coroutine versions of :class:`adb.filesync_protocol.FilesyncProtocol` and
+:class:`adb.filesync_protocol.FileSyncConnection`. Local files are read and written in the event loop's default
+executor, so a slow disk doesn't block the loop.
+
+This module requires Python 3.6 or later.
+
+
+.. rubric:: Contents
+
+* :class:`AsyncFileSyncConnection`
+
+    * :meth:`AsyncFileSyncConnection._Flush`
+    * :meth:`AsyncFileSyncConnection._ReadBuffered`
+    * :meth:`AsyncFileSyncConnection.Read`
+    * :meth:`AsyncFileSyncConnection.Send`
+    * :meth:`AsyncFileSyncConnection.SendFile`
+
+* :class:`AsyncFilesyncProtocol`
+
+    * :meth:`AsyncFilesyncProtocol._CheckPushResult`
+    * :meth:`AsyncFilesyncProtocol.List`
+    * :meth:`AsyncFilesyncProtocol.Pull`
+    * :meth:`AsyncFilesyncProtocol.Push`
+    * :meth:`AsyncFilesyncProtocol.PushFiles`
+    * :meth:`AsyncFilesyncProtocol.Stat`
+
+"""
+
+import collections
+import struct
+import time
+
+from adb import adb_protocol
+from adb import async_io
+from adb import filesync_protocol
+from adb import usb_exceptions
+
+
+_STAT_HEADER = struct.Struct(b'<4I')
+_LIST_HEADER = struct.Struct(b'<5I')
+
+
+class AsyncFilesyncProtocol(object):
+    """Implements the FileSync protocol with coroutines, like :class:`adb.filesync_protocol.FilesyncProtocol`."""
+
+    @staticmethod
+    async def Stat(connection, filename):
+        """Get file status (mode, size, and mtime).
+
+        .. image:: _static/adb.filesync_protocol_async.AsyncFilesyncProtocol.Stat.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.async_io.AsyncConnection
+            A stream to the ``sync:`` service
+        filename : str, bytes
+            The file on the device
+
+        Returns
+        -------
+        mode : int
+            The mode of the file
+        size : int
+            The size of the file
+        mtime : int
+            The time of last modification for the file
+
+        """
+        sync = AsyncFileSyncConnection(connection)
+        await sync.Send(b'STAT', filename)
+        _, (mode, size, mtime), _ = await sync.Read(_STAT_HEADER, (b'STAT',), read_data=False)
+        return mode, size, mtime
+
+    @staticmethod
+    async def List(connection, path):
+        """Get a list of the files in ``path``.
+
+        Parameters
+        ----------
+        connection : adb.async_io.AsyncConnection
+            A stream to the ``sync:`` service
+        path : str, bytes
+            The directory on the device
+
+        Returns
+        -------
+        files : list[adb.filesync_protocol.DeviceFile]
+            The files in the directory
+
+        """
+        sync = AsyncFileSyncConnection(connection)
+        await sync.Send(b'LIST', path)
+        files = []
+        while True:
+            command_id, header, filename = await sync.Read(_LIST_HEADER, (b'DENT', b'DONE'))
+            if command_id == b'DONE':
+                return files
+            files.append(filesync_protocol.DeviceFile(filename, *header))
+
+    @classmethod
+    async def Pull(cls, connection, filename, dest_file, progress_callback=None):
+        """Pull a file from the device into the file-like ``dest_file``.
+
+        .. image:: _static/adb.filesync_protocol_async.AsyncFilesyncProtocol.Pull.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.async_io.AsyncConnection
+            A stream to the ``sync:`` service
+        filename : str
+            The file on the device
+        dest_file : io.IOBase
+            A writable file-like object
+        progress_callback : function, None
+            Callback method that accepts ``filename``, ``bytes_written``, and ``total_bytes``
+
+        Raises
+        ------
+        adb.filesync_protocol.PullFailedError
+            The device couldn't send the file.
+
+        """
+        total_bytes = (await cls.Stat(connection, filename))[1] if progress_callback else None
+        sync = AsyncFileSyncConnection(connection)
+        written = 0
+        try:
+            await sync.Send(b'RECV', filename)
+            while True:
+                command_id, _, data = await sync.Read(filesync_protocol._SYNC_HEADER, (b'DATA', b'DONE'))  # pylint: disable=protected-access
+                if command_id == b'DONE':
+                    break
+                await async_io.InExecutor(dest_file.write, data)
+                written += len(data)
+                if progress_callback:
+                    progress_callback(filename, written, total_bytes)
+        except usb_exceptions.AdbCommandFailureException as e:
+            raise filesync_protocol.PullFailedError('Unable to pull file %s due to: %s' % (filename, e))
+
+    @staticmethod
+    async def Push(connection, datafile, filename, st_mode=filesync_protocol.DEFAULT_PUSH_MODE, mtime=0, progress_callback=None, total_bytes=-1):
+        """Push a file-like object to the device.
+
+        .. image:: _static/adb.filesync_protocol_async.AsyncFilesyncProtocol.Push.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.async_io.AsyncConnection
+            A stream to the ``sync:`` service
+        datafile : io.IOBase
+            A readable file-like object
+        filename : str
+            The destination on the device
+        st_mode : int
+            The mode of the file on the device
+        mtime : int
+            The modification time to set; by default, now
+        progress_callback : function, None
+            Callback method that accepts ``filename``, ``bytes_written``, and ``total_bytes``
+        total_bytes : int
+            The size of ``datafile``, for ``progress_callback``; -1 if it isn't known
+
+        Raises
+        ------
+        adb.filesync_protocol.PushFailedError
+            The device couldn't write the file.
+
+        """
+        written = 0
+
+        def _Progress(size):
+            nonlocal written
+            written += size
+            if progress_callback:
+                progress_callback(filename, written, total_bytes)
+
+        sync = AsyncFileSyncConnection(connection)
+        await sync.SendFile(datafile, filename, st_mode, mtime, _Progress)
+        command_id, _, data = await sync.Read(filesync_protocol._SYNC_HEADER, (b'OKAY', b'FAIL'))  # pylint: disable=protected-access
+        if command_id == b'FAIL':
+            raise filesync_protocol.PushFailedError(data)
+
+    @classmethod
+    async def PushFiles(cls, connection, files, st_mode=filesync_protocol.DEFAULT_PUSH_MODE, mtime=0, progress_callback=None, max_pending=filesync_protocol.MAX_PENDING_PUSHES):
+        """Push many local files to the device over one FileSync session.
+
+        Like :meth:`adb.filesync_protocol.FilesyncProtocol.PushFiles`, the requests for each file are sent without
+        waiting for the device to confirm the previous files, up to ``max_pending`` files ahead.
+
+        .. image:: _static/adb.filesync_protocol_async.AsyncFilesyncProtocol.PushFiles.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.async_io.AsyncConnection
+            A stream to the ``sync:`` service
+        files : list[tuple]
+            The local path, destination on the device, and size of each file, e.g. from
+            :func:`adb.filesync_protocol.WalkLocalTree`
+        st_mode : int
+            The mode of the files on the device
+        mtime : int
+            The modification time to set; by default, now
+        progress_callback : function, None
+            Callback method that accepts the destination of the file being pushed, the bytes written for all the files
+            so far, and the total bytes of all the files
+        max_pending : int
+            How many files can be sent before the device confirms the first of them
+
+        Raises
+        ------
+        adb.filesync_protocol.PushFailedError
+            The device couldn't write a file.
+
+        """
+        total_bytes = sum(size for _, _, size in files)
+        written = 0
+        filename = None
+
+        def _Progress(size):
+            nonlocal written
+            written += size
+            if progress_callback:
+                progress_callback(filename, written, total_bytes)
+
+        sync = AsyncFileSyncConnection(connection)
+        pending = collections.deque()
+        for local_path, filename, _ in files:
+            with await async_io.InExecutor(open, local_path, 'rb') as datafile:
+                await sync.SendFile(datafile, filename, st_mode, mtime, _Progress)
+            pending.append(filename)
+
+            while len(pending) >= max_pending:
+                await cls._CheckPushResult(sync, pending.popleft())
+
+        while pending:
+            await cls._CheckPushResult(sync, pending.popleft())
+
+    @staticmethod
+    async def _CheckPushResult(sync, filename):
+        """Read the device's response to a pushed file.
+
+        .. image:: _static/adb.filesync_protocol_async.AsyncFilesyncProtocol._CheckPushResult.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        sync : AsyncFileSyncConnection
+            The FileSync session
+        filename : str
+            The destination of the file, for the error message
+
+        Raises
+        ------
+        adb.filesync_protocol.PushFailedError
+            The device couldn't write the file.
+
+        """
+        command_id, _, data = await sync.Read(filesync_protocol._SYNC_HEADER, (b'OKAY', b'FAIL'))  # pylint: disable=protected-access
+        if command_id == b'FAIL':
+            raise filesync_protocol.PushFailedError('Unable to push file %s due to: %s' % (filename, data.decode('utf-8', errors='ignore')))
+
+
+class AsyncFileSyncConnection(object):
+    """The FileSync protocol over an asyncio stream, like :class:`adb.filesync_protocol.FileSyncConnection`.
+
+    Requests are buffered until :meth:`AsyncFileSyncConnection.Read` is called, or until an ADB packet is full.
+
+    Parameters
+    ----------
+    connection : adb.async_io.AsyncConnection
+        A stream to the ``sync:`` service
+
+    Attributes
+    ----------
+    connection : adb.async_io.AsyncConnection
+        A stream to the ``sync:`` service
+    max_push_data : int
+        The size of the ``DATA`` requests sent by :meth:`AsyncFilesyncProtocol.Push`
+    _recv_buffer : bytearray
+        Received data that hasn't been read yet
+    _send_buffer : bytearray
+        Requests that haven't been sent yet
+
+    """
+    id_to_wire = filesync_protocol.FileSyncConnection.id_to_wire
+    wire_to_id = filesync_protocol.FileSyncConnection.wire_to_id
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.max_push_data = min(filesync_protocol.MAX_PUSH_DATA, connection.max_data - filesync_protocol._SYNC_HEADER.size)  # pylint: disable=protected-access
+        self._recv_buffer = bytearray()
+        self._send_buffer = bytearray()
+
+    async def Send(self, command_id, data=b'', size=0):
+        """Buffer a FileSync request.
+
+        Parameters
+        ----------
+        command_id : bytes
+            The request's ID
+        data : str, bytes
+            The request's data
+        size : int
+            The size field, if there is no data
+
+        """
+        if data:
+            if not isinstance(data, bytes):
+                data = data.encode('utf8')
+            size = len(data)
+
+        if len(self._send_buffer) + filesync_protocol._SYNC_HEADER.size + len(data) > self.connection.max_data:  # pylint: disable=protected-access
+            await self._Flush()
+        self._send_buffer += filesync_protocol._SYNC_HEADER.pack(self.id_to_wire[command_id], size)  # pylint: disable=protected-access
+        self._send_buffer += data
+
+    async def SendFile(self, datafile, filename, st_mode, mtime, progress=None):
+        """Buffer the requests that push a file, without waiting for the device's response.
+
+        Parameters
+        ----------
+        datafile : io.IOBase
+            A readable file-like object
+        filename : str
+            The destination on the device
+        st_mode : int
+            The mode of the file on the device
+        mtime : int
+            The modification time to set; 0 for now
+        progress : function, None
+            Called with the size of each ``DATA`` request
+
+        """
+        await self.Send(b'SEND', '{},{}'.format(filename, int(st_mode)))
+        while True:
+            data = await async_io.InExecutor(datafile.read, self.max_push_data)
+            if not data:
+                break
+            await self.Send(b'DATA', data)
+            if progress:
+                progress(len(data))
+
+        await self.Send(b'DONE', size=int(mtime) or int(time.time()))
+
+    async def Read(self, header_struct, expected_ids, read_data=True):
+        """Send the buffered requests, then read a FileSync response.
+
+        Parameters
+        ----------
+        header_struct : struct.Struct
+            The format of the response's header, which starts with its ID and ends with the size of its data
+        expected_ids : tuple[bytes]
+            The IDs that are expected
+        read_data : bool
+            Whether the response has data after its header
+
+        Returns
+        -------
+        command_id : bytes
+            The response's ID
+        header : tuple
+            The rest of the header, without the size if ``read_data`` is ``True``
+        data : bytes
+            The data, if ``read_data`` is ``True``
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The response's ID is not in ``expected_ids``.
+        adb.usb_exceptions.AdbCommandFailureException
+            The device sent ``FAIL``.
+
+        """
+        if self._send_buffer:
+            await self._Flush()
+
+        header = header_struct.unpack(await self._ReadBuffered(header_struct.size))
+        command_id = self.wire_to_id[header[0]]
+        if command_id not in expected_ids:
+            if command_id == b'FAIL':
+                reason = bytes(self._recv_buffer).decode('utf-8', errors='ignore')
+                raise usb_exceptions.AdbCommandFailureException('Command failed: {}'.format(reason))
+            raise adb_protocol.InvalidResponseError('Expected one of %s, got %s' % (expected_ids, command_id))
+
+        if not read_data:
+            return command_id, header[1:], b''
+        return command_id, header[1:-1], await self._ReadBuffered(header[-1])
+
+    async def _Flush(self):
+        """Send the buffered requests."""
+        data, self._send_buffer = bytes(self._send_buffer), bytearray()
+        await self.connection.Write(data)
+
+    async def _ReadBuffered(self, size):
+        """Read ``size`` bytes from the stream.
+
+        Parameters
+        ----------
+        size : int
+            The number of bytes
+
+        Returns
+        -------
+        bytes
+            The bytes
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The stream was closed.
+
+        """
+        while len(self._recv_buffer) < size:
+            data = await self.connection.Read()
+            if data is None:
+                raise adb_protocol.InvalidResponseError('The sync stream was closed')
+            self._recv_buffer += data
+
+        result = bytes(self._recv_buffer[:size])
+        del self._recv_buffer[:size]
+        return result
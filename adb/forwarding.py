@@ -0,0 +1,290 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Port forwarding over an :class:`adb.adb_commands_async.AsyncAdbCommands` connection, like ``adb forward``.
+
+A :class:`ForwardServer` listens on a local TCP port. Each client that connects to it gets its own stream to a service
+on the device, such as ``tcp:8080`` or ``localabstract:chrome_devtools_remote``, and the data is copied both ways.
+All the streams share the device's transport, and the device's flow control only slows down the stream it applies to,
+so a busy client doesn't hold up the others. The streams that the device opens for
+:meth:`adb.adb_commands_async.AsyncAdbCommands.Reverse` are copied to local sockets the same way.
+
+This module requires Python 3.6 or later.
+
+::
+
+    server = await device.Forward('tcp:0', 'localabstract:chrome_devtools_remote')
+    print('DevTools on port', server.port)
+    ...
+    await server.Close()
+
+
+.. rubric:: Contents
+
+* :func:`_FromDevice`
+* :func:`_ParseTcpSpec`
+* :func:`_Pipe`
+* :func:`_ToDevice`
+* :class:`ForwardServer`
+
+    * :meth:`ForwardServer._Forward`
+    * :meth:`ForwardServer._HandleClient`
+    * :meth:`ForwardServer.Close`
+    * :meth:`ForwardServer.Start`
+
+"""
+
+import asyncio
+import socket
+
+from adb import usb_exceptions
+
+
+#: How many bytes to read from a local client at a time
+FORWARD_READ_SIZE = 64 * 1024
+
+
+def _ParseTcpSpec(spec):
+    """Get the port of a ``tcp:<port>`` socket spec.
+
+    .. image:: _static/adb.forwarding._ParseTcpSpec.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    spec : str, bytes
+        The spec, e.g. ``'tcp:5037'``; port 0 picks a free port
+
+    Returns
+    -------
+    int
+        The port
+
+    Raises
+    ------
+    ValueError
+        ``spec`` isn't a TCP spec.
+
+    """
+    if isinstance(spec, bytes):
+        spec = spec.decode('utf8')
+
+    kind, _, port = spec.partition(':')
+    if kind != 'tcp' or not port.isdigit():
+        raise ValueError('Only tcp:<port> can be forwarded from the host, not %r' % spec)
+    return int(port)
+
+
+class ForwardServer(object):
+    """Forward the connections to a local port to a service on the device.
+
+    .. image:: _static/adb.forwarding.ForwardServer.__init__.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    commands : adb.adb_commands_async.AsyncAdbCommands
+        The connection to the device
+    remote : str, bytes
+        The service on the device, e.g. ``'tcp:8080'`` or ``'localabstract:chrome_devtools_remote'``
+    timeout_ms : int, None
+        Timeout for the device to accept each stream; by default, the connection's
+
+    Attributes
+    ----------
+    commands : adb.adb_commands_async.AsyncAdbCommands
+        The connection to the device
+    port : int, None
+        The local port, once :meth:`ForwardServer.Start` has been called
+    remote : bytes
+        The service on the device
+    timeout_ms : int, None
+        Timeout for the device to accept each stream
+    _clients : set
+        The tasks that run :meth:`ForwardServer._Forward` for each client
+    _server : asyncio.AbstractServer, None
+        The listening socket
+
+    """
+    def __init__(self, commands, remote, timeout_ms=None):
+        if not isinstance(remote, bytes):
+            remote = remote.encode('utf8')
+
+        self.commands = commands
+        self.port = None
+        self.remote = remote
+        self.timeout_ms = timeout_ms
+        self._clients = set()
+        self._server = None
+
+    async def Start(self, port=0, host='127.0.0.1'):
+        """Start listening.
+
+        .. image:: _static/adb.forwarding.ForwardServer.Start.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        port : int
+            The local port, or 0 to pick a free one
+        host : str
+            The local address
+
+        Returns
+        -------
+        ForwardServer
+            This server
+
+        """
+        self._server = await asyncio.start_server(self._HandleClient, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def Close(self):
+        """Stop listening, and close the connections of the clients and their streams.
+
+        .. image:: _static/adb.forwarding.ForwardServer.Close.CALLER_GRAPH.svg
+
+        """
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+        clients, self._clients = self._clients, set()
+        for client in clients:
+            client.cancel()
+        if clients:
+            await asyncio.wait(clients)
+
+    async def _HandleClient(self, reader, writer):
+        """Forward a client's connection until either end closes it, or the server is closed.
+
+        .. image:: _static/adb.forwarding.ForwardServer._HandleClient.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            Reads from the client
+        writer : asyncio.StreamWriter
+            Writes to the client
+
+        """
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        client = asyncio.ensure_future(self._Forward(reader, writer))
+        self._clients.add(client)
+        try:
+            await client
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._clients.discard(client)
+
+    async def _Forward(self, reader, writer):
+        """Open a stream for a client, and copy the data both ways until one of them is closed.
+
+        .. image:: _static/adb.forwarding.ForwardServer._Forward.CALL_GRAPH.svg
+
+        .. image:: _static/adb.forwarding.ForwardServer._Forward.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        reader : asyncio.StreamReader
+            Reads from the client
+        writer : asyncio.StreamWriter
+            Writes to the client
+
+        """
+        try:
+            connection = await self.commands._Open(self.remote, self.timeout_ms)  # pylint: disable=protected-access
+        except (asyncio.TimeoutError, usb_exceptions.AdbCommandFailureException):
+            writer.close()
+            return
+
+        await _Pipe(connection, reader, writer)
+
+
+async def _Pipe(connection, reader, writer):
+    """Copy data both ways between a stream and a local socket until either end closes, then close both.
+
+    .. image:: _static/adb.forwarding._Pipe.CALL_GRAPH.svg
+
+    .. image:: _static/adb.forwarding._Pipe.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    connection : adb.async_io.AsyncConnection
+        The stream
+    reader : asyncio.StreamReader
+        Reads from the socket
+    writer : asyncio.StreamWriter
+        Writes to the socket
+
+    """
+    # Either end may stay quiet for as long as it likes.
+    connection.timeout_ms = None
+
+    pumps = [asyncio.ensure_future(_ToDevice(reader, connection)), asyncio.ensure_future(_FromDevice(connection, writer))]
+    try:
+        await asyncio.wait(pumps, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for pump in pumps:
+            pump.cancel()
+        await asyncio.gather(*pumps, return_exceptions=True)
+        writer.close()
+        await connection.Close()
+
+
+async def _ToDevice(reader, connection):
+    """Copy what the socket receives to the stream, until the socket is closed.
+
+    .. image:: _static/adb.forwarding._ToDevice.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    reader : asyncio.StreamReader
+        Reads from the socket
+    connection : adb.async_io.AsyncConnection
+        The stream
+
+    """
+    while True:
+        data = await reader.read(FORWARD_READ_SIZE)
+        if not data:
+            return
+        await connection.Write(data)
+
+
+async def _FromDevice(connection, writer):
+    """Copy what the device sends on the stream to the socket, until the device closes the stream.
+
+    The next data is only read, and acked, once the socket has taken the last, so a slow client only slows down its
+    own stream.
+
+    .. image:: _static/adb.forwarding._FromDevice.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    connection : adb.async_io.AsyncConnection
+        The stream
+    writer : asyncio.StreamWriter
+        Writes to the socket
+
+    """
+    while True:
+        data = await connection.Read()
+        if data is None:
+            return
+        writer.write(data)
+        await writer.drain()
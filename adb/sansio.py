@@ -0,0 +1,827 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A sans-I/O implementation of the host side of the ADB transport protocol.
+
+:class:`AdbTransport` never reads or writes anything itself. Feed it the bytes received from the device with
+:meth:`AdbTransport.ReceiveData`, which returns the events that they caused, and send the bytes returned by
+:meth:`AdbTransport.DataToSend` to the device. One thread or event loop can therefore drive any number of devices, and
+the same state machine works with USB, TCP, or a test that just passes bytes around.
+
+The blocking API in :mod:`adb.adb_protocol` drives this state machine too: :meth:`adb.adb_protocol.AdbMessage.Connect`
+runs the ``CNXN``/``AUTH`` handshake on it, and its streams read whole packets themselves (into their own buffers, or
+on a reader thread), pass them to :meth:`AdbTransport.HandlePacket`, and send what :meth:`AdbTransport.PacketsToSend`
+returns. Stream ids, acks, flow control and the checks on the ids in received packets are therefore only implemented
+here.
+
+::
+
+    transport = AdbTransport(banner=b'host', rsa_keys=keys)
+    transport.Connect()
+    sock.sendall(transport.DataToSend())
+    for event in transport.ReceiveData(sock.recv(4096)):
+        ...
+
+
+.. rubric:: Contents
+
+* :class:`_Stream`
+* :class:`AdbTransport`
+
+    * :meth:`AdbTransport._Flush`
+    * :meth:`AdbTransport._HandleAuth`
+    * :meth:`AdbTransport._HandleClose`
+    * :meth:`AdbTransport._HandleOkay`
+    * :meth:`AdbTransport._HandleOpen`
+    * :meth:`AdbTransport._HandleWrite`
+    * :meth:`AdbTransport._NewStream`
+    * :meth:`AdbTransport._Queue`
+    * :meth:`AdbTransport.Accept`
+    * :meth:`AdbTransport.Acknowledge`
+    * :meth:`AdbTransport.Close`
+    * :meth:`AdbTransport.Connect`
+    * :meth:`AdbTransport.DataToSend`
+    * :meth:`AdbTransport.HandlePacket`
+    * :meth:`AdbTransport.Open`
+    * :meth:`AdbTransport.PacketsToSend`
+    * :meth:`AdbTransport.PendingBytes`
+    * :meth:`AdbTransport.ReceiveData`
+    * :meth:`AdbTransport.Reject`
+    * :meth:`AdbTransport.SendWindow`
+    * :meth:`AdbTransport.Writable`
+    * :meth:`AdbTransport.Write`
+
+"""
+
+import collections
+
+from adb import adb_protocol
+from adb import checksum
+from adb import usb_exceptions
+
+
+#: The device accepted the connection; ``banner`` is the payload of its ``CNXN`` packet
+Connected = collections.namedtuple('Connected', ['banner'])
+
+#: None of the keys were accepted, so the public key of the first one was sent; the device is showing a dialog
+PublicKeySent = collections.namedtuple('PublicKeySent', [])
+
+#: The device accepted the stream opened by :meth:`AdbTransport.Open`
+StreamOpened = collections.namedtuple('StreamOpened', ['local_id'])
+
+#: The device refused to open the stream, e.g., because it doesn't have the service
+StreamRejected = collections.namedtuple('StreamRejected', ['local_id'])
+
+#: The device sent ``data`` on a stream
+StreamData = collections.namedtuple('StreamData', ['local_id', 'data'])
+
+#: Everything written to the stream has been sent; more can be written without being buffered
+StreamWritable = collections.namedtuple('StreamWritable', ['local_id'])
+
+#: The stream was closed, by the device or after :meth:`AdbTransport.Close`
+StreamClosed = collections.namedtuple('StreamClosed', ['local_id'])
+
+#: The device wants to open a stream to ``destination`` on the host, e.g. for ``adb reverse``; answer with
+#: :meth:`AdbTransport.Accept` or :meth:`AdbTransport.Reject`
+StreamRequested = collections.namedtuple('StreamRequested', ['remote_id', 'destination'])
+
+_OPENING, _OPEN, _CLOSING = 'opening', 'open', 'closing'
+
+
+class _Stream(object):
+    """The state of one stream of an :class:`AdbTransport`.
+
+    Parameters
+    ----------
+    local_id : int
+        Our id for the stream
+
+    Attributes
+    ----------
+    awaiting_okay : bool
+        Without the ``delayed_ack`` feature, whether a ``WRTE`` packet is waiting for its ``OKAY``
+    local_id : int
+        Our id for the stream
+    pending : collections.deque
+        Payloads that were written but not sent yet (see :meth:`AdbTransport.Write`)
+    remote_id : int
+        The device's id for the stream, once it is open
+    send_window : int, None
+        With the ``delayed_ack`` feature, how many more bytes the device can take
+    state : str
+        ``'opening'``, ``'open'``, or ``'closing'``
+
+    """
+    __slots__ = ('awaiting_okay', 'local_id', 'pending', 'remote_id', 'send_window', 'state')
+
+    def __init__(self, local_id):
+        self.awaiting_okay = False
+        self.local_id = local_id
+        self.pending = collections.deque()
+        self.remote_id = 0
+        self.send_window = None
+        self.state = _OPENING
+
+
+class AdbTransport(object):
+    """The host side of an ADB connection, as a state machine.
+
+    Parameters
+    ----------
+    banner : bytes
+        A string to send as a host identifier
+    rsa_keys : list[adb_protocol.AuthSigner], None
+        Signers to authenticate with, tried in order (see :meth:`adb.adb_protocol.AdbMessage.Connect`)
+    auto_ack : bool
+        Whether to ack ``WRTE`` packets as soon as they are received; if ``False``, call
+        :meth:`AdbTransport.Acknowledge` once the data has been consumed, which stops the device from sending more in
+        the meantime
+    accept_opens : bool
+        Whether streams that the device opens are reported as :class:`StreamRequested` events; if ``False``, they are
+        refused
+    preferred_key : adb.adb_protocol.AuthSigner, None
+        One of ``rsa_keys`` to try before the others, e.g. the one that the device accepted last time (see
+        :meth:`adb.adb_protocol.AdbMessage.AcceptedKey`); the public key that is sent is still that of ``rsa_keys[0]``
+
+    Attributes
+    ----------
+    accept_opens : bool
+        Whether streams that the device opens are reported as :class:`StreamRequested` events
+    accepted_key : adb.adb_protocol.AuthSigner, None
+        Once connected, the key that the device accepted, if it asked for one
+    auto_ack : bool
+        Whether ``WRTE`` packets are acked as soon as they are received
+    banner : bytes
+        A string to send as a host identifier
+    connected : bool
+        Whether the device accepted the connection
+    device_banner : bytes, None
+        The payload of the device's ``CNXN`` packet
+    info : adb.adb_protocol._TransportInfo
+        The version, maximum payload size and features negotiated with the device
+    _auth_index : int
+        How many of ``_auth_keys`` have been tried
+    _auth_keys : list[adb_protocol.AuthSigner]
+        ``_rsa_keys`` in the order in which they are tried
+    _header : tuple, None
+        The header of the packet whose payload is being received
+    _public_key_sent : bool
+        Whether the public key was sent
+    _recv_buffer : bytearray
+        Received bytes that haven't been parsed yet
+    _requests : dict
+        ``_requests[remote_id]`` is the device's window, or 0, for each :class:`StreamRequested` that wasn't answered
+    _rsa_keys : list[adb_protocol.AuthSigner]
+        Signers to authenticate with
+    _send_queue : list
+        ``(command, arg0, arg1, data)`` packets waiting for :meth:`AdbTransport.PacketsToSend` or
+        :meth:`AdbTransport.DataToSend`
+    _streams : dict
+        ``_streams[local_id]`` is the :class:`_Stream` for each stream that isn't closed
+
+    """
+    def __init__(self, banner=b'notadb', rsa_keys=None, auto_ack=True, accept_opens=False, preferred_key=None):
+        self.accept_opens = accept_opens
+        self.accepted_key = None
+        self.auto_ack = auto_ack
+        self.banner = banner
+        self.connected = False
+        self.device_banner = None
+        self.info = adb_protocol._DEFAULT_TRANSPORT_INFO  # pylint: disable=protected-access
+        self._auth_index = 0
+        self._auth_keys = list(rsa_keys or [])
+        if preferred_key is not None and preferred_key in self._auth_keys:
+            self._auth_keys.remove(preferred_key)
+            self._auth_keys.insert(0, preferred_key)
+        self._header = None
+        self._public_key_sent = False
+        self._recv_buffer = bytearray()
+        self._requests = {}
+        self._rsa_keys = rsa_keys or []
+        self._send_queue = []
+        self._streams = {}
+
+    def Connect(self):
+        """Start connecting to the device by sending a ``CNXN`` packet.
+
+        .. image:: _static/adb.sansio.AdbTransport.Connect.CALL_GRAPH.svg
+
+        """
+        self._Queue(b'CNXN', adb_protocol.VERSION, adb_protocol.HOST_MAX_ADB_DATA, adb_protocol._HostBanner(self.banner))  # pylint: disable=protected-access
+
+    def Open(self, destination, window=None):
+        """Open a stream to a service on the device.
+
+        Data can be written right away; it is sent once the device accepts the stream (see :class:`StreamOpened`).
+
+        .. image:: _static/adb.sansio.AdbTransport.Open.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        destination : bytes
+            The service, e.g. ``b'shell:ls'``
+        window : int, None
+            With the ``delayed_ack`` feature, how many bytes the device can send before they are acked; defaults to
+            :const:`adb.adb_protocol.DELAYED_ACK_WINDOW`
+
+        Returns
+        -------
+        local_id : int
+            Our id for the stream, which is in the events for it
+
+        """
+        stream = self._NewStream()
+        if b'delayed_ack' not in self.info.features:
+            window = 0
+        elif window is None:
+            window = adb_protocol.DELAYED_ACK_WINDOW
+        self._Queue(b'OPEN', stream.local_id, window, destination + b'\0')
+        return stream.local_id
+
+    def Accept(self, remote_id):
+        """Accept a stream that the device opened.
+
+        .. image:: _static/adb.sansio.AdbTransport.Accept.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream, from the :class:`StreamRequested` event
+
+        Returns
+        -------
+        local_id : int
+            Our id for the stream, which is in the events for it
+
+        Raises
+        ------
+        KeyError
+            The device didn't ask for this stream, or it was already answered.
+
+        """
+        window = self._requests.pop(remote_id)
+        stream = self._NewStream()
+        stream.state = _OPEN
+        stream.remote_id = remote_id
+
+        if b'delayed_ack' in self.info.features:
+            stream.send_window = window
+            self._Queue(b'OKAY', stream.local_id, remote_id, adb_protocol._UINT32.pack(adb_protocol.DELAYED_ACK_WINDOW))  # pylint: disable=protected-access
+        else:
+            self._Queue(b'OKAY', stream.local_id, remote_id)
+        return stream.local_id
+
+    def Reject(self, remote_id):
+        """Refuse a stream that the device opened.
+
+        .. image:: _static/adb.sansio.AdbTransport.Reject.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream, from the :class:`StreamRequested` event
+
+        """
+        if self._requests.pop(remote_id, None) is not None:
+            self._Queue(b'CLSE', 0, remote_id)
+
+    def Write(self, local_id, data, copy=True):
+        """Write data to a stream.
+
+        The data is split into packets of the negotiated maximum size. Packets are sent as the device's flow control
+        allows, and the rest waits in the stream until the device acks what was sent.
+
+        .. image:: _static/adb.sansio.AdbTransport.Write.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        local_id : int
+            The id returned by :meth:`AdbTransport.Open`
+        data : bytes, bytearray, memoryview
+            The data to write
+        copy : bool
+            If ``False`` and ``data`` fits in one packet, it becomes the packet's payload as it is, so it must not change
+            until it has been sent. It can then be any object with a length that the code sending the packets knows
+            how to write, e.g. a part of a file.
+
+        Raises
+        ------
+        KeyError
+            The stream is not open.
+
+        """
+        stream = self._streams[local_id]
+        max_data = self.info.max_data
+        if not copy and len(data) <= max_data:
+            stream.pending.append(data)
+        else:
+            for start in range(0, len(data), max_data):
+                stream.pending.append(bytes(data[start:start + max_data]))
+        self._Flush(stream)
+
+    def Writable(self, local_id):
+        """Whether data written to a stream now would be sent right away.
+
+        Parameters
+        ----------
+        local_id : int
+            The id returned by :meth:`AdbTransport.Open`
+
+        Returns
+        -------
+        bool
+            Whether the stream is open, has nothing pending, and the device's flow control allows another ``WRTE``
+
+        """
+        stream = self._streams.get(local_id)
+        if stream is None or stream.state != _OPEN or stream.pending:
+            return False
+
+        if stream.send_window is not None:
+            return stream.send_window > 0
+        return not stream.awaiting_okay
+
+    def SendWindow(self, local_id):
+        """Get how many more bytes the device can take on a stream, with the ``delayed_ack`` feature.
+
+        Parameters
+        ----------
+        local_id : int
+            The id returned by :meth:`AdbTransport.Open`
+
+        Returns
+        -------
+        int, None
+            The window, which is negative if the last packet was bigger than what was left; ``None`` without the
+            ``delayed_ack`` feature, or if the stream is not open
+
+        """
+        stream = self._streams.get(local_id)
+        return stream.send_window if stream is not None else None
+
+    def PendingBytes(self, local_id):
+        """Get how many of the bytes written to a stream haven't been sent yet.
+
+        Parameters
+        ----------
+        local_id : int
+            The id returned by :meth:`AdbTransport.Open`
+
+        Returns
+        -------
+        int
+            The number of bytes waiting for the device's flow control
+
+        """
+        stream = self._streams.get(local_id)
+        return sum(len(data) for data in stream.pending) if stream is not None else 0
+
+    def Acknowledge(self, local_id, length):
+        """Ack data received on a stream, when ``auto_ack`` is ``False``.
+
+        .. image:: _static/adb.sansio.AdbTransport.Acknowledge.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        local_id : int
+            The id of the stream
+        length : int
+            The length of the :class:`StreamData` that was consumed
+
+        """
+        stream = self._streams.get(local_id)
+        if stream is None or stream.state != _OPEN:
+            return
+
+        data = adb_protocol._UINT32.pack(length) if b'delayed_ack' in self.info.features else b''  # pylint: disable=protected-access
+        self._Queue(b'OKAY', local_id, stream.remote_id, data)
+
+    def Close(self, local_id):
+        """Close a stream; data that is still pending is dropped.
+
+        The stream's id is not reused until the device confirms (see :class:`StreamClosed`).
+
+        .. image:: _static/adb.sansio.AdbTransport.Close.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        local_id : int
+            The id returned by :meth:`AdbTransport.Open`
+
+        """
+        stream = self._streams.get(local_id)
+        if stream is None or stream.state == _CLOSING:
+            return
+
+        stream.pending.clear()
+        stream.state = _CLOSING
+        self._Queue(b'CLSE', local_id, stream.remote_id)
+
+    def PacketsToSend(self):
+        """Get the packets that should be sent to the device, and forget them.
+
+        This is for drivers that frame the packets themselves; others use :meth:`AdbTransport.DataToSend`.
+
+        Returns
+        -------
+        packets : list
+            ``(command, arg0, arg1, data)`` for each packet queued since the last call, in order
+
+        """
+        packets, self._send_queue = self._send_queue, []
+        return packets
+
+    def DataToSend(self):
+        """Get the bytes that should be sent to the device, and forget them.
+
+        .. image:: _static/adb.sansio.AdbTransport.DataToSend.CALL_GRAPH.svg
+
+        Returns
+        -------
+        bytes
+            Everything queued since the last call
+
+        """
+        skip_checksum = self.info.version >= adb_protocol.VERSION_SKIP_CHECKSUM
+        data = bytearray()
+        for command, arg0, arg1, payload in self.PacketsToSend():
+            data += adb_protocol.AdbMessage(command, arg0, arg1, payload).Pack(skip_checksum)
+            data += payload
+        return bytes(data)
+
+    def ReceiveData(self, data):
+        """Process bytes received from the device.
+
+        They don't have to line up with packets; incomplete packets are kept until the rest arrives.
+
+        .. image:: _static/adb.sansio.AdbTransport.ReceiveData.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        data : bytes, bytearray, memoryview
+            The received bytes
+
+        Returns
+        -------
+        events : list
+            :class:`Connected`, :class:`PublicKeySent`, :class:`StreamOpened`, :class:`StreamRejected`,
+            :class:`StreamData`, :class:`StreamWritable`, :class:`StreamClosed`, and :class:`StreamRequested` events
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidCommandError
+            Received an unknown command.
+        adb.adb_protocol.InvalidChecksumError
+            Received checksum does not match the expected checksum.
+        adb.adb_protocol.InvalidResponseError
+            The device does authentication in an unexpected way.
+        adb.usb_exceptions.DeviceAuthError
+            The device expects authentication, but none of the keys worked.
+
+        """
+        self._recv_buffer += data
+        header_size = adb_protocol.AdbMessage.header_struct.size
+        events = []
+        start = 0
+
+        while True:
+            if self._header is None:
+                if len(self._recv_buffer) - start < header_size:
+                    break
+                self._header = adb_protocol.AdbMessage.Unpack(bytes(self._recv_buffer[start:start + header_size]))
+                start += header_size
+
+            cmd, arg0, arg1, data_length, data_checksum = self._header
+            if len(self._recv_buffer) - start < data_length:
+                break
+
+            payload = bytes(self._recv_buffer[start:start + data_length])
+            start += data_length
+            self._header = None
+
+            command = adb_protocol.AdbMessage.constants.get(cmd)
+            if not command:
+                raise adb_protocol.InvalidCommandError('Unknown command: %x' % cmd, cmd, (arg0, arg1))
+
+            if payload and self.info.version < adb_protocol.VERSION_SKIP_CHECKSUM and not checksum.IsTransportTrusted():
+                actual_checksum = adb_protocol.AdbMessage.CalculateChecksum(payload)
+                # Until the version has been negotiated, the device may already be sending 0 instead of checksums.
+                if actual_checksum != data_checksum and (data_checksum or self.connected):
+                    raise adb_protocol.InvalidChecksumError('Received checksum {0} != {1}'.format(actual_checksum, data_checksum))
+
+            events += self.HandlePacket(command, arg0, arg1, payload)
+
+        del self._recv_buffer[:start]
+        return events
+
+    def HandlePacket(self, command, arg0, arg1, data):
+        """Process a whole packet that was received from the device.
+
+        This is for drivers that read and check packets themselves; others use :meth:`AdbTransport.ReceiveData`.
+
+        .. image:: _static/adb.sansio.AdbTransport.HandlePacket.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport.HandlePacket.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : bytes
+            The packet's command, e.g. ``b'WRTE'``
+        arg0 : int
+            The packet's first argument
+        arg1 : int
+            The packet's second argument
+        data : bytes, memoryview
+            The packet's payload, whose checksum has been checked; :class:`StreamData` events use it as it is
+
+        Returns
+        -------
+        events : list
+            The events that the packet caused (see :meth:`AdbTransport.ReceiveData`)
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The device does authentication in an unexpected way.
+        adb.usb_exceptions.DeviceAuthError
+            The device expects authentication, but none of the keys worked.
+
+        """
+        events = []
+        if command == b'CNXN':
+            self.info = adb_protocol._NegotiatedInfo(arg0, arg1, data)  # pylint: disable=protected-access
+            self.connected = True
+            if self._public_key_sent:
+                self.accepted_key = self._rsa_keys[0]
+            elif self._auth_index:
+                self.accepted_key = self._auth_keys[self._auth_index - 1]
+            self.device_banner = data
+            events.append(Connected(data))
+        elif command == b'AUTH':
+            self._HandleAuth(arg0, arg1, data, events)
+        elif command == b'OKAY':
+            self._HandleOkay(arg0, arg1, data, events)
+        elif command == b'WRTE':
+            self._HandleWrite(arg0, arg1, data, events)
+        elif command == b'CLSE':
+            self._HandleClose(arg0, arg1, events)
+        elif command == b'OPEN':
+            self._HandleOpen(arg0, arg1, data, events)
+        return events
+
+    def _HandleAuth(self, arg0, arg1, data, events):
+        """Answer the device's ``AUTH`` token with the next key, or with the public key once they have all been tried.
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleAuth.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleAuth.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        arg0 : int
+            The type of ``AUTH`` packet, which should be :const:`adb.adb_protocol.AUTH_TOKEN`
+        arg1 : int
+            The packet's second argument
+        data : bytes
+            The token to sign
+        events : list
+            :class:`PublicKeySent` is appended to this list when the public key is sent
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The device does authentication in an unexpected way.
+        adb.usb_exceptions.DeviceAuthError
+            The device expects authentication, but none of the keys worked.
+
+        """
+        if not self._rsa_keys:
+            raise usb_exceptions.DeviceAuthError('Device authentication required, no keys available.')
+
+        if arg0 != adb_protocol.AUTH_TOKEN:
+            raise adb_protocol.InvalidResponseError('Unknown AUTH response: %s %s %s' % (arg0, arg1, data))
+
+        if self._auth_index < len(self._auth_keys):
+            signed_token = self._auth_keys[self._auth_index].Sign(data)
+            self._auth_index += 1
+            self._Queue(b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, signed_token)
+        elif not self._public_key_sent:
+            self._public_key_sent = True
+            self._Queue(b'AUTH', adb_protocol.AUTH_RSAPUBLICKEY, 0, self._rsa_keys[0].GetPublicKey() + b'\0')
+            events.append(PublicKeySent())
+        else:
+            raise usb_exceptions.DeviceAuthError('Accept auth key on device, then retry.')
+
+    def _HandleOpen(self, remote_id, window, data, events):
+        """Handle the device opening a stream, which is refused unless ``accept_opens`` is set.
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleOpen.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleOpen.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream
+        window : int
+            With the ``delayed_ack`` feature, how many bytes the device can take before it acks them
+        data : bytes
+            The destination, followed by ``\\0``
+        events : list
+            :class:`StreamRequested` is appended to this list
+
+        """
+        if not self.accept_opens or not remote_id or remote_id in self._requests:
+            self._Queue(b'CLSE', 0, remote_id)
+            return
+
+        self._requests[remote_id] = window
+        events.append(StreamRequested(remote_id, data.rstrip(b'\0')))
+
+    def _HandleOkay(self, remote_id, local_id, data, events):
+        """Handle the device accepting a stream, or acking data that was sent on it.
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleOkay.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleOkay.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream
+        local_id : int
+            Our id for the stream
+        data : bytes
+            With the ``delayed_ack`` feature, the number of bytes that are acked
+        events : list
+            :class:`StreamOpened` or :class:`StreamWritable` is appended to this list
+
+        """
+        stream = self._streams.get(local_id)
+        if stream is None or stream.state == _CLOSING:
+            return
+
+        acked = adb_protocol._UINT32.unpack(data)[0] if len(data) == 4 and b'delayed_ack' in self.info.features else None  # pylint: disable=protected-access
+        if stream.state == _OPENING:
+            stream.state = _OPEN
+            stream.remote_id = remote_id
+            stream.send_window = acked
+            events.append(StreamOpened(local_id))
+        elif stream.send_window is not None:
+            if acked is not None:
+                stream.send_window += acked
+        else:
+            stream.awaiting_okay = False
+
+        self._Flush(stream)
+        if not stream.pending:
+            events.append(StreamWritable(local_id))
+
+    def _HandleWrite(self, remote_id, local_id, data, events):
+        """Handle data from the device, unless it is for a stream that is not open.
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleWrite.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleWrite.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream
+        local_id : int
+            Our id for the stream
+        data : bytes
+            The data
+        events : list
+            :class:`StreamData` is appended to this list
+
+        """
+        stream = self._streams.get(local_id)
+        if stream is None or stream.state != _OPEN or stream.remote_id != remote_id:
+            # Data for a stream that is closing, or for an earlier stream that had the same local id, is dropped.
+            return
+
+        if self.auto_ack:
+            self.Acknowledge(local_id, len(data))
+        events.append(StreamData(local_id, data))
+
+    def _HandleClose(self, remote_id, local_id, events):
+        """Handle the device closing a stream, refusing to open it, or confirming that it was closed.
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleClose.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport._HandleClose.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        remote_id : int
+            The device's id for the stream
+        local_id : int
+            Our id for the stream
+        events : list
+            :class:`StreamRejected` or :class:`StreamClosed` is appended to this list
+
+        """
+        if not local_id:
+            # The device gave up on a stream that it opened before it was answered.
+            self._requests.pop(remote_id, None)
+            return
+
+        stream = self._streams.get(local_id)
+        if stream is None:
+            return
+
+        if stream.state == _OPENING:
+            if remote_id:
+                # A refusal has no remote id; this is a late ``CLSE`` for an earlier stream that had the same local id,
+                # which some devices send.
+                return
+            del self._streams[local_id]
+            events.append(StreamRejected(local_id))
+            return
+
+        del self._streams[local_id]
+
+        if stream.state == _OPEN:
+            self._Queue(b'CLSE', local_id, remote_id)
+        events.append(StreamClosed(local_id))
+
+    def _NewStream(self):
+        """Add a stream with the lowest id that isn't in use.
+
+        .. image:: _static/adb.sansio.AdbTransport._NewStream.CALLER_GRAPH.svg
+
+        Returns
+        -------
+        _Stream
+            The stream, which is opening
+
+        """
+        local_id = 1
+        while local_id in self._streams:
+            local_id += 1
+        stream = self._streams[local_id] = _Stream(local_id)
+        return stream
+
+    def _Flush(self, stream):
+        """Send as much of a stream's pending data as its flow control allows.
+
+        Without the ``delayed_ack`` feature, one ``WRTE`` packet at a time waits for its ``OKAY``. With it, packets are
+        sent as long as the window isn't used up, even if the last one is bigger than what is left, like adb does.
+
+        .. image:: _static/adb.sansio.AdbTransport._Flush.CALL_GRAPH.svg
+
+        .. image:: _static/adb.sansio.AdbTransport._Flush.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        stream : _Stream
+            The stream
+
+        """
+        if stream.state != _OPEN:
+            return
+
+        while stream.pending:
+            if stream.send_window is not None:
+                if stream.send_window <= 0:
+                    return
+            elif stream.awaiting_okay:
+                return
+
+            data = stream.pending.popleft()
+            self._Queue(b'WRTE', stream.local_id, stream.remote_id, data)
+            if stream.send_window is not None:
+                stream.send_window -= len(data)
+            else:
+                stream.awaiting_okay = True
+
+    def _Queue(self, command, arg0, arg1, data=b''):
+        """Add a packet to the packets to send.
+
+        .. image:: _static/adb.sansio.AdbTransport._Queue.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : bytes
+            The command
+        arg0 : int
+            The first argument
+        arg1 : int
+            The second argument
+        data : bytes
+            The payload
+
+        """
+        self._send_queue.append((command, arg0, arg1, data))
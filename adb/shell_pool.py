@@ -0,0 +1,284 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A pool of long-lived shell sessions for running many short commands.
+
+:meth:`adb.adb_commands.AdbCommands.Shell` opens a new ``shell:`` stream for every command, which costs several round
+trips and starts a new shell on the device. :class:`ShellPool` keeps shells open instead, and runs each command in one
+of them between two markers that are unique to the command. The output is what is printed between the markers, and
+the exit status is printed with the second one.
+
+::
+
+    pool = device.ShellPool(size=4)
+    result = pool.Shell('getprop ro.build.version.sdk')
+    print(result.output, result.exit_code)
+    pool.Close()
+
+
+.. rubric:: Contents
+
+* :class:`_ShellSession`
+
+    * :meth:`_ShellSession.Close`
+    * :meth:`_ShellSession.Run`
+
+* :class:`ShellPool`
+
+    * :meth:`ShellPool._Acquire`
+    * :meth:`ShellPool.Close`
+    * :meth:`ShellPool.Shell`
+
+* :class:`ShellResult`
+
+"""
+
+import binascii
+import collections
+import os
+import threading
+
+from adb import adb_protocol
+from adb import usb_exceptions
+
+
+#: The number of shells that a :class:`ShellPool` keeps open by default
+DEFAULT_POOL_SIZE = 4
+
+#: Turns off the echo of the commands and the translation of ``\n`` to ``\r\n`` in the shell's terminal
+_SETUP_COMMAND = b'stty -echo -onlcr 2>/dev/null\n'
+
+#: The output of a command run by :meth:`ShellPool.Shell`, and its exit status
+ShellResult = collections.namedtuple('ShellResult', ['output', 'exit_code'])
+
+
+class _ShellSession(object):
+    """A ``shell:`` stream, and the shell running in it.
+
+    Parameters
+    ----------
+    connection : adb.adb_protocol._AdbConnection
+        The stream
+
+    Attributes
+    ----------
+    connection : adb.adb_protocol._AdbConnection
+        The stream
+    _buffer : bytearray
+        Output that was received but not parsed yet
+    _count : int
+        The number of commands run so far, which makes each command's markers unique
+    _token : bytes
+        A random string, which makes the markers unique to this session
+
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self._buffer = bytearray()
+        self._count = 0
+        self._token = binascii.hexlify(os.urandom(8))
+
+        connection.Write(_SETUP_COMMAND)
+
+    def Run(self, command, timeout_ms=None):
+        """Run a command in the shell.
+
+        The command runs in a subshell, with its input from ``/dev/null``, so it can't change the session's working
+        directory or environment, nor read the commands that follow it.
+
+        .. image:: _static/adb.shell_pool._ShellSession.Run.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        command : bytes
+            The command
+        timeout_ms : int, None
+            Timeout for each packet of the output; by default, the stream's
+
+        Returns
+        -------
+        output : bytes
+            What the command printed
+        exit_code : int
+            The command's exit status
+
+        Raises
+        ------
+        adb.adb_protocol.InvalidResponseError
+            The shell exited, or its output is garbled.
+
+        """
+        self._count += 1
+        marker = self._token + b'_' + str(self._count).encode('ascii')
+
+        # The empty quotes are removed by the shell, so the markers are only found in the output of ``echo``, not in
+        # the echo of the command line.
+        self.connection.Write(b"echo ADB_BEGIN_''" + marker + b'; (' + command + b") </dev/null; echo ADB_END_''" + marker + b':$?\n')
+        begin_marker = b'ADB_BEGIN_' + marker
+        end_marker = b'ADB_END_' + marker + b':'
+
+        if timeout_ms is not None:
+            default_timeout_ms, self.connection.timeout_ms = self.connection.timeout_ms, timeout_ms
+        try:
+            # Only the data that arrived since the last packet is searched, plus enough before it for a marker that
+            # was split between packets.
+            search_start = 0
+            while True:
+                end = self._buffer.find(end_marker, search_start)
+                if end >= 0:
+                    end_of_line = self._buffer.find(b'\n', end + len(end_marker))
+                    if end_of_line >= 0:
+                        break
+                    search_start = end
+                else:
+                    search_start = max(0, len(self._buffer) - len(end_marker) + 1)
+
+                cmd, data = self.connection.ReadUntil(b'WRTE', b'CLSE')
+                if cmd == b'CLSE':
+                    raise adb_protocol.InvalidResponseError('The shell exited while running %s' % command)
+                self._buffer += data
+        finally:
+            if timeout_ms is not None:
+                self.connection.timeout_ms = default_timeout_ms
+
+        begin = self._buffer.find(begin_marker, 0, end)
+        exit_code = self._buffer[end + len(end_marker):end_of_line].rstrip(b'\r')
+        if begin < 0 or not exit_code.isdigit():
+            raise adb_protocol.InvalidResponseError('Unexpected output from %s' % command)
+        output = bytes(self._buffer[self._buffer.index(b'\n', begin) + 1:end])
+
+        # What follows is the shell's prompt, if anything.
+        self._buffer = bytearray()
+        return output, int(exit_code)
+
+    def Close(self):
+        """Close the stream, which ends the shell."""
+        try:
+            self.connection.Close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+class ShellPool(object):
+    """Run shell commands in a pool of long-lived shells.
+
+    Each call to :meth:`ShellPool.Shell` takes a shell that is idle, or opens a new one if there are fewer than
+    ``size``. Several threads can therefore run commands at the same time over one handle. A shell that fails, e.g.
+    because a command timed out, is closed and replaced.
+
+    .. image:: _static/adb.shell_pool.ShellPool.__init__.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    handle : adb.common.TcpHandle, adb.common.UsbHandle
+        A connected handle
+    size : int
+        The maximum number of shells
+    timeout_ms : int, None
+        Timeout for each packet, unless one is given to :meth:`ShellPool.Shell`
+    protocol_handler : type
+        The class that opens streams, like :attr:`adb.adb_commands.AdbCommands.protocol_handler`
+
+    Attributes
+    ----------
+    protocol_handler : type
+        The class that opens streams
+    size : int
+        The maximum number of shells
+    timeout_ms : int, None
+        Timeout for each packet
+    _available : threading.BoundedSemaphore
+        Counts the shells that can be used or opened
+    _handle : adb.common.TcpHandle, adb.common.UsbHandle
+        A connected handle
+    _idle : collections.deque
+        The :class:`_ShellSession` objects that aren't running a command
+    _lock : threading.Lock
+        Guards ``_idle``
+
+    """
+    def __init__(self, handle, size=DEFAULT_POOL_SIZE, timeout_ms=None, protocol_handler=adb_protocol.AdbMessage):
+        self.protocol_handler = protocol_handler
+        self.size = size
+        self.timeout_ms = timeout_ms
+        self._available = threading.BoundedSemaphore(size)
+        self._handle = handle
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+    def Shell(self, command, timeout_ms=None):
+        """Run a command in one of the shells.
+
+        .. image:: _static/adb.shell_pool.ShellPool.Shell.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        command : str, bytes
+            The command
+        timeout_ms : int, None
+            Timeout for each packet of the output
+
+        Returns
+        -------
+        ShellResult
+            The output, as a ``str``, and the exit status
+
+        """
+        if not isinstance(command, bytes):
+            command = command.encode('utf8')
+
+        with self._available:
+            session = self._Acquire()
+            try:
+                output, exit_code = session.Run(command, timeout_ms or self.timeout_ms)
+            except:  # noqa pylint: disable=bare-except
+                session.Close()
+                raise
+
+            with self._lock:
+                self._idle.append(session)
+
+        return ShellResult(output.decode('utf8'), exit_code)
+
+    def Close(self):
+        """Close the shells that are idle."""
+        with self._lock:
+            sessions, self._idle = self._idle, collections.deque()
+        for session in sessions:
+            session.Close()
+
+    def _Acquire(self):
+        """Take an idle shell, or open a new one.
+
+        .. image:: _static/adb.shell_pool.ShellPool._Acquire.CALLER_GRAPH.svg
+
+        Returns
+        -------
+        _ShellSession
+            The shell
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            The device refused to open a shell.
+
+        """
+        with self._lock:
+            if self._idle:
+                return self._idle.popleft()
+
+        connection = self.protocol_handler.Open(self._handle, destination=b'shell:', timeout_ms=self.timeout_ms)
+        if connection is None:
+            raise usb_exceptions.AdbCommandFailureException('The device refused to open a shell')
+        return _ShellSession(connection)
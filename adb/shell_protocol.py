@@ -0,0 +1,302 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Shell protocol v2 implementation.
+
+With the ``shell_v2`` feature, ``shell,v2:`` streams carry packets instead of raw output: each has a 1-byte ID
+(:const:`ID_STDIN`, :const:`ID_STDOUT`, :const:`ID_STDERR`, :const:`ID_EXIT`, :const:`ID_CLOSE_STDIN`, or
+:const:`ID_WINDOW_SIZE_CHANGE`) and a 4-byte length, followed by the data. stdout and stderr are therefore kept apart,
+and the command's exit code is sent at the end.
+
+
+.. rubric:: Contents
+
+* :class:`ShellChunk`
+* :class:`ShellV2Protocol`
+
+    * :meth:`ShellV2Protocol.CloseStdin`
+    * :meth:`ShellV2Protocol.Command`
+    * :meth:`ShellV2Protocol.Open`
+    * :meth:`ShellV2Protocol.Pack`
+    * :meth:`ShellV2Protocol.ReadChunks`
+    * :meth:`ShellV2Protocol.ResizeWindow`
+    * :meth:`ShellV2Protocol.StreamingCommand`
+    * :meth:`ShellV2Protocol.Write`
+
+* :class:`ShellV2Result`
+
+"""
+
+import collections
+import struct
+
+from adb import adb_protocol
+from adb import usb_exceptions
+
+
+#: Data for the command's stdin
+ID_STDIN = 0
+
+#: Data from the command's stdout
+ID_STDOUT = 1
+
+#: Data from the command's stderr
+ID_STDERR = 2
+
+#: The command's exit code, as one byte
+ID_EXIT = 3
+
+#: Close the command's stdin
+ID_CLOSE_STDIN = 4
+
+#: The terminal's size, as ``b'<rows>x<cols>,<width>x<height>\0'``
+ID_WINDOW_SIZE_CHANGE = 5
+
+#: The header of a packet: its ID and the length of its data
+_PACKET_HEADER = struct.Struct(b'<BI')
+
+#: A packet from the device: ``id`` is :const:`ID_STDOUT` or :const:`ID_STDERR` and ``data`` is bytes, or ``id`` is
+#: :const:`ID_EXIT` and ``data`` is the exit code
+ShellChunk = collections.namedtuple('ShellChunk', ['id', 'data'])
+
+#: The output of a command and its exit code, which is ``None`` if the device closed the stream without sending it
+ShellV2Result = collections.namedtuple('ShellV2Result', ['stdout', 'stderr', 'exit_code'])
+
+
+class ShellV2Protocol(object):
+    """Implements the shell protocol v2, as described in ``shell_protocol.h`` in adb's sources."""
+
+    @staticmethod
+    def Pack(packet_id, data=b''):
+        """Make a packet.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.Pack.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        packet_id : int
+            The packet's ID
+        data : bytes
+            The packet's data
+
+        Returns
+        -------
+        bytes
+            The packet
+
+        """
+        return _PACKET_HEADER.pack(packet_id, len(data)) + data
+
+    @classmethod
+    def Open(cls, usb, command, pty=False, timeout_ms=None, protocol_handler=adb_protocol.AdbMessage):
+        """Start a command in a ``shell,v2:`` stream.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.Open.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            A connected handle
+        command : str, bytes
+            The command; if empty, an interactive shell
+        pty : bool
+            Whether to run the command in a terminal, which merges stderr into stdout
+        timeout_ms : int, None
+            Timeout for each packet
+        protocol_handler : type
+            The class that opens streams
+
+        Returns
+        -------
+        adb.adb_protocol._AdbConnection
+            The stream
+
+        Raises
+        ------
+        adb.usb_exceptions.AdbCommandFailureException
+            The device refused to open the stream.
+
+        """
+        if not isinstance(command, bytes):
+            command = command.encode('utf8')
+
+        destination = b'shell,v2,%s:%s' % (b'pty' if pty else b'raw', command)
+        connection = protocol_handler.Open(usb, destination=destination, timeout_ms=timeout_ms)
+        if connection is None:
+            raise usb_exceptions.AdbCommandFailureException('The device refused to open %s' % destination)
+        return connection
+
+    @classmethod
+    def Write(cls, connection, data):
+        """Write to the command's stdin.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.Write.CALL_GRAPH.svg
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.Write.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.adb_protocol._AdbConnection
+            A stream from :meth:`ShellV2Protocol.Open`
+        data : bytes
+            The data
+
+        """
+        max_chunk = connection.max_data - _PACKET_HEADER.size
+        for start in range(0, len(data), max_chunk):
+            connection.Write(cls.Pack(ID_STDIN, data[start:start + max_chunk]))
+
+    @classmethod
+    def CloseStdin(cls, connection):
+        """Close the command's stdin, so that it sees the end of its input.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.CloseStdin.CALL_GRAPH.svg
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.CloseStdin.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.adb_protocol._AdbConnection
+            A stream from :meth:`ShellV2Protocol.Open`
+
+        """
+        connection.Write(cls.Pack(ID_CLOSE_STDIN))
+
+    @classmethod
+    def ResizeWindow(cls, connection, rows, cols, width=0, height=0):
+        """Tell the command's terminal its new size.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.ResizeWindow.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.adb_protocol._AdbConnection
+            A stream from :meth:`ShellV2Protocol.Open` with ``pty=True``
+        rows : int
+            The number of rows
+        cols : int
+            The number of columns
+        width : int
+            The width in pixels
+        height : int
+            The height in pixels
+
+        """
+        connection.Write(cls.Pack(ID_WINDOW_SIZE_CHANGE, b'%dx%d,%dx%d\0' % (rows, cols, width, height)))
+
+    @classmethod
+    def ReadChunks(cls, connection):
+        """Read the command's output until the device closes the stream.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.ReadChunks.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        connection : adb.adb_protocol._AdbConnection
+            A stream from :meth:`ShellV2Protocol.Open`
+
+        Yields
+        ------
+        ShellChunk
+            Data from stdout or stderr, in the order it was sent, and then the exit code
+
+        """
+        buf = bytearray()
+        for data in connection.ReadUntilClose():
+            buf += data
+            offset = 0
+            while len(buf) - offset >= _PACKET_HEADER.size:
+                packet_id, length = _PACKET_HEADER.unpack_from(buf, offset)
+                end = offset + _PACKET_HEADER.size + length
+                if len(buf) < end:
+                    break
+
+                payload, offset = bytes(buf[offset + _PACKET_HEADER.size:end]), end
+                if packet_id in (ID_STDOUT, ID_STDERR):
+                    yield ShellChunk(packet_id, payload)
+                elif packet_id == ID_EXIT:
+                    yield ShellChunk(ID_EXIT, bytearray(payload)[0] if payload else 0)
+
+            # Drop the parsed packets once per read rather than copying the rest of the buffer after each one.
+            del buf[:offset]
+
+    @classmethod
+    def StreamingCommand(cls, usb, command, timeout_ms=None, stdin=None, protocol_handler=adb_protocol.AdbMessage):
+        """Run a command, yielding its output as it arrives.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.StreamingCommand.CALL_GRAPH.svg
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.StreamingCommand.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            A connected handle
+        command : str, bytes
+            The command
+        timeout_ms : int, None
+            Timeout for each packet
+        stdin : bytes, None
+            If not ``None``, the command's input; otherwise, its stdin is left open
+        protocol_handler : type
+            The class that opens streams
+
+        Yields
+        ------
+        ShellChunk
+            Data from stdout or stderr, in the order it was sent, and then the exit code
+
+        """
+        connection = cls.Open(usb, command, timeout_ms=timeout_ms, protocol_handler=protocol_handler)
+        if stdin is not None:
+            cls.Write(connection, stdin)
+            cls.CloseStdin(connection)
+
+        for chunk in cls.ReadChunks(connection):
+            yield chunk
+
+    @classmethod
+    def Command(cls, usb, command, timeout_ms=None, stdin=None, protocol_handler=adb_protocol.AdbMessage):
+        """Run a command, returning its output and exit code.
+
+        .. image:: _static/adb.shell_protocol.ShellV2Protocol.Command.CALL_GRAPH.svg
+
+        Parameters
+        ----------
+        usb : adb.common.TcpHandle, adb.common.UsbHandle
+            A connected handle
+        command : str, bytes
+            The command
+        timeout_ms : int, None
+            Timeout for each packet
+        stdin : bytes, None
+            If not ``None``, the command's input
+        protocol_handler : type
+            The class that opens streams
+
+        Returns
+        -------
+        ShellV2Result
+            The command's stdout and stderr, as ``str``, and its exit code
+
+        """
+        output = {ID_STDOUT: [], ID_STDERR: []}
+        exit_code = None
+        for chunk in cls.StreamingCommand(usb, command, timeout_ms, stdin, protocol_handler):
+            if chunk.id == ID_EXIT:
+                exit_code = chunk.data
+            else:
+                output[chunk.id].append(chunk.data)
+
+        return ShellV2Result(b''.join(output[ID_STDOUT]).decode('utf8'), b''.join(output[ID_STDERR]).decode('utf8'), exit_code)
@@ -0,0 +1,266 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Create :class:`adb.adb_protocol.AuthSigner` objects with the fastest backend that is installed.
+
+:func:`GetSigner` loads a key with the first backend in :data:`BACKENDS` that can be imported, and keeps the signer
+for as long as the key files don't change, so connecting to many devices with the same key only parses it once. Run
+``python -m adb.sign_auto [KEY]`` to compare the backends on this machine.
+
+::
+
+    signer = sign_auto.GetSigner(os.path.expanduser('~/.android/adbkey'))
+    device = adb_commands.AdbCommands()
+    device.ConnectDevice(rsa_keys=[signer])
+
+
+.. rubric:: Contents
+
+* :func:`_KeyVersion`
+* :func:`_LoadBackend`
+* :func:`AvailableBackends`
+* :func:`Benchmark`
+* :func:`ClearCache`
+* :func:`GetSigner`
+* :func:`main`
+
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import threading
+import timeit
+
+
+#: The signer backends, fastest first: their names, modules, and the attributes that create a signer from a key path.
+#: ``pycryptodome`` is last, even though it signs faster than ``rsa``, because it signs a SHA-256 hash of the token
+#: rather than the token itself.
+BACKENDS = (
+    ('cryptography', 'adb.sign_cryptography', 'CryptographySigner'),
+    ('rsa', 'adb.sign_pythonrsa', 'PythonRSASigner.FromRSAKeyPath'),
+    ('pycryptodome', 'adb.sign_pycryptodome', 'PycryptodomeAuthSigner'),
+)
+
+#: How many times :func:`Benchmark` signs a token with each backend by default
+BENCHMARK_ROUNDS = 20
+
+#: The default key for ``python -m adb.sign_auto``
+DEFAULT_KEY_PATH = os.path.join('~', '.android', 'adbkey')
+
+# The signers that `GetSigner` has created, by backend and key path: ``(key version, signer)``
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def _LoadBackend(backend=None):
+    """Import a backend.
+
+    Parameters
+    ----------
+    backend : str, None
+        The name of a backend in :data:`BACKENDS`, or ``None`` for the first one that can be imported
+
+    Returns
+    -------
+    name : str
+        The name of the backend
+    factory : function
+        Creates a signer from the path to a private key
+
+    Raises
+    ------
+    ValueError
+        ``backend`` is not the name of a backend.
+    ImportError
+        The backend, or every backend if ``backend`` is ``None``, can't be imported.
+
+    """
+    if backend is not None and backend not in (name for name, _, _ in BACKENDS):
+        raise ValueError('Unknown signer backend {!r}, expected one of {}'.format(backend, [name for name, _, _ in BACKENDS]))
+
+    for name, module_name, attr in BACKENDS:
+        if backend is not None and name != backend:
+            continue
+
+        try:
+            factory = importlib.import_module(module_name)
+        except ImportError:
+            if backend is not None:
+                raise
+            continue
+
+        for part in attr.split('.'):
+            factory = getattr(factory, part)
+        return name, factory
+
+    raise ImportError('No signer backend is installed; install one of {}'.format([name for name, _, _ in BACKENDS]))
+
+
+def _KeyVersion(rsa_key_path):
+    """Identify the current contents of a key's files, so that :func:`GetSigner` notices when they change.
+
+    Parameters
+    ----------
+    rsa_key_path : str
+        The path to the private key; the public key is ``rsa_key_path + '.pub'``
+
+    Returns
+    -------
+    tuple
+        The modification times and sizes of the two files
+
+    Raises
+    ------
+    OSError
+        A file doesn't exist.
+
+    """
+    private = os.stat(rsa_key_path)
+    public = os.stat(rsa_key_path + '.pub')
+    return private.st_mtime, private.st_size, public.st_mtime, public.st_size
+
+
+def AvailableBackends():
+    """Get the backends that are installed.
+
+    Returns
+    -------
+    list[str]
+        The names of the backends in :data:`BACKENDS` that can be imported, fastest first
+
+    """
+    available = []
+    for name, _, _ in BACKENDS:
+        try:
+            _LoadBackend(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+def ClearCache():
+    """Forget the signers that :func:`GetSigner` has created, so that their keys are loaded again."""
+    with _signers_lock:
+        _signers.clear()
+
+
+def GetSigner(rsa_key_path, backend=None):
+    """Get a signer for a key, loading the key only if it hasn't been loaded or its files have changed since.
+
+    The signers are shared by everyone in the process who asks for the same key, which is safe because signing doesn't
+    change them.
+
+    Parameters
+    ----------
+    rsa_key_path : str
+        The path to the private key; the public key must be ``rsa_key_path + '.pub'``
+    backend : str, None
+        The name of a backend in :data:`BACKENDS`, or ``None`` for the fastest one that is installed
+
+    Returns
+    -------
+    adb.adb_protocol.AuthSigner
+        The signer
+
+    Raises
+    ------
+    ValueError
+        ``backend`` is not the name of a backend.
+    ImportError
+        The backend isn't installed.
+    OSError
+        A key file doesn't exist.
+
+    """
+    name, factory = _LoadBackend(backend)
+    rsa_key_path = os.path.abspath(os.path.expanduser(rsa_key_path))
+    version = _KeyVersion(rsa_key_path)
+
+    with _signers_lock:
+        cached = _signers.get((name, rsa_key_path))
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    # Parse the key outside of the lock, so that loading one key doesn't hold up getting another.
+    signer = factory(rsa_key_path)
+    with _signers_lock:
+        _signers[(name, rsa_key_path)] = (version, signer)
+    return signer
+
+
+def Benchmark(rsa_key_path, rounds=BENCHMARK_ROUNDS):
+    """Time how long each installed backend takes to load a key and to sign a token with it.
+
+    Parameters
+    ----------
+    rsa_key_path : str
+        The path to the private key; the public key must be ``rsa_key_path + '.pub'``
+    rounds : int
+        How many times to sign a token with each backend
+
+    Returns
+    -------
+    results : dict
+        ``results[name]`` is ``(load, sign)``, the times in seconds that backend ``name`` takes to load the key and to
+        sign a token
+
+    """
+    rsa_key_path = os.path.expanduser(rsa_key_path)
+    token = os.urandom(20)
+
+    results = {}
+    for name in AvailableBackends():
+        _, factory = _LoadBackend(name)
+        start = timeit.default_timer()
+        signer = factory(rsa_key_path)
+        load = timeit.default_timer() - start
+        sign = timeit.timeit(lambda signer=signer: signer.Sign(token), number=rounds) / rounds
+        results[name] = (load, sign)
+    return results
+
+
+def main(argv=None):
+    """Print a table of :func:`Benchmark` results.
+
+    Parameters
+    ----------
+    argv : list[str], None
+        The command-line arguments; by default, ``sys.argv[1:]``
+
+    Returns
+    -------
+    int
+        0
+
+    """
+    parser = argparse.ArgumentParser(description='Compare the signing speed of the ADB signer backends.')
+    parser.add_argument('rsa_key_path', nargs='?', default=DEFAULT_KEY_PATH, help='The private key, default: %(default)s')
+    parser.add_argument('--rounds', type=int, default=BENCHMARK_ROUNDS, help='How many tokens to sign, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    results = Benchmark(args.rsa_key_path, args.rounds)
+    sys.stdout.write('{:<14}{:>12}{:>12}\n'.format('backend', 'load', 'sign'))
+    for name, _, _ in BACKENDS:
+        if name in results:
+            load, sign = results[name]
+            sys.stdout.write('{:<14}{:>10.2f}ms{:>10.2f}ms\n'.format(name, load * 1e3, sign * 1e3))
+    sys.stdout.write('default backend: {}\n'.format(_LoadBackend()[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -37,8 +37,6 @@ from adb import adb_protocol
 class CryptographySigner(adb_protocol.AuthSigner):
     """AuthSigner using cryptography.io.
 
-    .. warning:: This is currently broken!
-
     .. image:: _static/adb.sign_cryptography.CryptographySigner.CALL_GRAPH.svg
 
     Parameters
@@ -58,7 +56,7 @@ class CryptographySigner(adb_protocol.AuthSigner):
         with open(rsa_key_path + '.pub') as rsa_pub_file:
             self.public_key = rsa_pub_file.read()
 
-        with open(rsa_key_path) as rsa_prv_file:
+        with open(rsa_key_path, 'rb') as rsa_prv_file:
             self.rsa_key = serialization.load_pem_private_key(rsa_prv_file.read(), None, default_backend())
 
     def Sign(self, data):
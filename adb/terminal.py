@@ -0,0 +1,215 @@
+# Copyright 2014 Google Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Clean up the output of an interactive shell as it arrives.
+
+A ``shell:`` stream without a command runs in a terminal, so its output has the echo of what we type, ``\\r\\n`` line
+endings, and backspaces that erase characters. :class:`TerminalOutputCleaner` undoes these in one pass over the
+output, keeping only the line that is being printed, and looks for a delimiter (usually the shell's prompt) even if
+it is split across packets.
+
+
+.. rubric:: Contents
+
+* :func:`CleanTerminalOutput`
+* :class:`TerminalOutputCleaner`
+
+    * :meth:`TerminalOutputCleaner._Search`
+    * :meth:`TerminalOutputCleaner._Write`
+    * :meth:`TerminalOutputCleaner.Feed`
+    * :meth:`TerminalOutputCleaner.Flush`
+
+"""
+
+import re
+
+
+#: The bytes that move the cursor: backspace, carriage return, and line feed
+_CONTROL_RE = re.compile(b'[\x08\r\n]')
+
+
+class TerminalOutputCleaner(object):
+    """Turn the output of a terminal into what it displays, one chunk at a time.
+
+    A backspace erases the character before the cursor, a carriage return moves the cursor to the start of the line,
+    and a line feed ends the line. Lines therefore end with ``\\n``, whether the terminal sent ``\\n``, ``\\r\\n`` or
+    ``\\r\\r\\n``. Only the current line is kept, so each byte is handled once.
+
+    .. image:: _static/adb.terminal.TerminalOutputCleaner.__init__.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    delim : bytes, None
+        If not ``None``, look for this in the output
+    clean : bool
+        If ``False``, pass the output through unchanged, and only look for ``delim``
+
+    Attributes
+    ----------
+    clean : bool
+        Whether the output is cleaned
+    delim : bytes, None
+        What to look for in the output
+    found_delim : bool
+        Whether ``delim`` was found
+    _cursor : int
+        The position of the cursor in ``_line``
+    _line : bytearray
+        The line that is being printed, or the last bytes of the output if ``clean`` is ``False``
+    _searched : int
+        How much of ``_line`` was searched for ``delim`` and hasn't changed since
+
+    """
+    def __init__(self, delim=None, clean=True):
+        self.clean = clean
+        self.delim = delim
+        self.found_delim = False
+        self._cursor = 0
+        self._line = bytearray()
+        self._searched = 0
+
+    def Feed(self, data):
+        """Process a chunk of output.
+
+        .. image:: _static/adb.terminal.TerminalOutputCleaner.Feed.CALL_GRAPH.svg
+
+        .. image:: _static/adb.terminal.TerminalOutputCleaner.Feed.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        data : bytes, bytearray, memoryview
+            The output
+
+        Returns
+        -------
+        bytes
+            The lines that were completed, or all of ``data`` if :attr:`TerminalOutputCleaner.clean` is ``False``
+
+        """
+        data = bytes(data)
+        if not self.clean:
+            if self.delim:
+                # Keep enough of the output to find a delimiter that starts in this chunk and ends in the next one.
+                self._line += data
+                self._Search()
+                del self._line[:max(0, len(self._line) - len(self.delim) + 1)]
+                self._searched = len(self._line)
+            return data
+
+        lines = []
+        pos = 0
+        for match in _CONTROL_RE.finditer(data):
+            if match.start() > pos:
+                self._Write(data[pos:match.start()])
+            pos = match.end()
+
+            control = match.group()
+            if control == b'\n':
+                self._Search()
+                lines.append(bytes(self._line) + b'\n')
+                self._line = bytearray()
+                self._cursor = self._searched = 0
+            elif control == b'\r':
+                self._cursor = 0
+            elif self._cursor:
+                self._cursor -= 1
+                del self._line[self._cursor]
+                self._searched = min(self._searched, self._cursor)
+
+        if pos < len(data):
+            self._Write(data[pos:])
+        self._Search()
+
+        return b''.join(lines)
+
+    def Flush(self):
+        """Get the line that is being printed, e.g. the shell's prompt.
+
+        .. image:: _static/adb.terminal.TerminalOutputCleaner.Flush.CALLER_GRAPH.svg
+
+        Returns
+        -------
+        bytes
+            The output that :meth:`TerminalOutputCleaner.Feed` hasn't returned yet
+
+        """
+        if not self.clean:
+            return b''
+
+        line = bytes(self._line)
+        self._line = bytearray()
+        self._cursor = self._searched = 0
+        return line
+
+    def _Search(self):
+        """Look for :attr:`TerminalOutputCleaner.delim` in the part of the current line that changed.
+
+        .. image:: _static/adb.terminal.TerminalOutputCleaner._Search.CALLER_GRAPH.svg
+
+        """
+        if self.delim and not self.found_delim:
+            start = max(0, self._searched - len(self.delim) + 1)
+            self.found_delim = self._line.find(self.delim, start) != -1
+        self._searched = len(self._line)
+
+    def _Write(self, text):
+        """Print text at the cursor, overwriting what is there.
+
+        .. image:: _static/adb.terminal.TerminalOutputCleaner._Write.CALLER_GRAPH.svg
+
+        Parameters
+        ----------
+        text : bytes
+            Text without control characters
+
+        """
+        end = self._cursor + len(text)
+        self._line[self._cursor:end] = text
+        self._searched = min(self._searched, self._cursor)
+        self._cursor = end
+
+
+def CleanTerminalOutput(chunks, delim=None, clean=True):
+    """Clean up the output of a terminal as it arrives, stopping once the delimiter is found.
+
+    .. image:: _static/adb.terminal.CleanTerminalOutput.CALL_GRAPH.svg
+
+    .. image:: _static/adb.terminal.CleanTerminalOutput.CALLER_GRAPH.svg
+
+    Parameters
+    ----------
+    chunks : iterable
+        The output, as ``bytes``
+    delim : bytes, None
+        If not ``None``, stop reading ``chunks`` after the one in which this is found
+    clean : bool
+        If ``False``, yield the output unchanged
+
+    Yields
+    ------
+    bytes
+        The output, one or more complete lines at a time, and then the last line, which has no ``\\n``
+
+    """
+    cleaner = TerminalOutputCleaner(delim, clean)
+    for data in chunks:
+        output = cleaner.Feed(data)
+        if output:
+            yield output
+        if cleaner.found_delim:
+            break
+
+    output = cleaner.Flush()
+    if output:
+        yield output
@@ -38,13 +38,23 @@ def main():
   with zipfile.ZipFile('adb.zip', 'w', zipfile.ZIP_DEFLATED) as z:
     z.write('adb/__init__.py')
     z.write('adb/adb_commands.py')
+    z.write('adb/adb_commands_async.py')
     z.write('adb/adb_debug.py', '__main__.py')
     z.write('adb/adb_protocol.py')
+    z.write('adb/async_io.py')
+    z.write('adb/checksum.py')
     z.write('adb/common.py')
     z.write('adb/common_cli.py')
     z.write('adb/filesync_protocol.py')
+    z.write('adb/filesync_protocol_async.py')
+    z.write('adb/forwarding.py')
+    z.write('adb/sansio.py')
+    z.write('adb/shell_pool.py')
+    z.write('adb/shell_protocol.py')
+    z.write('adb/sign_auto.py')
     z.write('adb/sign_cryptography.py')
     z.write('adb/sign_pythonrsa.py')
+    z.write('adb/terminal.py')
     z.write('adb/usb_exceptions.py')
   with zipfile.ZipFile('fastboot.zip', 'w', zipfile.ZIP_DEFLATED) as z:
     z.write('adb/__init__.py')
@@ -66,7 +66,8 @@ Android project's ADB.
     ],
 
     extras_require = {
-        'fastboot': 'progressbar>=2.3'
+        'fastboot': 'progressbar>=2.3',
+        'numpy': 'numpy'
     },
 
     tests_require = ['cryptography', 'pycryptodome', 'rsa'],
@@ -0,0 +1,186 @@
+"""Stubs for tests of :mod:`adb.adb_commands_async`; they require Python 3.6 or later."""
+
+import asyncio
+import struct
+import unittest
+
+from adb import adb_commands_async
+from adb import adb_protocol
+from adb import filesync_protocol
+
+
+ID_TO_WIRE = filesync_protocol.FileSyncConnection.id_to_wire
+WIRE_TO_ID = filesync_protocol.FileSyncConnection.wire_to_id
+
+
+def Packet(command, arg0, arg1, data=b''):
+    return adb_protocol.AdbMessage(command, arg0, arg1, data).Pack() + data
+
+
+class FakeDevice(asyncio.Protocol):
+    """A device with a shell that answers from ``outputs`` and a file system in ``files``."""
+    def __init__(self, max_data=4096):
+        self.buffer = b''
+        self.echoes = {}
+        self.files = {}
+        self.max_data = max_data
+        self.next_id = 100
+        self.outputs = {}
+        self.refused = []
+        self.reverse_streams = {}
+        self.reverses = {}
+        self.services = []
+        self.shell_commands = []
+        self.syncs = {}
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 24:
+            cmd, arg0, arg1, length, _ = adb_protocol.AdbMessage.Unpack(self.buffer[:24])
+            if len(self.buffer) < 24 + length:
+                break
+            payload, self.buffer = self.buffer[24:24 + length], self.buffer[24 + length:]
+            self.Handle(adb_protocol.AdbMessage.constants[cmd], arg0, arg1, payload)
+
+    def Send(self, command, arg0, arg1, data=b''):
+        self.transport.write(Packet(command, arg0, arg1, data))
+
+    def Handle(self, command, arg0, arg1, data):
+        if command == b'CNXN':
+            self.Send(b'CNXN', adb_protocol.VERSION, self.max_data, b'device::ro.product.name=fake;features=shell_v2\0')
+        elif command == b'OPEN':
+            device_id, self.next_id = self.next_id, self.next_id + 1
+            service = data.rstrip(b'\0')
+            self.services.append(service)
+            if service.startswith((b'shell:', b'exec:')):
+                command = service.split(b':', 1)[1]
+                self.shell_commands.append(command)
+                self.Send(b'OKAY', device_id, arg0)
+                output = self.outputs.get(command, b'')
+                for chunk in output if isinstance(output, list) else [output]:
+                    self.Send(b'WRTE', device_id, arg0, chunk)
+                self.Send(b'CLSE', device_id, arg0)
+            elif service.startswith(b'tcp:'):
+                self.echoes[device_id] = arg0
+                self.Send(b'OKAY', device_id, arg0)
+            elif service == b'sync:':
+                self.syncs[device_id] = [arg0, b'', None]
+                self.Send(b'OKAY', device_id, arg0)
+            elif service.startswith(b'reverse:'):
+                self.Send(b'OKAY', device_id, arg0)
+                self.Send(b'WRTE', device_id, arg0, self.HandleReverse(service[8:]))
+                self.Send(b'CLSE', device_id, arg0)
+            else:
+                self.Send(b'CLSE', 0, arg0)
+        elif command == b'OKAY' and arg1 in self.reverse_streams:
+            self.reverse_streams[arg1]['host_id'] = arg0
+        elif command == b'WRTE':
+            self.Send(b'OKAY', arg1, arg0)
+            if arg1 in self.echoes:
+                self.Send(b'WRTE', arg1, arg0, data)
+                return
+            if arg1 in self.reverse_streams:
+                self.reverse_streams[arg1]['received'] += data
+                return
+            self.syncs[arg1][1] += data
+            self.HandleSync(arg1)
+        elif command == b'CLSE' and not arg0:
+            self.refused.append(arg1)
+        elif command == b'CLSE' and arg1 in self.reverse_streams:
+            self.reverse_streams[arg1]['closed'] = True
+        elif command == b'CLSE' and (self.syncs.pop(arg1, None) or self.echoes.pop(arg1, None)):
+            self.Send(b'CLSE', arg1, arg0)
+
+    def HandleReverse(self, command):
+        if command.startswith(b'forward:'):
+            remote, local = command[8:].split(b';')
+            reply = b'OKAY'
+            if remote == b'tcp:0':
+                remote, reply = b'tcp:9123', b'OKAY00049123'
+            self.reverses[remote] = local
+            return reply
+        if command == b'killforward-all':
+            self.reverses.clear()
+            return b'OKAY'
+        remote = command[len(b'killforward:'):]
+        if self.reverses.pop(remote, None) is None:
+            message = b"listener '%s' not found" % remote
+            return b'FAIL%04x%s' % (len(message), message)
+        return b'OKAY'
+
+    def OpenReverse(self, device_id, destination):
+        """Open a stream to the host, like the device does when something connects to a reversed socket."""
+        self.reverse_streams[device_id] = {'closed': False, 'host_id': None, 'received': b''}
+        self.Send(b'OPEN', device_id, 0, destination + b'\0')
+
+    def HandleSync(self, device_id):
+        sync = self.syncs[device_id]
+        host_id = sync[0]
+        while len(sync[1]) >= 8:
+            command_id, size = struct.unpack('<2I', sync[1][:8])
+            command = WIRE_TO_ID[command_id]
+            if command == b'DONE':
+                sync[1] = sync[1][8:]
+                path, contents = sync[2]
+                self.files[path] = contents
+                self.Send(b'WRTE', device_id, host_id, struct.pack('<2I', ID_TO_WIRE[b'OKAY'], 0))
+                continue
+
+            if len(sync[1]) < 8 + size:
+                break
+            data, sync[1] = sync[1][8:8 + size], sync[1][8 + size:]
+            if command == b'SEND':
+                sync[2] = (data.rsplit(b',', 1)[0], b'')
+            elif command == b'DATA':
+                sync[2] = (sync[2][0], sync[2][1] + data)
+            elif command == b'STAT':
+                contents = self.files.get(data)
+                header = (0o100644, len(contents), 1234) if contents is not None else (0, 0, 0)
+                self.Send(b'WRTE', device_id, host_id, struct.pack('<4I', ID_TO_WIRE[b'STAT'], *header))
+            elif command == b'LIST':
+                reply = b''
+                for path in sorted(self.files):
+                    directory, _, name = path.rpartition(b'/')
+                    if directory == data:
+                        reply += struct.pack('<5I', ID_TO_WIRE[b'DENT'], 0o100644, len(self.files[path]), 1234, len(name)) + name
+                self.Send(b'WRTE', device_id, host_id, reply + struct.pack('<5I', ID_TO_WIRE[b'DONE'], 0, 0, 0, 0))
+            elif command == b'RECV':
+                if data not in self.files:
+                    self.Send(b'WRTE', device_id, host_id, struct.pack('<2I', ID_TO_WIRE[b'FAIL'], 9) + b'not found')
+                    continue
+                contents = self.files[data]
+                for start in range(0, len(contents), 1000):
+                    chunk = contents[start:start + 1000]
+                    self.Send(b'WRTE', device_id, host_id, struct.pack('<2I', ID_TO_WIRE[b'DATA'], len(chunk)) + chunk)
+                self.Send(b'WRTE', device_id, host_id, struct.pack('<2I', ID_TO_WIRE[b'DONE'], 0))
+
+
+class AsyncAdbCommandsTestCase(unittest.TestCase):
+    """Connects an :class:`adb.adb_commands_async.AsyncAdbCommands` to a :class:`FakeDevice` in a new event loop."""
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.device = FakeDevice()
+        self.server = self.Run(self.loop.create_server(lambda: self.device, '127.0.0.1', 0))
+        serial = '127.0.0.1:%d' % self.server.sockets[0].getsockname()[1]
+        self.adb = self.Run(adb_commands_async.AsyncAdbCommands().ConnectDevice(serial=serial, banner=b'test', default_timeout_ms=5000))
+
+    def tearDown(self):
+        self.Run(self.adb.Close())
+        self.server.close()
+        self.Run(self.server.wait_closed())
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def Run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def RunUntil(self, condition):
+        async def Wait():
+            while not condition():
+                await asyncio.sleep(0.01)
+        self.Run(asyncio.wait_for(Wait(), 5))
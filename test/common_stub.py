@@ -1,6 +1,7 @@
 """Stubs for tests using common's usb handling."""
 
 import binascii
+import os
 import signal
 import string
 import sys
@@ -116,8 +117,20 @@ class StubTcp(TcpHandle):
   def BulkWrite(self, data, unused_timeout_ms=None):
     return self.stub_base.BulkWrite(data, unused_timeout_ms)
 
+  def BulkWriteV(self, buffers, unused_timeout_ms=None):
+    for data in buffers:
+      self.stub_base.BulkWrite(data, unused_timeout_ms)
+
+  def SendFile(self, fd, offset, count, unused_timeout_ms=None):
+    return self.stub_base.BulkWrite(os.pread(fd, count, offset), unused_timeout_ms)
+
   def BulkRead(self, length, timeout_ms=None):
     return self.stub_base.BulkRead(length, timeout_ms)
 
+  def BulkReadInto(self, view, timeout_ms=None):
+    data = self.stub_base.BulkRead(len(view), timeout_ms)
+    view[:len(data)] = data
+    return len(data)
+
   def Timeout(self, timeout_ms):
     return self.stub_base.Timeout(timeout_ms)
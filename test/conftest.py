@@ -0,0 +1,9 @@
+"""pytest configuration for the tests."""
+
+import sys
+
+
+# These modules test the asyncio API, which requires Python 3.6 or later; on Python 2, they can't even be imported.
+collect_ignore = []
+if sys.version_info < (3, 6):
+    collect_ignore += ['async_stub.py', 'test_adb_commands_async.py', 'test_async_io.py', 'test_forwarding.py']
@@ -82,6 +82,19 @@ class FastbootTest(unittest.TestCase):
     with self.assertRaises(fastboot.FastbootTransferError):
       dev.Download(data)
 
+  def testDownloadPlainHandle(self):
+    # A handle without BulkWriteAsync/FlushWrites still gets every chunk.
+    self.usb = common_stub.StubHandleBase(timeout_ms=None)
+    raw = u'aoeuidhtnsqjkxbmwpyfgcrl'
+
+    self.ExpectDownload([raw])
+    dev = fastboot.FastbootCommands()
+    dev.ConnectDevice(handle=self.usb)
+
+    response = dev.Download(io.StringIO(raw))
+    self.assertEqual(b'Result', response)
+    self.assertEqual([], self.usb.written_data)
+
   def testFlash(self):
     partition = b'yarr'
 
@@ -0,0 +1,115 @@
+"""Tests for adb.adb_commands_async."""
+
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+
+from adb import filesync_protocol
+from adb import usb_exceptions
+
+from test import async_stub
+
+
+class AsyncAdbCommandsTest(async_stub.AsyncAdbCommandsTestCase):
+    def testConnect(self):
+        self.assertEqual(b'device', self.adb.GetState())
+        self.assertEqual(str([b'ro.product.name=fake', b'features=shell_v2\0']), self.adb.build_props)
+        self.assertEqual({b'ro.product.name': b'fake'}, self.adb.banner.properties)
+        self.assertIn(b'shell_v2', self.adb.banner.features)
+
+    def testShell(self):
+        self.device.outputs[b'echo hi'] = b'hi\n'
+        self.assertEqual('hi\n', self.Run(self.adb.Shell('echo hi')))
+
+    def testStreamingShell(self):
+        self.device.outputs[b'logcat'] = [b'line 1\n', b'line 2\n']
+        stream = self.adb.StreamingShell('logcat')
+        output = []
+        while True:
+            try:
+                output.append(self.Run(stream.__anext__()))
+            except StopAsyncIteration:
+                break
+        self.assertEqual(['line 1\n', 'line 2\n'], output)
+
+    def testStreamingShellSplitCharacter(self):
+        self.device.outputs[b'echo caf\xc3\xa9'] = [b'caf\xc3', b'\xa9\n']
+        self.assertEqual('caf\xe9\n', self.Run(self.adb.Shell(b'echo caf\xc3\xa9')))
+
+    def testExecOut(self):
+        self.device.outputs[b'screencap -p'] = [b'\x89PNG\r\n', b'\xff\x00']
+        self.assertEqual(b'\x89PNG\r\n\xff\x00', self.Run(self.adb.ExecOut('screencap -p')))
+
+    def testConcurrentCommands(self):
+        self.device.outputs[b'getprop a'] = b'1'
+        self.device.outputs[b'getprop b'] = b'2'
+        self.device.files[b'/sdcard/f'] = b'data'
+        results = self.Run(asyncio.gather(self.adb.Shell('getprop a'), self.adb.Pull('/sdcard/f'), self.adb.Shell('getprop b')))
+        self.assertEqual(['1', b'data', '2'], results)
+
+    def testPushAndPull(self):
+        data = os.urandom(10000)
+        self.Run(self.adb.Push(io.BytesIO(data), '/sdcard/data.bin'))
+        self.assertEqual(data, self.device.files[b'/sdcard/data.bin'])
+
+        progress = []
+        self.assertEqual(data, self.Run(self.adb.Pull('/sdcard/data.bin', progress_callback=lambda *args: progress.append(args))))
+        self.assertEqual(('/sdcard/data.bin', 10000, 10000), progress[-1])
+
+    def testPushDirectory(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        os.mkdir(os.path.join(tempdir, 'empty'))
+        os.mkdir(os.path.join(tempdir, 'sub'))
+        for i in range(100):
+            with open(os.path.join(tempdir, 'sub', 'f%03d' % i), 'wb') as f:
+                f.write(b'%d' % i)
+
+        progress = []
+        self.Run(self.adb.Push(tempdir, '/sdcard/dir', progress_callback=lambda *args: progress.append(args)))
+
+        # The whole tree goes over one sync: stream, more files than MAX_PENDING_PUSHES ahead of the device.
+        self.assertEqual(1, self.device.services.count(b'sync:'))
+        self.assertEqual(dict((b'/sdcard/dir/sub/f%03d' % i, b'%d' % i) for i in range(100)), self.device.files)
+        self.assertEqual([b"mkdir -p '/sdcard/dir/empty'"], self.device.shell_commands)
+        self.assertEqual(('/sdcard/dir/sub/f099', 190, 190), progress[-1])
+
+    def testPushDirectoryQuotesNames(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        os.mkdir(os.path.join(tempdir, 'it\'s "$(reboot)"'))
+
+        self.Run(self.adb.Push(tempdir, '/sdcard/dir'))
+        self.assertEqual([b'mkdir -p \'/sdcard/dir/it\'\\\'\'s "$(reboot)"\''], self.device.shell_commands)
+
+    def testPullMissingFile(self):
+        with self.assertRaises(filesync_protocol.PullFailedError):
+            self.Run(self.adb.Pull('/sdcard/missing'))
+
+    def testStatAndList(self):
+        self.device.files[b'/sdcard/a'] = b'abc'
+        self.device.files[b'/sdcard/b'] = b''
+        self.assertEqual((0o100644, 3, 1234), self.Run(self.adb.Stat('/sdcard/a')))
+        self.assertEqual([filesync_protocol.DeviceFile(b'a', 0o100644, 3, 1234), filesync_protocol.DeviceFile(b'b', 0o100644, 0, 1234)],
+                         self.Run(self.adb.List('/sdcard')))
+
+    def testInstall(self):
+        self.device.outputs[b'pm install -r "/data/local/tmp/app.apk"'] = b'Success\n'
+        directory = tempfile.mkdtemp()
+        apk_path = os.path.join(directory, 'app.apk')
+        with open(apk_path, 'wb') as f:
+            f.write(b'apk')
+        try:
+            self.assertEqual('Success\n', self.Run(self.adb.Install(apk_path)))
+        finally:
+            os.remove(apk_path)
+            os.rmdir(directory)
+
+        self.assertEqual(b'apk', self.device.files[b'/data/local/tmp/app.apk'])
+        self.assertEqual(b'rm /data/local/tmp/app.apk', self.device.shell_commands[-1])
+
+    def testRefusedStream(self):
+        with self.assertRaises(usb_exceptions.AdbCommandFailureException):
+            self.Run(self.adb._Open(b'nope:'))  # pylint: disable=protected-access
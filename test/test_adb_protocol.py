@@ -15,7 +15,11 @@
 """Tests for adb."""
 
 from io import BytesIO
+import os
+import shutil
 import struct
+import tempfile
+import threading
 import unittest
 from mock import mock
 
@@ -23,7 +27,9 @@ from mock import mock
 from adb import common
 from adb import adb_commands
 from adb import adb_protocol
-from adb.usb_exceptions import TcpTimeoutException, DeviceNotFoundError
+from adb import filesync_protocol
+from adb import shell_protocol
+from adb.usb_exceptions import AdbCommandFailureException, TcpTimeoutException, DeviceAuthError, DeviceNotFoundError, ReadFailedError
 import common_stub
 
 
@@ -54,16 +60,17 @@ class BaseAdbTest(unittest.TestCase):
     return sum(c << (i * 8) for i, c in enumerate(bytearray(command)))
 
   @classmethod
-  def _MakeHeader(cls, command, arg0, arg1, data):
+  def _MakeHeader(cls, command, arg0, arg1, data, checksum=None):
     command = cls._ConvertCommand(command)
     magic = command ^ 0xFFFFFFFF
-    checksum = adb_protocol.AdbMessage.CalculateChecksum(data)
+    if checksum is None:
+      checksum = adb_protocol.AdbMessage.CalculateChecksum(data)
     return struct.pack(b'<6I', command, arg0, arg1, len(data), checksum, magic)
 
   @classmethod
-  def _ExpectConnection(cls, usb):
-    cls._ExpectWrite(usb, b'CNXN', 0x01000000, 4096, b'host::%s\0' % BANNER)
-    cls._ExpectRead(usb, b'CNXN', 0, 0, b'device::\0')
+  def _ExpectConnection(cls, usb, max_data=0, banner=b'device::\0'):
+    cls._ExpectWrite(usb, b'CNXN', 0x01000001, 1024 * 1024, b'host::%s;features=delayed_ack,shell_v2\0' % BANNER)
+    cls._ExpectRead(usb, b'CNXN', 0, max_data, banner)
 
   @classmethod
   def _ExpectOpen(cls, usb, service):
@@ -99,6 +106,119 @@ class AdbTest(BaseAdbTest):
     dev = adb_commands.AdbCommands()
     dev.ConnectDevice(handle=usb, banner=BANNER)
 
+  def testConnectParsesBanner(self):
+    tcp = common_stub.StubTcp('10.0.0.42')
+    self._ExpectConnection(tcp, banner=b'device::ro.product.name=x;ro.product.model=y;features=shell_v2,stat_v2\0')
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=tcp, banner=BANNER)
+    self.assertEqual(b'device', dev.GetState())
+    self.assertEqual(str([b'ro.product.name=x', b'ro.product.model=y', b'features=shell_v2,stat_v2\0']), dev.build_props)
+    self.assertEqual({b'ro.product.name': b'x', b'ro.product.model': b'y'}, dev.banner.properties)
+    self.assertTrue(dev.HasFeature(b'stat_v2'))
+    self.assertFalse(dev.HasFeature(b'apex'))
+    self.assertEqual(dev.banner, adb_commands.AdbCommands.CachedBanner('10.0.0.42:5555'))
+    self.assertEqual(dev.banner, adb_protocol.AdbMessage.Banner(tcp))
+
+  def testConnectTriesAcceptedKeyFirst(self):
+    class FakeSigner(object):
+      def __init__(self, name):
+        self.name = name
+
+      def Sign(self, data):
+        return self.name + b':' + data
+
+      def GetPublicKey(self):
+        return self.name.decode('utf-8')
+
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    accepted_keys_path = os.path.join(tempdir, '.android', 'adb_accepted_keys.json')
+    patch_path = mock.patch.object(adb_protocol.AdbMessage, 'accepted_keys_path', accepted_keys_path)
+    patch_keys = mock.patch.object(adb_protocol.AdbMessage, '_accepted_keys', None)
+    patch_path.start()
+    patch_keys.start()
+    self.addCleanup(patch_path.stop)
+    self.addCleanup(patch_keys.stop)
+    keys = [FakeSigner(b'old'), FakeSigner(b'new')]
+
+    tcp = common_stub.StubTcp('10.0.0.7')
+    self._ExpectWrite(tcp, b'CNXN', 0x01000001, 1024 * 1024, b'host::%s;features=delayed_ack,shell_v2\0' % BANNER)
+    self._ExpectRead(tcp, b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token')
+    self._ExpectWrite(tcp, b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'old:token')
+    self._ExpectRead(tcp, b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token')
+    self._ExpectWrite(tcp, b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'new:token')
+    self._ExpectRead(tcp, b'CNXN', 0, 0, b'device::\0')
+    adb_commands.AdbCommands().ConnectDevice(handle=tcp, banner=BANNER, rsa_keys=keys)
+
+    # The device accepted the second key, so it is tried first when reconnecting.
+    tcp = common_stub.StubTcp('10.0.0.7')
+    self._ExpectWrite(tcp, b'CNXN', 0x01000001, 1024 * 1024, b'host::%s;features=delayed_ack,shell_v2\0' % BANNER)
+    self._ExpectRead(tcp, b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token')
+    self._ExpectWrite(tcp, b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'new:token')
+    self._ExpectRead(tcp, b'CNXN', 0, 0, b'device::\0')
+    adb_commands.AdbCommands().ConnectDevice(handle=tcp, banner=BANNER, rsa_keys=keys)
+
+    # It is saved, so it is also tried first by a new process.
+    adb_protocol.AdbMessage._accepted_keys = None
+    self.assertTrue(os.path.exists(accepted_keys_path))
+    self.assertIs(keys[1], adb_protocol.AdbMessage.AcceptedKey('10.0.0.7:5555', keys))
+    self.assertIsNone(adb_protocol.AdbMessage.AcceptedKey('10.0.0.8:5555', keys))
+    self.assertIsNone(adb_protocol.AdbMessage.AcceptedKey(None, keys))
+
+  def testAcceptedKeysAreReplacedAtOnce(self):
+    signer = mock.Mock(**{'GetPublicKey.return_value': 'key'})
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    accepted_keys_path = os.path.join(tempdir, 'adb_accepted_keys.json')
+    patch_path = mock.patch.object(adb_protocol.AdbMessage, 'accepted_keys_path', accepted_keys_path)
+    patch_keys = mock.patch.object(adb_protocol.AdbMessage, '_accepted_keys', None)
+    patch_path.start()
+    patch_keys.start()
+    self.addCleanup(patch_path.stop)
+    self.addCleanup(patch_keys.stop)
+
+    adb_protocol.AdbMessage.RememberAcceptedKey('10.0.0.7:5555', signer)
+    self.assertEqual(['adb_accepted_keys.json'], os.listdir(tempdir))
+
+    # If the new file can't be moved into place, the old one is kept and the temporary file is removed.
+    with mock.patch.object(os, 'rename', side_effect=OSError):
+      adb_protocol.AdbMessage.RememberAcceptedKey('10.0.0.8:5555', signer)
+    self.assertEqual(['adb_accepted_keys.json'], os.listdir(tempdir))
+    adb_protocol.AdbMessage._accepted_keys = None
+    self.assertIs(signer, adb_protocol.AdbMessage.AcceptedKey('10.0.0.7:5555', [signer]))
+    self.assertIsNone(adb_protocol.AdbMessage.AcceptedKey('10.0.0.8:5555', [signer]))
+
+  def testConnectSendsPublicKey(self):
+    class FakeSigner(object):
+      def Sign(self, data):
+        return b'sig:' + data
+
+      def GetPublicKey(self):
+        return b'public'
+
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectWrite(usb, b'CNXN', 0x01000001, 1024 * 1024, b'host::%s;features=delayed_ack,shell_v2\0' % BANNER)
+    self._ExpectRead(usb, b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token')
+    self._ExpectWrite(usb, b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'sig:token')
+    self._ExpectRead(usb, b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token')
+    self._ExpectWrite(usb, b'AUTH', adb_protocol.AUTH_RSAPUBLICKEY, 0, b'public\0')
+
+    bulk_read = usb.BulkRead
+
+    def BulkRead(length, timeout_ms=None):
+      if usb.stub_base.read_data:
+        return bulk_read(length, timeout_ms)
+      # Nobody accepts the key on the device.
+      self.assertEqual(50, timeout_ms)
+      raise ReadFailedError('Timed out', common.usb1.USBErrorTimeout())
+
+    usb.BulkRead = BulkRead
+
+    with self.assertRaises(DeviceAuthError):
+      adb_protocol.AdbMessage.Connect(usb, BANNER, rsa_keys=[FakeSigner()], auth_timeout_ms=50)
+    self.assertEqual([], usb.stub_base.written_data)
+
   def testConnectSerialString(self):
     dev = adb_commands.AdbCommands()
 
@@ -115,6 +235,19 @@ class AdbTest(BaseAdbTest):
     dev.ConnectDevice(handle=usb, banner=BANNER)
     self.assertEqual(response, dev.Shell(command))
 
+  def testHandleWithOnlyBulkWrite(self):
+    # Handles don't have to implement ``BulkWriteV``.
+    usb = common_stub.StubHandleBase(0)
+    self.assertFalse(hasattr(usb, 'BulkWriteV'))
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'shell:ls\0')
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, 0, b'file')
+    self._ExpectClose(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual('file', dev.Shell('ls'))
+
   def testBigResponseShell(self):
     command = b'keepin it real big'
     # The data doesn't have to be big, the point is that it just concatenates
@@ -154,6 +287,100 @@ class AdbTest(BaseAdbTest):
       response_count = response_count + 1
     self.assertEqual(len(responses), response_count)
 
+  def testStreamingShellSplitCharacter(self):
+    command = b'echo caf\xc3\xa9'
+    # The two bytes of the last character arrive in different packets.
+    usb = self._ExpectCommand(b'shell', command, b'caf\xc3', b'\xa9\n')
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual([u'caf', u'\xe9\n'], list(dev.StreamingShell(command)))
+
+  def testExecOut(self):
+    command = b'screencap -p'
+    responses = [b'\x89PNG\r\n\x1a\n', b'\xff\xfe\x00\x01']
+    usb = self._ExpectCommand(b'exec', command, *responses)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual(b''.join(responses), dev.ExecOut(command))
+
+  def testStreamingExecWithoutCopies(self):
+    command = b'cat /sdcard/backup.tar'
+    responses = [b'\x00' * 100, b'\xff' * 50]
+    usb = self._ExpectCommand(b'exec', command, *responses)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual(responses, [bytes(data) for data in dev.StreamingExec(command, copy=False)])
+
+  def testMessageIsSlotted(self):
+    message = adb_protocol.AdbMessage(b'WRTE', LOCAL_ID, REMOTE_ID, b'data')
+    self.assertFalse(hasattr(message, '__dict__'))
+
+    buffer = bytearray(28)
+    message.PackInto(buffer, 4)
+    self.assertEqual(message.Pack(), bytes(buffer[4:]))
+
+  def testChecksumIsCachedUntilDataChanges(self):
+    message = adb_protocol.AdbMessage(b'WRTE', LOCAL_ID, REMOTE_ID, b'\x01\x02')
+    with mock.patch.object(adb_protocol.AdbMessage, 'CalculateChecksum', return_value=3) as calculate:
+      self.assertEqual(3, message.checksum)
+      self.assertEqual(3, message.checksum)
+      calculate.assert_called_once_with(b'\x01\x02')
+
+      message.data = b'\x05'
+      self.assertEqual(3, message.checksum)
+      calculate.assert_called_with(b'\x05')
+
+  def testReadIntoBuffer(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    usb.ExpectRead(self._MakeHeader(b'WRTE', REMOTE_ID, LOCAL_ID, b'payload'))
+    usb.ExpectRead(b'pay')
+    usb.ExpectRead(b'load')
+    buffer = bytearray(16)
+
+    cmd, _, _, data = adb_protocol.AdbMessage.Read(usb, [b'WRTE'], buffer=buffer)
+    self.assertEqual(b'WRTE', cmd)
+    self.assertIsInstance(data, memoryview)
+    self.assertEqual(b'payload', bytes(data))
+    self.assertEqual(b'payload', bytes(buffer[:7]))
+
+  def testConnectSkipsChecksums(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectWrite(usb, b'CNXN', 0x01000001, 1024 * 1024, b'host::%s;features=delayed_ack,shell_v2\0' % BANNER)
+    # The device already leaves out the checksum of its CNXN message.
+    usb.ExpectRead(self._MakeHeader(b'CNXN', 0x01000001, 4096, b'device::\0', checksum=0))
+    usb.ExpectRead(b'device::\0')
+
+    usb.ExpectWrite(self._MakeHeader(b'OPEN', LOCAL_ID, 0, b'shell:cat\0', checksum=0))
+    usb.ExpectWrite(b'shell:cat\0')
+    self._ExpectRead(usb, b'OKAY', REMOTE_ID, LOCAL_ID)
+    usb.ExpectRead(self._MakeHeader(b'WRTE', REMOTE_ID, 0, b'meow', checksum=0))
+    usb.ExpectRead(b'meow')
+    usb.ExpectWrite(self._MakeHeader(b'OKAY', LOCAL_ID, REMOTE_ID, b'', checksum=0))
+    usb.ExpectWrite(b'')
+    self._ExpectClose(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertTrue(adb_protocol.AdbMessage.SkipsChecksum(usb))
+    self.assertEqual('meow', dev.Shell('cat'))
+
+  def testChecksumIsCheckedForOlderVersion(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectWrite(usb, b'OPEN', LOCAL_ID, 0, b'shell:cat\0')
+    usb.ExpectRead(self._MakeHeader(b'OKAY', REMOTE_ID, LOCAL_ID, b''))
+    usb.ExpectRead(self._MakeHeader(b'WRTE', REMOTE_ID, 0, b'meow', checksum=0))
+    usb.ExpectRead(b'meow')
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertFalse(adb_protocol.AdbMessage.SkipsChecksum(usb))
+    with self.assertRaises(adb_protocol.InvalidChecksumError):
+      dev.Shell('cat')
+
   def testReboot(self):
     usb = self._ExpectCommand(b'reboot', b'', b'')
     dev = adb_commands.AdbCommands()
@@ -237,6 +464,143 @@ class FilesyncAdbTest(BaseAdbTest):
     dev.ConnectDevice(handle=usb, banner=BANNER)
     dev.Push(BytesIO(filedata), '/data', mtime=mtime)
 
+  def testPushNegotiatedMaxData(self):
+    filedata = bytes(bytearray(range(256))) * 1024
+    mtime = 100
+
+    # The device lowers the maximum payload to 128 KiB, and DATA packets are still limited to 64 KiB.
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb, max_data=128 * 1024)
+    self._ExpectOpen(usb, b'sync:\0')
+
+    chunks = [filedata[start:start + filesync_protocol.MAX_PUSH_DATA] for start in range(0, len(filedata), filesync_protocol.MAX_PUSH_DATA)]
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'SEND', b'/data,33272') + self._MakeWriteSyncPacket(b'DATA', chunks[0]))
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'DATA', chunks[1]))
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'DATA', chunks[2]))
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'DATA', chunks[3]) + self._MakeWriteSyncPacket(b'DONE', size=mtime))
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'OKAY\0\0\0\0')
+    self._ExpectClose(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual(128 * 1024, adb_protocol.AdbMessage.MaxData(usb))
+    dev.Push(BytesIO(filedata), '/data', mtime=mtime)
+
+  def testSendBufferGrowsOnDemand(self):
+    adb_connection = mock.Mock(max_data=adb_protocol.HOST_MAX_ADB_DATA)
+    cnxn = filesync_protocol.FileSyncConnection(adb_connection, b'<4I')
+    self.assertEqual(0, len(cnxn.send_buffer))
+
+    cnxn.Send(b'STAT', b'/data')
+    self.assertEqual(len(self._MakeWriteSyncPacket(b'STAT', b'/data')), len(cnxn.send_buffer))
+
+  def testPushDirectory(self):
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    os.mkdir(os.path.join(tempdir, 'empty'))
+    os.mkdir(os.path.join(tempdir, 'sub'))
+    with open(os.path.join(tempdir, 'a'), 'wb') as f:
+      f.write(b'alpha')
+    with open(os.path.join(tempdir, 'sub', 'b'), 'wb') as f:
+      f.write(b'beta')
+    mtime = 100
+
+    # Only the empty directory is created with a shell command.
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b"shell:mkdir -p '/data/dir/empty'\0")
+    self._ExpectClose(usb)
+
+    # Both files go over one sync: stream, in one packet, before the device confirms either of them.
+    self._ExpectOpen(usb, b'sync:\0')
+    send = [
+        self._MakeWriteSyncPacket(b'SEND', b'/data/dir/a,33272'),
+        self._MakeWriteSyncPacket(b'DATA', b'alpha'),
+        self._MakeWriteSyncPacket(b'DONE', size=mtime),
+        self._MakeWriteSyncPacket(b'SEND', b'/data/dir/sub/b,33272'),
+        self._MakeWriteSyncPacket(b'DATA', b'beta'),
+        self._MakeWriteSyncPacket(b'DONE', size=mtime),
+    ]
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, b''.join(send))
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'OKAY\0\0\0\0' * 2)
+    self._ExpectClose(usb)
+
+    progress = []
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    dev.Push(tempdir, '/data/dir', mtime=mtime, progress_callback=lambda *args: progress.append(args))
+    self.assertEqual([('/data/dir/a', 5, 9), ('/data/dir/sub/b', 9, 9)], progress)
+
+  def testPushDirectoryQuotesNames(self):
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    os.mkdir(os.path.join(tempdir, 'it\'s "$(reboot)"'))
+
+    # The shell doesn't expand anything in the name.
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'shell:mkdir -p \'/data/dir/it\'\\\'\'s "$(reboot)"\'\0')
+    self._ExpectClose(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    dev.Push(tempdir, '/data/dir')
+
+  def testPushFilesKeepsEarlyResponses(self):
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    with open(os.path.join(tempdir, 'a'), 'wb') as f:
+      f.write(b'x' * 3000)
+    with open(os.path.join(tempdir, 'b'), 'wb') as f:
+      f.write(b'y' * 3000)
+    mtime = 100
+
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'sync:\0')
+
+    # The second file doesn't fit in the first packet.
+    first = (self._MakeWriteSyncPacket(b'SEND', b'/data/dir/a,33272') + self._MakeWriteSyncPacket(b'DATA', b'x' * 3000) +
+             self._MakeWriteSyncPacket(b'DONE', size=mtime) + self._MakeWriteSyncPacket(b'SEND', b'/data/dir/b,33272'))
+    usb.ExpectWrite(self._MakeHeader(b'WRTE', LOCAL_ID, REMOTE_ID, first))
+    usb.ExpectWrite(first)
+
+    # The device confirms the first file before it acks the packet; the confirmation must not be lost.
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'OKAY\0\0\0\0')
+    self._ExpectRead(usb, b'OKAY', REMOTE_ID, LOCAL_ID)
+
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'DATA', b'y' * 3000) + self._MakeWriteSyncPacket(b'DONE', size=mtime))
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'OKAY\0\0\0\0')
+    self._ExpectClose(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    dev.Push(tempdir, '/data/dir', mtime=mtime)
+
+  def testPushFilesFailure(self):
+    tempdir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, tempdir)
+    with open(os.path.join(tempdir, 'a'), 'wb') as f:
+      f.write(b'alpha')
+    mtime = 100
+
+    send = [
+        self._MakeWriteSyncPacket(b'SEND', b'/system/a,33272'),
+        self._MakeWriteSyncPacket(b'DATA', b'alpha'),
+        self._MakeWriteSyncPacket(b'DONE', size=mtime),
+    ]
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'sync:\0')
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, b''.join(send))
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, self._MakeWriteSyncPacket(b'FAIL', b'Read-only file system'))
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    with self.assertRaises(filesync_protocol.PushFailedError) as cm:
+      dev.Push(tempdir, '/system', mtime=mtime)
+    self.assertIn('/system/a due to: Read-only file system', str(cm.exception))
+
   def testPull(self):
     filedata = b"g'ddayta, govnah"
 
@@ -250,6 +614,411 @@ class FilesyncAdbTest(BaseAdbTest):
     dev.ConnectDevice(handle=usb, banner=BANNER)
     self.assertEqual(filedata, dev.Pull('/data'))
 
+  @unittest.skipUnless(hasattr(os, 'sendfile'), 'os.sendfile is not available')
+  def testPushRegularFileOverTcp(self):
+    filedata = b'alo there, govnah' * 500
+    mtime = 100
+
+    tcp = common_stub.StubTcp('10.0.0.123')
+    self._ExpectConnection(tcp)
+    self._ExpectOpen(tcp, b'sync:\0')
+
+    # The SEND packet doesn't fit next to a full DATA packet.
+    self._ExpectWrite(tcp, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'SEND', b'/data,33272'))
+
+    # The file's contents are sent from its file descriptor, after the headers.
+    chunk_size = adb_protocol.MAX_ADB_DATA - 8
+    for start in range(0, len(filedata), chunk_size):
+      chunk = filedata[start:start + chunk_size]
+      data = self._MakeSyncHeader(b'DATA', len(chunk))
+      tcp.ExpectWrite(self._MakeHeader(b'WRTE', LOCAL_ID, REMOTE_ID, data + chunk))
+      tcp.ExpectWrite(data)
+      tcp.ExpectWrite(chunk)
+      self._ExpectRead(tcp, b'OKAY', 0, 0)
+
+    self._ExpectWrite(tcp, b'WRTE', LOCAL_ID, REMOTE_ID, self._MakeWriteSyncPacket(b'DONE', size=mtime))
+    self._ExpectRead(tcp, b'WRTE', REMOTE_ID, LOCAL_ID, b'OKAY\0\0\0\0')
+    self._ExpectClose(tcp)
+
+    with tempfile.TemporaryFile() as datafile:
+      datafile.write(filedata)
+      datafile.seek(0)
+
+      dev = adb_commands.AdbCommands()
+      dev.ConnectDevice(handle=tcp, banner=BANNER)
+      dev.Push(datafile, '/data', mtime=mtime)
+
+
+class MultiplexerTest(BaseAdbTest):
+
+  @classmethod
+  def _ExpectPacket(cls, usb, command, arg0, arg1, data=b''):
+    usb.ExpectRead(cls._MakeHeader(command, arg0, arg1, data))
+    if data:
+      usb.ExpectRead(data)
+
+  @classmethod
+  def _ExpectStreams(cls, usb, *remote_ids):
+    cls._ExpectConnection(usb)
+    for local_id, remote_id in enumerate(remote_ids, 1):
+      cls._ExpectWrite(usb, b'OPEN', local_id, 0, b'shell:%d\0' % local_id)
+      cls._ExpectPacket(usb, b'OKAY', remote_id, local_id)
+
+  @classmethod
+  def _OpenStreams(cls, usb, count):
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    return [adb_protocol.AdbMessage.Open(usb, b'shell:%d' % local_id) for local_id in range(1, count + 1)]
+
+  def testInterleavedStreams(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectWrite(usb, b'OPEN', 1, 0, b'logcat:\0')
+    self._ExpectPacket(usb, b'OKAY', 10, 1)
+    self._ExpectWrite(usb, b'OPEN', 2, 0, b'shell:ls\0')
+    self._ExpectPacket(usb, b'OKAY', 20, 2)
+
+    # Logcat output arrives while the shell stream is reading; it is only acked when logcat reads it.
+    self._ExpectPacket(usb, b'WRTE', 10, 1, b'log line')
+    self._ExpectPacket(usb, b'WRTE', 20, 2, b'file')
+    self._ExpectWrite(usb, b'OKAY', 2, 20, b'')
+    self._ExpectPacket(usb, b'CLSE', 20, 2)
+    self._ExpectWrite(usb, b'CLSE', 2, 20, b'')
+    self._ExpectWrite(usb, b'OKAY', 1, 10, b'')
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    logcat = adb_protocol.AdbMessage.Open(usb, b'logcat:')
+    shell = adb_protocol.AdbMessage.Open(usb, b'shell:ls')
+
+    self.assertEqual([b'file'], list(shell.ReadUntilClose()))
+    self.assertEqual((b'WRTE', b'log line'), logcat.ReadUntil(b'WRTE'))
+
+    # The shell's local id is free again.
+    self.assertEqual(2, adb_protocol.AdbMessage.Multiplexer(usb).transport.Open(b'shell:pwd'))
+
+  def testPacketsForClosedStreamsAreDropped(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'shell:ls\0')
+    self._ExpectPacket(usb, b'WRTE', REMOTE_ID, 7, b'stale')
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'file')
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    shell = adb_protocol.AdbMessage.Open(usb, b'shell:ls')
+    self.assertEqual((b'WRTE', b'file'), shell.ReadUntil(b'WRTE'))
+
+  def testRefusedStream(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectWrite(usb, b'OPEN', LOCAL_ID, 0, b'nope:\0')
+    # A late CLSE for an earlier stream with the same local id comes first.
+    self._ExpectPacket(usb, b'CLSE', 5, LOCAL_ID)
+    self._ExpectPacket(usb, b'CLSE', 0, LOCAL_ID)
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    self.assertIsNone(adb_protocol.AdbMessage.Open(usb, b'nope:'))
+    self.assertEqual(LOCAL_ID, adb_protocol.AdbMessage.Multiplexer(usb).transport.Open(b'shell:'))
+
+  def testWriteToClosedStream(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'shell:\0')
+    usb.ExpectWrite(self._MakeHeader(b'WRTE', LOCAL_ID, REMOTE_ID, b'ls\n'))
+    usb.ExpectWrite(b'ls\n')
+    # The device closes the stream instead of acking the write.
+    self._ExpectPacket(usb, b'CLSE', REMOTE_ID, LOCAL_ID)
+    self._ExpectWrite(usb, b'CLSE', LOCAL_ID, REMOTE_ID, b'')
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    shell = adb_protocol.AdbMessage.Open(usb, b'shell:')
+    with self.assertRaises(adb_protocol.InvalidCommandError):
+      shell.Write(b'ls\n')
+    with self.assertRaises(adb_protocol.InvalidCommandError):
+      shell.Write(b'pwd\n')
+    self.assertEqual([], list(shell.ReadUntilClose()))
+    self.assertEqual([], usb.stub_base.written_data)
+
+  def testConcurrentReaders(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectStreams(usb, 10, 20)
+    # Packets for the second stream come first.
+    for local_id, remote_id in ((2, 20), (1, 10)):
+      self._ExpectPacket(usb, b'WRTE', remote_id, local_id, b'data for %d' % local_id)
+    streams = self._OpenStreams(usb, 2)
+
+    # Which thread reads which packet, and so the order of the acks, depends on timing.
+    written = []
+    usb.BulkWrite = lambda data, timeout_ms=None: written.append(bytes(data))
+    results = {}
+
+    def Reader(stream):
+      results[stream.local_id] = stream.ReadUntil(b'WRTE')[1]
+
+    threads = [threading.Thread(target=Reader, args=(stream,)) for stream in streams]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    self.assertEqual({1: b'data for 1', 2: b'data for 2'}, results)
+    self.assertEqual(sorted([self._MakeHeader(b'OKAY', 1, 10, b''), self._MakeHeader(b'OKAY', 2, 20, b'')]),
+                     sorted(data for data in written if data))
+
+  def testReaderThreadAcksPromptly(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectStreams(usb, 10, 20)
+    self._ExpectPacket(usb, b'WRTE', 10, 1, b'first')
+    self._ExpectPacket(usb, b'WRTE', 20, 2, b'second')
+    self._ExpectWrite(usb, b'OKAY', 1, 10, b'')
+    self._ExpectWrite(usb, b'OKAY', 2, 20, b'')
+    first, second = self._OpenStreams(usb, 2)
+    multiplexer = adb_protocol.AdbMessage.Multiplexer(usb)
+
+    multiplexer.StartReader(usb)
+    self.assertEqual((b'WRTE', b'second'), second.ReadUntil(b'WRTE'))
+    self.assertEqual((b'WRTE', b'first'), first.ReadUntil(b'WRTE'))
+    multiplexer.StopReader()
+
+    # Both packets were acked by the reader thread.
+    self.assertEqual([], usb.stub_base.written_data)
+
+  def testReaderThreadDefersAckWhenQueueIsFull(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectStreams(usb, 10)
+    self._ExpectPacket(usb, b'WRTE', 10, 1, b'first')
+    self._ExpectPacket(usb, b'WRTE', 10, 1, b'second')
+    self._ExpectWrite(usb, b'OKAY', 1, 10, b'')
+    self._ExpectWrite(usb, b'OKAY', 1, 10, b'')
+    stream, = self._OpenStreams(usb, 1)
+    multiplexer = adb_protocol.AdbMessage.Multiplexer(usb)
+
+    # There is room for the second packet or another one of the largest size, but not for both.
+    multiplexer.StartReader(usb, max_queued=len(b'second') + adb_protocol.MAX_ADB_DATA)
+    # The reader thread stops when the stub runs out of data.
+    multiplexer._thread.join()
+    # The second packet hasn't been acked yet.
+    self.assertNotEqual([], usb.stub_base.written_data)
+
+    self.assertEqual((b'WRTE', b'first'), stream.ReadUntil(b'WRTE'))
+    self.assertEqual([], usb.stub_base.written_data)
+    self.assertEqual((b'WRTE', b'second'), stream.ReadUntil(b'WRTE'))
+
+    # Then the reader thread's error is raised.
+    with self.assertRaises(IndexError):
+      stream.ReadUntil(b'WRTE')
+
+  def testReaderThreadFailsOnTimeoutInsidePacket(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectStreams(usb, 10)
+    self._ExpectPacket(usb, b'WRTE', 10, 1, b'first')
+    self._ExpectPacket(usb, b'WRTE', 10, 1, b'second')
+    stream, = self._OpenStreams(usb, 1)
+    multiplexer = adb_protocol.AdbMessage.Multiplexer(usb)
+
+    # The first header read times out before anything is read, which is retried; then the first payload read times
+    # out after its header was read, which is not.
+    timeouts = [True, False, True]
+    bulk_read = usb.BulkRead
+
+    def BulkRead(length, timeout_ms=None):
+      if timeouts and timeouts.pop(0):
+        raise TcpTimeoutException('Timed out')
+      return bulk_read(length, timeout_ms)
+
+    usb.BulkRead = BulkRead
+
+    multiplexer.StartReader(usb)
+    multiplexer._thread.join()
+    with self.assertRaises(TcpTimeoutException):
+      stream.ReadUntil(b'WRTE')
+
+  def testConnectWithReaderThread(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+    self._ExpectOpen(usb, b'shell:ls\0')
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'file')
+    self._ExpectRead(usb, b'CLSE', REMOTE_ID, LOCAL_ID)
+    self._ExpectWrite(usb, b'CLSE', LOCAL_ID, REMOTE_ID, b'')
+
+    # Like a device, don't answer until the stream has been opened.
+    opened = threading.Event()
+    bulk_write, bulk_read = usb.BulkWrite, usb.BulkRead
+
+    def BulkWrite(data, timeout_ms=None):
+      bulk_write(data, timeout_ms)
+      if bytes(data[:4]) == b'OPEN':
+        opened.set()
+
+    def BulkRead(length, timeout_ms=None):
+      if threading.current_thread().name == 'adb-reader':
+        opened.wait()
+      return bulk_read(length, timeout_ms)
+
+    usb.BulkWrite, usb.BulkRead = BulkWrite, BulkRead
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER, reader_thread=True)
+    shell = adb_protocol.AdbMessage.Open(usb, b'shell:ls')
+    self.assertEqual([b'file'], list(shell.ReadUntilClose()))
+    adb_protocol.AdbMessage.Multiplexer(usb).StopReader()
+
+
+class DelayedAckTest(BaseAdbTest):
+
+  @classmethod
+  def _ExpectPacket(cls, usb, command, arg0, arg1, data=b''):
+    usb.ExpectRead(cls._MakeHeader(command, arg0, arg1, data))
+    if data:
+      usb.ExpectRead(data)
+
+  @classmethod
+  def _ExpectDelayedAckOpen(cls, usb, service, window):
+    cls._ExpectWrite(usb, b'CNXN', 0x01000001, 1024 * 1024, b'host::%s;features=delayed_ack,shell_v2\0' % BANNER)
+    cls._ExpectPacket(usb, b'CNXN', 0x01000000, 4096, b'device::ro.product.name=x;features=shell_v2,delayed_ack\0')
+    # The window that streams advertise is what they can hold.
+    cls._ExpectWrite(usb, b'OPEN', LOCAL_ID, adb_protocol.READER_QUEUE_BYTES, service)
+    cls._ExpectPacket(usb, b'OKAY', REMOTE_ID, LOCAL_ID, struct.pack('<I', window))
+
+  def testParseBanner(self):
+    self.assertEqual(adb_protocol.DeviceBanner(b'device', {b'ro.product.name': b'x'}, frozenset([b'shell_v2', b'cmd'])),
+                     adb_protocol.ParseBanner(b'device::ro.product.name=x;features=shell_v2,cmd\0'))
+    self.assertEqual(adb_protocol.DeviceBanner(b'recovery', {}, frozenset()), adb_protocol.ParseBanner(b'recovery::\0'))
+
+  def testWritesWithinWindowDontWait(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectDelayedAckOpen(usb, b'shell:\0', 10)
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, b'12345678')
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, b'abcd')
+    # The window is used up, so the next write waits for the device to ack some bytes.
+    self._ExpectPacket(usb, b'OKAY', REMOTE_ID, LOCAL_ID, struct.pack('<I', 12))
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, b'xy')
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    self.assertTrue(adb_protocol.AdbMessage.DelayedAck(usb))
+    connection = adb_protocol.AdbMessage.Open(usb, b'shell:')
+    self.assertEqual(10, connection.send_window)
+
+    connection.Write(b'12345678')
+    connection.Write(b'abcd')
+    self.assertEqual(-2, connection.send_window)
+    connection.Write(b'xy')
+    self.assertEqual(8, connection.send_window)
+
+  def testReadCreditsWindowAndAcksBytes(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectDelayedAckOpen(usb, b'shell:\0', 4)
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, b'ls\n')
+    self._ExpectPacket(usb, b'OKAY', REMOTE_ID, LOCAL_ID, struct.pack('<I', 3))
+    self._ExpectPacket(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'file')
+    self._ExpectWrite(usb, b'OKAY', LOCAL_ID, REMOTE_ID, struct.pack('<I', 4))
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    connection = adb_protocol.AdbMessage.Open(usb, b'shell:')
+    connection.Write(b'ls\n')
+    self.assertEqual((b'WRTE', b'file'), connection.ReadUntil(b'WRTE'))
+    self.assertEqual(4, connection.send_window)
+
+  def testRoutedWritesAreAckedAsTheyAreRead(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectDelayedAckOpen(usb, b'logcat:\0', 4)
+    self._ExpectWrite(usb, b'OPEN', 2, adb_protocol.READER_QUEUE_BYTES, b'shell:\0')
+    self._ExpectPacket(usb, b'OKAY', 20, 2, struct.pack('<I', 4))
+
+    # Two packets for logcat arrive while the shell is reading, without waiting for an OKAY.
+    self._ExpectPacket(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'abc')
+    self._ExpectPacket(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'defgh')
+    self._ExpectPacket(usb, b'WRTE', 20, 2, b'file')
+    self._ExpectWrite(usb, b'OKAY', 2, 20, struct.pack('<I', 4))
+    # Then logcat acks the bytes of each as it reads them, so the device can't send more than the window on top of
+    # what is still queued.
+    self._ExpectWrite(usb, b'OKAY', LOCAL_ID, REMOTE_ID, struct.pack('<I', 3))
+    self._ExpectWrite(usb, b'OKAY', LOCAL_ID, REMOTE_ID, struct.pack('<I', 5))
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    logcat = adb_protocol.AdbMessage.Open(usb, b'logcat:')
+    shell = adb_protocol.AdbMessage.Open(usb, b'shell:')
+    self.assertEqual((b'WRTE', b'file'), shell.ReadUntil(b'WRTE'))
+    self.assertEqual((b'WRTE', b'abc'), logcat.ReadUntil(b'WRTE'))
+    self.assertEqual((b'WRTE', b'defgh'), logcat.ReadUntil(b'WRTE'))
+    self.assertEqual([], usb.stub_base.written_data)
+
+  def testReaderThreadStaysWithinWindow(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectDelayedAckOpen(usb, b'shell:\0', 4)
+    self._ExpectPacket(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'abc')
+    self._ExpectPacket(usb, b'WRTE', REMOTE_ID, LOCAL_ID, b'defgh')
+    self._ExpectWrite(usb, b'OKAY', LOCAL_ID, REMOTE_ID, struct.pack('<I', 3))
+    self._ExpectWrite(usb, b'OKAY', LOCAL_ID, REMOTE_ID, struct.pack('<I', 5))
+
+    adb_protocol.AdbMessage.Connect(usb, BANNER)
+    connection = adb_protocol.AdbMessage.Open(usb, b'shell:')
+    multiplexer = adb_protocol.AdbMessage.Multiplexer(usb)
+    multiplexer.StartReader(usb)
+    # The reader thread stops when the stub runs out of data.
+    multiplexer._thread.join()
+    # The window is all that the stream can hold, so nothing is acked before it is read.
+    self.assertEqual(4, len(usb.stub_base.written_data))
+
+    self.assertEqual((b'WRTE', b'abc'), connection.ReadUntil(b'WRTE'))
+    self.assertEqual((b'WRTE', b'defgh'), connection.ReadUntil(b'WRTE'))
+    self.assertEqual([], usb.stub_base.written_data)
+
+
+class ShellV2Test(BaseAdbTest):
+
+  @classmethod
+  def _Packet(cls, packet_id, data=b''):
+    return struct.pack(b'<BI', packet_id, len(data)) + data
+
+  @classmethod
+  def _ExpectShellV2(cls, command, *responses):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    cls._ExpectConnection(usb, banner=b'device::features=shell_v2,cmd\0')
+    cls._ExpectOpen(usb, b'shell,v2,raw:%s\0' % command)
+    for response in responses:
+      cls._ExpectRead(usb, b'WRTE', REMOTE_ID, 0, response)
+    cls._ExpectClose(usb)
+    return usb
+
+  def testShellV2(self):
+    stderr = self._Packet(shell_protocol.ID_STDERR, b'err')
+    # Packets can be split across ADB packets.
+    usb = self._ExpectShellV2(b'ls /nope', self._Packet(shell_protocol.ID_STDOUT, b'out') + stderr[:3],
+                              stderr[3:] + self._Packet(shell_protocol.ID_EXIT, b'\x03'))
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual(shell_protocol.ShellV2Result('out', 'err', 3), dev.ShellV2(b'ls /nope'))
+
+  def testShellSelectsShellV2(self):
+    usb = self._ExpectShellV2(b'ls', self._Packet(shell_protocol.ID_STDOUT, b'out'), self._Packet(shell_protocol.ID_STDERR, b'err'),
+                              self._Packet(shell_protocol.ID_EXIT, b'\x00'))
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual('outerr', dev.Shell('ls'))
+
+  def testStreamingShellV2WithStdin(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb, banner=b'device::features=shell_v2\0')
+    self._ExpectOpen(usb, b'shell,v2,raw:cat\0')
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._Packet(shell_protocol.ID_STDIN, b'hi'))
+    self._ExpectWrite(usb, b'WRTE', LOCAL_ID, REMOTE_ID, self._Packet(shell_protocol.ID_CLOSE_STDIN))
+    self._ExpectRead(usb, b'WRTE', REMOTE_ID, 0, self._Packet(shell_protocol.ID_STDOUT, b'hi') + self._Packet(shell_protocol.ID_EXIT, b'\x00'))
+    self._ExpectClose(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    self.assertEqual([shell_protocol.ShellChunk(shell_protocol.ID_STDOUT, b'hi'), shell_protocol.ShellChunk(shell_protocol.ID_EXIT, 0)],
+                     list(dev.StreamingShellV2('cat', stdin=b'hi')))
+
+  def testShellV2Unsupported(self):
+    usb = common_stub.StubUsb(device=None, setting=None)
+    self._ExpectConnection(usb)
+
+    dev = adb_commands.AdbCommands()
+    dev.ConnectDevice(handle=usb, banner=BANNER)
+    with self.assertRaises(AdbCommandFailureException):
+      dev.ShellV2('ls')
+
 
 class TcpTimeoutAdbTest(BaseAdbTest):
         
@@ -0,0 +1,60 @@
+"""Tests for adb.async_io."""
+
+import asyncio
+import unittest
+from mock import mock
+
+import usb1
+
+from adb import async_io
+
+from test import async_stub
+
+
+class UsbIOTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.handle = mock.Mock(_max_read_packet_len=512)
+        self.handle._context.getPollFDList.return_value = []
+        self.handle.Timeout.side_effect = lambda timeout_ms: timeout_ms if timeout_ms is not None else 1000
+        self.handle._handle.getTransfer.side_effect = mock.Mock
+        self.io = self.loop.run_until_complete(self.MakeIO())
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    async def MakeIO(self):
+        return async_io.UsbIO(self.handle)
+
+    def testReadTransfersAreOnePacket(self):
+        # adbd doesn't send zero-length packets, so a bigger transfer could wait for data that never comes.
+        transfers = self.io._read_transfers  # pylint: disable=protected-access
+        self.assertEqual(async_io.USB_READ_TRANSFERS, len(transfers))
+        for transfer in transfers:
+            self.assertEqual(512 * async_io.USB_READ_PACKETS, transfer.setBulk.call_args[0][1])
+
+    def testWritesUseTimeout(self):
+        transfers = []
+
+        def GetTransfer():
+            transfer = mock.Mock()
+            transfer.getStatus.return_value = usb1.TRANSFER_COMPLETED
+            transfer.submit.side_effect = lambda: self.loop.call_soon(self.io._OnWriteDone, transfer)  # pylint: disable=protected-access
+            transfers.append(transfer)
+            return transfer
+
+        self.handle._handle.getTransfer.side_effect = GetTransfer
+
+        self.loop.run_until_complete(self.io.Write(async_stub.Packet(b'WRTE', 1, 2, b'data'), 250))
+        self.assertEqual([250, 250], [transfer.setBulk.call_args[1]['timeout'] for transfer in transfers])
+
+        # By default, the handle's timeout.
+        del transfers[:]
+        self.loop.run_until_complete(self.io.Write(async_stub.Packet(b'OKAY', 1, 2)))
+        self.assertEqual([1000], [transfer.setBulk.call_args[1]['timeout'] for transfer in transfers])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Tests for adb.checksum."""
+
+import unittest
+
+from adb import adb_protocol
+from adb import checksum
+
+import common_stub
+
+
+PAYLOADS = [b'', b'\xff', b'host::\0', bytes(bytearray(range(256))) * 64]
+
+
+class ChecksumTest(unittest.TestCase):
+    def tearDown(self):
+        checksum.SetEngine(checksum.DEFAULT_ENGINE)
+        checksum.TrustTransport(False)
+
+    def testPythonChecksum(self):
+        for data in PAYLOADS:
+            expected = sum(bytearray(data)) & 0xFFFFFFFF
+            self.assertEqual(expected, checksum.PythonChecksum(data))
+            self.assertEqual(expected, checksum.PythonChecksum(bytearray(data)))
+            self.assertEqual(expected, checksum.PythonChecksum(memoryview(data)))
+
+    def testPythonChecksumWraps(self):
+        data = b'\xff' * 256
+        self.assertEqual(255 * 256, checksum.PythonChecksum(data))
+
+    @unittest.skipIf(checksum.numpy is None, 'numpy is not installed')
+    def testNumpyChecksum(self):
+        for data in PAYLOADS:
+            expected = checksum.PythonChecksum(data)
+            self.assertEqual(expected, checksum.NumpyChecksum(data))
+            self.assertEqual(expected, checksum.NumpyChecksum(bytearray(data)))
+            self.assertEqual(expected, checksum.NumpyChecksum(memoryview(data)))
+
+    def testSetEngine(self):
+        checksum.SetEngine('python')
+        self.assertIs(checksum.PythonChecksum, checksum.GetEngine())
+
+        checksum.SetEngine(lambda data: 42)
+        self.assertEqual(42, adb_protocol.AdbMessage.CalculateChecksum(b'data'))
+
+        with self.assertRaises(ValueError):
+            checksum.SetEngine('abacus')
+
+    def testBenchmark(self):
+        results = checksum.Benchmark(sizes=(24, 4096), number=1)
+        self.assertEqual([24, 4096], sorted(results))
+        self.assertEqual(sorted(checksum.ENGINES), sorted(results[24]))
+
+    def testTrustTransport(self):
+        header = adb_protocol.AdbMessage(b'WRTE', 2, 1, b'data').Pack()
+        # Corrupt the checksum.
+        header = header[:16] + b'\1\0\0\0' + header[20:]
+
+        usb = common_stub.StubUsb(device=None, setting=None)
+        usb.ExpectRead(header)
+        usb.ExpectRead(b'data')
+        usb.ExpectRead(header)
+        usb.ExpectRead(b'data')
+
+        with self.assertRaises(adb_protocol.InvalidChecksumError):
+            adb_protocol.AdbMessage.Read(usb, [b'WRTE'])
+
+        checksum.TrustTransport()
+        self.assertEqual((b'WRTE', 2, 1, b'data'), adb_protocol.AdbMessage.Read(usb, [b'WRTE']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,408 @@
+"""Tests for adb.common."""
+
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from mock import mock
+
+import usb1
+
+from adb import common
+from adb import usb_exceptions
+
+
+MAX_PACKET_SIZE = 512
+
+
+class FakeTransfer(object):
+    """A ``usb1.USBTransfer`` that is completed by :class:`FakeContext`."""
+    def __init__(self, context):
+        self._context = context
+        self._submitted = False
+        self._status = None
+        self._buffer = bytearray()
+        self._actual_length = 0
+        self.closed = False
+
+    def setBulk(self, endpoint, buffer_or_len, callback=None, user_data=None, timeout=0):  # pylint: disable=unused-argument
+        self.endpoint = endpoint
+        self._buffer = bytearray(buffer_or_len)
+        self._callback = callback
+        self._user_data = user_data
+
+    def submit(self):
+        self._submitted = True
+        self._context.pending.append(self)
+
+    def cancel(self):
+        self._context.cancelled.append(self)
+
+    def isSubmitted(self):
+        return self._submitted
+
+    def getStatus(self):
+        return self._status
+
+    def getActualLength(self):
+        return self._actual_length
+
+    def getBuffer(self):
+        return self._buffer
+
+    def getUserData(self):
+        return self._user_data
+
+    def close(self):
+        self.closed = True
+
+    def Complete(self, status, data=b''):
+        self._submitted = False
+        self._status = status
+        self._buffer[:len(data)] = data
+        self._actual_length = len(data)
+        self._callback(self)
+
+
+class FakeContext(object):
+    """A ``usb1.USBContext`` that plays back writes from the device, one packet per transfer."""
+    def __init__(self):
+        self.pending = []
+        self.cancelled = []
+        self.packets = []
+        self.written = []
+        self.write_status = usb1.TRANSFER_COMPLETED
+
+    def DeviceWrite(self, data):
+        for i in range(0, len(data), MAX_PACKET_SIZE):
+            self.packets.append(data[i:i + MAX_PACKET_SIZE])
+
+    def handleEventsTimeout(self, tv=0):  # pylint: disable=unused-argument
+        while self.cancelled:
+            transfer = self.cancelled.pop(0)
+            self.pending.remove(transfer)
+            transfer.Complete(usb1.TRANSFER_CANCELLED)
+        writes = [transfer for transfer in self.pending if not transfer.endpoint & 0x80]
+        if writes:
+            self.pending.remove(writes[0])
+            self.written.append(bytes(writes[0].getBuffer()))
+            writes[0].Complete(self.write_status)
+            return
+        reads = [transfer for transfer in self.pending if transfer.endpoint & 0x80]
+        if self.packets and reads:
+            self.pending.remove(reads[0])
+            reads[0].Complete(usb1.TRANSFER_COMPLETED, self.packets.pop(0))
+
+    handleEvents = handleEventsTimeout
+
+
+class FakeDeviceHandle(object):
+    def __init__(self, context):
+        self._context = context
+
+    def getTransfer(self):
+        return FakeTransfer(self._context)
+
+
+class AsyncBulkReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.context = FakeContext()
+        self.reader = common._AsyncBulkReader(FakeDeviceHandle(self.context), self.context, 0x81, 4, MAX_PACKET_SIZE)
+
+    def testKeepsTransfersQueued(self):
+        self.assertEqual(4, len(self.context.pending))
+        self.context.DeviceWrite(b'a' * 24)
+        self.assertEqual(b'a' * 24, self.reader.Read(24, 1000))
+        self.assertEqual(4, len(self.context.pending))
+
+    def testReadCoalescesPackets(self):
+        header = b'h' * 24
+        payload = bytes(bytearray(range(256))) * 16
+        self.context.DeviceWrite(header)
+        self.context.DeviceWrite(payload)
+
+        self.assertEqual(header, self.reader.Read(24, 1000))
+        self.assertEqual(payload, self.reader.Read(len(payload), 1000))
+
+    def testReadStopsAtShortPacket(self):
+        self.context.DeviceWrite(b'x' * 600)
+        self.context.DeviceWrite(b'y' * 10)
+
+        self.assertEqual(b'x' * 600, self.reader.Read(4096, 1000))
+        self.assertEqual(b'y' * 10, self.reader.Read(4096, 1000))
+
+    def testReadSplitsLargeTransfer(self):
+        self.context.DeviceWrite(b'abcdef')
+
+        self.assertEqual(b'abc', self.reader.Read(3, 1000))
+        self.assertEqual(b'def', self.reader.Read(3, 1000))
+
+    def testTimeoutKeepsPartialData(self):
+        self.context.DeviceWrite(b'z' * MAX_PACKET_SIZE)
+
+        with self.assertRaises(usb1.USBErrorTimeout):
+            self.reader.Read(1024, 1)
+        self.context.DeviceWrite(b'z' * 10)
+        self.assertEqual(b'z' * (MAX_PACKET_SIZE + 10), self.reader.Read(1024, 1000))
+
+    def testReadInto(self):
+        self.context.DeviceWrite(b'q' * 600)
+        buffer = bytearray(1024)
+
+        self.assertEqual(600, self.reader.ReadInto(memoryview(buffer), 1000))
+        self.assertEqual(b'q' * 600, bytes(buffer[:600]))
+
+    def testTransferError(self):
+        self.context.pending.pop(0).Complete(usb1.TRANSFER_NO_DEVICE)
+
+        with self.assertRaises(usb1.USBErrorNoDevice):
+            self.reader.Read(24, 1000)
+
+    def testClose(self):
+        transfers = list(self.context.pending)
+        self.reader.Close()
+
+        self.assertEqual([], self.context.pending)
+        self.assertTrue(all(transfer.closed for transfer in transfers))
+
+
+class AsyncBulkWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.context = FakeContext()
+        self.writer = common._AsyncBulkWriter(FakeDeviceHandle(self.context), self.context, 0x01, 2)
+
+    def testOnlyBlocksWhenFull(self):
+        self.writer.Write(b'one', 1000)
+        self.writer.Write(b'two', 1000)
+        self.assertEqual([], self.context.written)
+
+        self.writer.Write(b'three', 1000)
+        self.assertEqual([b'one'], self.context.written)
+
+        self.writer.Flush()
+        self.assertEqual([b'one', b'two', b'three'], self.context.written)
+
+    def testWriteCopiesData(self):
+        data = bytearray(b'abc')
+        self.writer.Write(data, 1000)
+        data[:] = b'xyz'
+
+        self.writer.Flush()
+        self.assertEqual([b'abc'], self.context.written)
+
+    def testFailedWriteIsReported(self):
+        self.context.write_status = usb1.TRANSFER_TIMED_OUT
+        self.writer.Write(b'data', 1000)
+
+        with self.assertRaises(usb1.USBErrorTimeout) as cm:
+            self.writer.Flush()
+        self.assertEqual(4, cm.exception.length)
+
+        # The error is only reported once.
+        self.writer.Flush()
+
+
+class UsbHandleAsyncTest(unittest.TestCase):
+    def _MakeHandle(self, context):
+        handle = common.UsbHandle(device=mock.MagicMock(), setting=None, context=context)
+        handle._handle = FakeDeviceHandle(context)
+        handle._write_endpoint = 0x01
+        return handle
+
+    def testBulkReadAsyncClosedHandle(self):
+        handle = common.UsbHandle(device=None, setting=None)
+        with self.assertRaises(usb_exceptions.ReadFailedError):
+            handle.BulkReadAsync(24)
+        self.assertIsNone(handle._async_reader)
+
+    def testPipelineWrites(self):
+        context = FakeContext()
+        handle = self._MakeHandle(context)
+        handle.pipeline_writes = True
+
+        self.assertEqual(6, handle.BulkWrite(b'header'))
+        self.assertEqual(7, handle.BulkWrite(b'payload'))
+        self.assertEqual([], context.written)
+
+        handle.FlushWrites()
+        self.assertEqual([b'header', b'payload'], context.written)
+
+    def testFlushWritesRaisesWriteFailedError(self):
+        context = FakeContext()
+        context.write_status = usb1.TRANSFER_STALL
+        handle = self._MakeHandle(context)
+
+        handle.BulkWriteAsync(b'data')
+        with self.assertRaises(usb_exceptions.WriteFailedError):
+            handle.FlushWrites()
+
+
+class SocketPairTcpHandle(common.TcpHandle):
+    """A :class:`adb.common.TcpHandle` connected to one end of a socket pair."""
+    def __init__(self, timeout_ms=None):
+        self.device, connection = socket.socketpair()
+        self._connect = mock.MagicMock(return_value=None)
+        super(SocketPairTcpHandle, self).__init__('localhost:5555', timeout_ms)
+        self._connection = connection
+
+
+class TcpHandleReadTest(unittest.TestCase):
+    def setUp(self):
+        self.handle = SocketPairTcpHandle(timeout_ms=1000)
+        self.addCleanup(self.handle.device.close)
+        self.addCleanup(self.handle._connection.close)
+
+    def testHeaderAndPayloadFromOneRecv(self):
+        self.handle.device.sendall(b'h' * 24 + b'p' * 100)
+        self.assertEqual(b'h' * 24, bytes(self.handle.BulkRead(24)))
+
+        with mock.patch('select.select') as select:
+            self.assertEqual(b'p' * 100, bytes(self.handle.BulkRead(100)))
+        select.assert_not_called()
+
+    def testReadWaitsForAllData(self):
+        self.handle.device.sendall(b'abc')
+        self.handle.device.sendall(b'def')
+        self.assertEqual(b'abcdef', bytes(self.handle.BulkRead(6)))
+
+    def testLeftoverDataIsMovedToTheFront(self):
+        size = common.TCP_RECV_BUFFER_SIZE
+        self.handle.device.sendall(b'a' * (size - 10))
+        self.assertEqual(b'a' * (size - 10), bytes(self.handle.BulkRead(size - 10)))
+
+        self.handle.device.sendall(b'b' * 20)
+        self.assertEqual(b'b' * 5, bytes(self.handle.BulkRead(5)))
+        self.handle.device.sendall(b'c' * 20)
+        self.assertEqual(b'b' * 15 + b'c' * 20, bytes(self.handle.BulkRead(35)))
+
+    def testReadLargerThanBuffer(self):
+        size = common.TCP_RECV_BUFFER_SIZE
+        self.handle.device.sendall(b'x' * 10)
+        self.assertEqual(b'x' * 5, bytes(self.handle.BulkRead(5)))
+
+        payload = bytes(bytearray(range(256))) * (size // 128)
+        sender = threading.Thread(target=self.handle.device.sendall, args=(payload,))
+        sender.start()
+        self.addCleanup(sender.join)
+        self.assertEqual(b'x' * 5 + payload, bytes(self.handle.BulkRead(5 + len(payload))))
+
+    def testTimeoutKeepsPartialData(self):
+        self.handle.device.sendall(b'abc')
+        with self.assertRaises(usb_exceptions.TcpTimeoutException):
+            self.handle.BulkRead(6, timeout=10)
+
+        self.handle.device.sendall(b'def')
+        self.assertEqual(b'abcdef', bytes(self.handle.BulkRead(6)))
+
+    def testConnectionClosed(self):
+        self.handle.device.close()
+        with self.assertRaises(usb_exceptions.ReadFailedError):
+            self.handle.BulkRead(24)
+
+    def testBulkReadIntoSmallRead(self):
+        self.handle.device.sendall(b'h' * 24 + b'p' * 100)
+        self.handle.BulkRead(24)
+
+        buffer = bytearray(100)
+        with mock.patch('select.select') as select:
+            self.assertEqual(100, self.handle.BulkReadInto(memoryview(buffer)))
+        select.assert_not_called()
+        self.assertEqual(b'p' * 100, bytes(buffer))
+
+    def testBulkReadIntoLargeReadSkipsTheBuffer(self):
+        size = common.TCP_RECV_BUFFER_SIZE
+        self.handle.device.sendall(b'x' * 10)
+        self.handle.BulkRead(5)
+
+        payload = bytes(bytearray(range(256))) * (size // 128)
+        sender = threading.Thread(target=self.handle.device.sendall, args=(payload,))
+        sender.start()
+        self.addCleanup(sender.join)
+
+        buffer = bytearray(5 + len(payload))
+        self.handle.BulkReadInto(memoryview(buffer))
+        self.assertEqual(b'x' * 5 + payload, bytes(buffer))
+
+    def testBulkReadIntoTimeoutKeepsPartialData(self):
+        size = common.TCP_RECV_BUFFER_SIZE
+        self.handle.device.sendall(b'a' * (size + 10))
+        with self.assertRaises(usb_exceptions.TcpTimeoutException):
+            self.handle.BulkReadInto(memoryview(bytearray(2 * size)), timeout=10)
+
+        self.handle.device.sendall(b'b' * (size - 10))
+        self.assertEqual(b'a' * (size + 10) + b'b' * (size - 10), bytes(self.handle.BulkRead(2 * size)))
+
+
+class TcpHandleWriteTest(unittest.TestCase):
+    def setUp(self):
+        self.handle = SocketPairTcpHandle(timeout_ms=1000)
+        self.addCleanup(self.handle.device.close)
+        self.addCleanup(self.handle._connection.close)
+
+    def testBulkWriteV(self):
+        self.assertEqual(30, self.handle.BulkWriteV((b'h' * 24, b'', bytearray(b'p' * 6))))
+        self.assertEqual(b'h' * 24 + b'p' * 6, self.handle.device.recv(100))
+
+    @unittest.skipUnless(hasattr(socket.socket, 'sendmsg'), 'sendmsg is not available')
+    def testBulkWriteVUsesOneSendmsg(self):
+        connection = mock.MagicMock(wraps=self.handle._connection)
+        self.handle._connection = connection
+        with mock.patch('select.select', return_value=([], [connection], [])):
+            self.handle.BulkWriteV((b'h' * 24, b'p' * 6))
+
+        connection.sendmsg.assert_called_once()
+        connection.send.assert_not_called()
+
+    def testPartialSends(self):
+        sent = []
+        send_sizes = [2, 2]
+        sendmsg_sizes = [10, 16]
+
+        def Send(data):
+            sent.append(bytes(data))
+            return send_sizes.pop(0)
+
+        def Sendmsg(buffers):
+            sent.append([bytes(buf) for buf in buffers])
+            return sendmsg_sizes.pop(0)
+
+        connection = mock.MagicMock()
+        connection.send.side_effect = Send
+        connection.sendmsg.side_effect = Sendmsg
+        self.handle._connection = connection
+
+        with mock.patch('select.select', return_value=([], [connection], [])):
+            self.assertEqual(30, self.handle.BulkWriteV((b'h' * 24, b'p' * 6)))
+
+        self.assertEqual([[b'h' * 24, b'p' * 6], [b'h' * 14, b'p' * 6], b'pppp', b'pp'], sent)
+
+    @unittest.skipUnless(hasattr(os, 'sendfile'), 'os.sendfile is not available')
+    def testSendFile(self):
+        with tempfile.TemporaryFile() as datafile:
+            datafile.write(b'0123456789')
+            datafile.flush()
+
+            self.assertEqual(4, self.handle.SendFile(datafile.fileno(), 3, 4))
+            self.assertEqual(b'3456', self.handle.device.recv(100))
+
+            with self.assertRaises(usb_exceptions.WriteFailedError):
+                self.handle.SendFile(datafile.fileno(), 8, 4)
+
+    def testTimeout(self):
+        with mock.patch('select.select', return_value=([], [], [])):
+            with self.assertRaises(usb_exceptions.TcpTimeoutException):
+                self.handle.BulkWrite(b'data')
+
+    def testSocketOptions(self):
+        with mock.patch('socket.create_connection') as create_connection:
+            common.TcpHandle('localhost:5555', sndbuf=1 << 20, rcvbuf=1 << 21)
+
+        create_connection.return_value.setsockopt.assert_has_calls([
+            mock.call(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            mock.call(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20),
+            mock.call(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 21)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Tests for adb.forwarding and the port forwarding of adb.adb_commands_async."""
+
+import asyncio
+import os
+
+from adb import usb_exceptions
+
+from test import async_stub
+
+
+class ForwardingTest(async_stub.AsyncAdbCommandsTestCase):
+    def testForward(self):
+        server = self.Run(self.adb.Forward('tcp:0', 'tcp:7'))
+
+        async def Echo(data):
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            writer.write(data)
+            echo = await reader.readexactly(len(data))
+            writer.close()
+            return echo
+
+        data = [os.urandom(100000), b'hi', os.urandom(5000)]
+        self.assertEqual(data, self.Run(asyncio.gather(*[Echo(d) for d in data])))
+
+        # Each client had its own stream, and they were all closed.
+        self.Run(asyncio.sleep(0.1))
+        self.assertEqual([b'tcp:7'] * 3, self.device.services)
+        self.assertEqual({}, self.device.echoes)
+        self.Run(server.Close())
+
+    def testForwardToRefusedService(self):
+        server = self.Run(self.adb.Forward(b'tcp:0', b'nope:'))
+
+        async def Connect():
+            reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+            data = await reader.read()
+            writer.close()
+            return data
+
+        self.assertEqual(b'', self.Run(Connect()))
+
+    def testForwardOnlyFromTcp(self):
+        with self.assertRaises(ValueError):
+            self.Run(self.adb.Forward('localabstract:foo', 'tcp:7'))
+
+    def testReverse(self):
+        async def Handle(reader, writer):
+            data = await reader.readexactly(5)
+            writer.write(data.upper())
+            await writer.drain()
+            writer.close()
+
+        server = self.Run(asyncio.start_server(Handle, '127.0.0.1', 0))
+        local = b'tcp:%d' % server.sockets[0].getsockname()[1]
+        try:
+            self.assertIsNone(self.Run(self.adb.Reverse('tcp:9000', local)))
+            self.assertEqual({b'tcp:9000': local}, self.device.reverses)
+
+            self.device.OpenReverse(200, local)
+            stream = self.device.reverse_streams[200]
+            self.RunUntil(lambda: stream['host_id'] is not None)
+            self.device.Send(b'WRTE', 200, stream['host_id'], b'hello')
+            self.RunUntil(lambda: stream['closed'])
+            self.assertEqual(b'HELLO', stream['received'])
+        finally:
+            server.close()
+            self.Run(server.wait_closed())
+
+    def testReverseRefusesOtherDestinations(self):
+        self.assertEqual(9123, self.Run(self.adb.Reverse('tcp:0', 'tcp:1')))
+
+        # Nothing listens on the local port.
+        self.device.OpenReverse(200, b'tcp:1')
+        # Nothing was reversed to this port.
+        self.device.OpenReverse(201, b'tcp:2')
+        self.RunUntil(lambda: len(self.device.refused) == 2)
+        self.assertEqual([200, 201], sorted(self.device.refused))
+
+    def testRemoveReverse(self):
+        self.Run(self.adb.Reverse('tcp:9000', 'tcp:1'))
+        self.Run(self.adb.Reverse('tcp:9001', 'tcp:2'))
+        self.Run(self.adb.RemoveReverse('tcp:9000'))
+        self.assertEqual({b'tcp:9001': b'tcp:2'}, self.device.reverses)
+
+        with self.assertRaises(usb_exceptions.AdbCommandFailureException):
+            self.Run(self.adb.RemoveReverse('tcp:9000'))
+
+        self.Run(self.adb.RemoveReverse())
+        self.assertEqual({}, self.device.reverses)
@@ -0,0 +1,287 @@
+"""Tests for adb.sansio."""
+
+import struct
+import unittest
+
+from adb import adb_protocol
+from adb import sansio
+from adb import usb_exceptions
+
+
+def Packet(command, arg0, arg1, data=b''):
+    return adb_protocol.AdbMessage(command, arg0, arg1, data).Pack() + data
+
+
+class FakeSigner(object):
+    def __init__(self, name):
+        self.name = name
+
+    def Sign(self, data):
+        return self.name + b':' + data
+
+    def GetPublicKey(self):
+        return b'public:' + self.name
+
+
+class AdbTransportTest(unittest.TestCase):
+    def _Connect(self, features=b'', max_data=4096, **kwargs):
+        transport = sansio.AdbTransport(banner=b'test', **kwargs)
+        transport.Connect()
+        self.assertEqual(Packet(b'CNXN', 0x01000001, 1024 * 1024, b'host::test;features=delayed_ack,shell_v2\0'), transport.DataToSend())
+
+        banner = b'device::ro.product.name=x;features=' + features + b'\0'
+        self.assertEqual([sansio.Connected(banner)], transport.ReceiveData(Packet(b'CNXN', 0x01000000, max_data, banner)))
+        return transport
+
+    def _Open(self, transport):
+        local_id = transport.Open(b'shell:')
+        self.assertEqual(b'OPEN', transport.DataToSend()[:4])
+        self.assertEqual([sansio.StreamOpened(local_id), sansio.StreamWritable(local_id)],
+                         transport.ReceiveData(Packet(b'OKAY', 20, local_id)))
+        return local_id
+
+    def testConnect(self):
+        transport = self._Connect(features=b'shell_v2,delayed_ack', max_data=256 * 1024)
+        self.assertTrue(transport.connected)
+        self.assertEqual(0x01000000, transport.info.version)
+        self.assertEqual(256 * 1024, transport.info.max_data)
+        self.assertEqual(frozenset([b'delayed_ack', b'shell_v2']), transport.info.features)
+
+    def testPacketsSplitAcrossReads(self):
+        transport = self._Connect()
+        local_id = self._Open(transport)
+
+        data = Packet(b'WRTE', 20, local_id, b'hello') + Packet(b'WRTE', 20, local_id, b'world')
+        events = []
+        for i in range(len(data)):
+            events += transport.ReceiveData(data[i:i + 1])
+
+        self.assertEqual([sansio.StreamData(local_id, b'hello'), sansio.StreamData(local_id, b'world')], events)
+        okay = Packet(b'OKAY', local_id, 20)
+        self.assertEqual(okay + okay, transport.DataToSend())
+
+    def testAuth(self):
+        transport = sansio.AdbTransport(rsa_keys=[FakeSigner(b'a'), FakeSigner(b'b')])
+        transport.Connect()
+        transport.DataToSend()
+
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertEqual(Packet(b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'a:token'), transport.DataToSend())
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertEqual(Packet(b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'b:token'), transport.DataToSend())
+
+        events = transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertEqual([sansio.PublicKeySent()], events)
+        self.assertEqual(Packet(b'AUTH', adb_protocol.AUTH_RSAPUBLICKEY, 0, b'public:a\0'), transport.DataToSend())
+
+        with self.assertRaises(usb_exceptions.DeviceAuthError):
+            transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+
+    def testAcceptedKey(self):
+        keys = [FakeSigner(b'a'), FakeSigner(b'b')]
+        transport = sansio.AdbTransport(rsa_keys=keys)
+        transport.Connect()
+        transport.DataToSend()
+
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertIsNone(transport.accepted_key)
+        transport.ReceiveData(Packet(b'CNXN', 0x01000000, 4096, b'device::\0'))
+        self.assertIs(keys[1], transport.accepted_key)
+
+    def testPreferredKey(self):
+        keys = [FakeSigner(b'a'), FakeSigner(b'b')]
+        transport = sansio.AdbTransport(rsa_keys=keys, preferred_key=keys[1])
+        transport.Connect()
+        transport.DataToSend()
+
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertEqual(Packet(b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'b:token'), transport.DataToSend())
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertEqual(Packet(b'AUTH', adb_protocol.AUTH_SIGNATURE, 0, b'a:token'), transport.DataToSend())
+
+        # The public key is still that of the first key.
+        transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+        self.assertEqual(Packet(b'AUTH', adb_protocol.AUTH_RSAPUBLICKEY, 0, b'public:a\0'), transport.DataToSend())
+        transport.ReceiveData(Packet(b'CNXN', 0x01000000, 4096, b'device::\0'))
+        self.assertIs(keys[0], transport.accepted_key)
+
+    def testAuthWithoutKeys(self):
+        transport = sansio.AdbTransport()
+        with self.assertRaises(usb_exceptions.DeviceAuthError):
+            transport.ReceiveData(Packet(b'AUTH', adb_protocol.AUTH_TOKEN, 0, b'token'))
+
+    def testOneWriteInFlightWithoutDelayedAck(self):
+        transport = self._Connect(max_data=4)
+        local_id = self._Open(transport)
+
+        transport.Write(local_id, b'abcdefg')
+        self.assertEqual(Packet(b'WRTE', local_id, 20, b'abcd'), transport.DataToSend())
+        self.assertEqual(3, transport.PendingBytes(local_id))
+
+        self.assertEqual([sansio.StreamWritable(local_id)], transport.ReceiveData(Packet(b'OKAY', 20, local_id)))
+        self.assertEqual(Packet(b'WRTE', local_id, 20, b'efg'), transport.DataToSend())
+        self.assertEqual([sansio.StreamWritable(local_id)], transport.ReceiveData(Packet(b'OKAY', 20, local_id)))
+
+    def testDelayedAckWindow(self):
+        transport = self._Connect(features=b'delayed_ack', max_data=4)
+        local_id = transport.Open(b'shell:')
+        self.assertEqual(Packet(b'OPEN', local_id, adb_protocol.DELAYED_ACK_WINDOW, b'shell:\0'), transport.DataToSend())
+        transport.ReceiveData(Packet(b'OKAY', 20, local_id, struct.pack('<I', 6)))
+
+        transport.Write(local_id, b'abcdefghij')
+        self.assertEqual(Packet(b'WRTE', local_id, 20, b'abcd') + Packet(b'WRTE', local_id, 20, b'efgh'), transport.DataToSend())
+        self.assertEqual(2, transport.PendingBytes(local_id))
+
+        transport.ReceiveData(Packet(b'OKAY', 20, local_id, struct.pack('<I', 8)))
+        self.assertEqual(Packet(b'WRTE', local_id, 20, b'ij'), transport.DataToSend())
+
+        # Received data is acked with its length.
+        transport.ReceiveData(Packet(b'WRTE', 20, local_id, b'out'))
+        self.assertEqual(Packet(b'OKAY', local_id, 20, struct.pack('<I', 3)), transport.DataToSend())
+
+    def testWritable(self):
+        transport = self._Connect(features=b'delayed_ack')
+        local_id = transport.Open(b'shell:')
+        self.assertFalse(transport.Writable(local_id))
+        transport.ReceiveData(Packet(b'OKAY', 20, local_id, struct.pack('<I', 4)))
+        self.assertTrue(transport.Writable(local_id))
+        self.assertEqual(4, transport.SendWindow(local_id))
+
+        # Like adb, a packet is sent as long as the window isn't used up.
+        transport.Write(local_id, b'abcdef')
+        self.assertEqual(-2, transport.SendWindow(local_id))
+        self.assertFalse(transport.Writable(local_id))
+        transport.ReceiveData(Packet(b'OKAY', 20, local_id, struct.pack('<I', 6)))
+        self.assertTrue(transport.Writable(local_id))
+        self.assertIsNone(transport.SendWindow(local_id + 1))
+
+    def testHandlePacketAndPacketsToSend(self):
+        transport = self._Connect(auto_ack=False)
+        local_id = transport.Open(b'shell:')
+        self.assertEqual([(b'OPEN', local_id, 0, b'shell:\0')], transport.PacketsToSend())
+        self.assertEqual([sansio.StreamOpened(local_id), sansio.StreamWritable(local_id)], transport.HandlePacket(b'OKAY', 20, local_id, b''))
+
+        # The payload isn't copied.
+        data = memoryview(bytearray(b'out'))
+        self.assertIs(data, transport.HandlePacket(b'WRTE', 20, local_id, data)[0].data)
+        transport.Write(local_id, data, copy=False)
+        self.assertIs(data, transport.PacketsToSend()[0][3])
+        self.assertEqual([], transport.PacketsToSend())
+
+    def testLateCloseWhileOpeningIsIgnored(self):
+        transport = self._Connect()
+        local_id = transport.Open(b'shell:')
+        transport.DataToSend()
+
+        # A refusal has no remote id, so this is for an earlier stream.
+        self.assertEqual([], transport.ReceiveData(Packet(b'CLSE', 30, local_id)))
+        self.assertEqual([sansio.StreamOpened(local_id), sansio.StreamWritable(local_id)], transport.ReceiveData(Packet(b'OKAY', 20, local_id)))
+
+    def testOpenWithWindow(self):
+        transport = self._Connect(features=b'delayed_ack')
+        local_id = transport.Open(b'shell:', 1024)
+        self.assertEqual(Packet(b'OPEN', local_id, 1024, b'shell:\0'), transport.DataToSend())
+
+        # Without the ``delayed_ack`` feature, there is no window.
+        transport = self._Connect()
+        local_id = transport.Open(b'shell:', 1024)
+        self.assertEqual(Packet(b'OPEN', local_id, 0, b'shell:\0'), transport.DataToSend())
+
+    def testWriteFromWrongRemoteIsDropped(self):
+        transport = self._Connect()
+        local_id = self._Open(transport)
+
+        self.assertEqual([], transport.ReceiveData(Packet(b'WRTE', 21, local_id, b'stale')))
+        self.assertEqual(b'', transport.DataToSend())
+
+    def testManualAck(self):
+        transport = self._Connect(auto_ack=False)
+        local_id = self._Open(transport)
+
+        self.assertEqual([sansio.StreamData(local_id, b'out')], transport.ReceiveData(Packet(b'WRTE', 20, local_id, b'out')))
+        self.assertEqual(b'', transport.DataToSend())
+        transport.Acknowledge(local_id, 3)
+        self.assertEqual(Packet(b'OKAY', local_id, 20), transport.DataToSend())
+
+    def testStreamRejected(self):
+        transport = self._Connect()
+        local_id = transport.Open(b'nope:')
+        self.assertEqual([sansio.StreamRejected(local_id)], transport.ReceiveData(Packet(b'CLSE', 0, local_id)))
+        self.assertEqual(local_id, transport.Open(b'shell:'))
+
+    def testDeviceCloses(self):
+        transport = self._Connect()
+        local_id = self._Open(transport)
+
+        self.assertEqual([sansio.StreamClosed(local_id)], transport.ReceiveData(Packet(b'CLSE', 20, local_id)))
+        self.assertEqual(Packet(b'CLSE', local_id, 20), transport.DataToSend())
+
+    def testHostCloses(self):
+        transport = self._Connect()
+        local_id = self._Open(transport)
+
+        transport.Close(local_id)
+        self.assertEqual(Packet(b'CLSE', local_id, 20), transport.DataToSend())
+        # Data that was already on its way is dropped, and the id isn't reused until the device confirms.
+        self.assertEqual([], transport.ReceiveData(Packet(b'WRTE', 20, local_id, b'late')))
+        self.assertNotEqual(local_id, transport.Open(b'shell:'))
+        self.assertEqual([sansio.StreamClosed(local_id)], transport.ReceiveData(Packet(b'CLSE', 20, local_id)))
+
+    def testChecksumIsChecked(self):
+        transport = self._Connect()
+        local_id = self._Open(transport)
+
+        packet = bytearray(Packet(b'WRTE', 20, local_id, b'data'))
+        packet[16] ^= 1
+        with self.assertRaises(adb_protocol.InvalidChecksumError):
+            transport.ReceiveData(bytes(packet))
+
+    def testDeviceOpenIsRefused(self):
+        transport = self._Connect()
+        transport.ReceiveData(Packet(b'OPEN', 30, 0, b'tcp:1234\0'))
+        self.assertEqual(Packet(b'CLSE', 0, 30), transport.DataToSend())
+
+    def testDeviceOpenIsAccepted(self):
+        transport = self._Connect(accept_opens=True)
+        self.assertEqual([sansio.StreamRequested(30, b'tcp:1234')], transport.ReceiveData(Packet(b'OPEN', 30, 0, b'tcp:1234\0')))
+        self.assertEqual(b'', transport.DataToSend())
+
+        local_id = transport.Accept(30)
+        self.assertEqual(Packet(b'OKAY', local_id, 30), transport.DataToSend())
+        self.assertEqual([sansio.StreamData(local_id, b'hi')], transport.ReceiveData(Packet(b'WRTE', 30, local_id, b'hi')))
+        transport.DataToSend()
+
+        transport.Write(local_id, b'result')
+        self.assertEqual(Packet(b'WRTE', local_id, 30, b'result'), transport.DataToSend())
+
+    def testDeviceOpenWithDelayedAck(self):
+        transport = self._Connect(features=b'delayed_ack', accept_opens=True)
+        transport.ReceiveData(Packet(b'OPEN', 30, 4, b'tcp:1234\0'))
+
+        local_id = transport.Accept(30)
+        self.assertEqual(Packet(b'OKAY', local_id, 30, struct.pack('<I', adb_protocol.DELAYED_ACK_WINDOW)), transport.DataToSend())
+        # The device's window is in its OPEN packet.
+        transport.Write(local_id, b'abcdef')
+        self.assertEqual(Packet(b'WRTE', local_id, 30, b'abcdef'), transport.DataToSend())
+        transport.Write(local_id, b'gh')
+        self.assertEqual(b'', transport.DataToSend())
+
+    def testDeviceOpenIsRejected(self):
+        transport = self._Connect(accept_opens=True)
+        transport.ReceiveData(Packet(b'OPEN', 30, 0, b'tcp:1234\0'))
+        transport.Reject(30)
+        self.assertEqual(Packet(b'CLSE', 0, 30), transport.DataToSend())
+        with self.assertRaises(KeyError):
+            transport.Accept(30)
+
+    def testDeviceGivesUpOnOpen(self):
+        transport = self._Connect(accept_opens=True)
+        transport.ReceiveData(Packet(b'OPEN', 30, 0, b'tcp:1234\0'))
+        self.assertEqual([], transport.ReceiveData(Packet(b'CLSE', 30, 0)))
+        with self.assertRaises(KeyError):
+            transport.Accept(30)
+
+
+if __name__ == '__main__':
+    unittest.main()
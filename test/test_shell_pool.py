@@ -0,0 +1,134 @@
+"""Tests for adb.shell_pool."""
+
+import re
+import threading
+import unittest
+
+from adb import adb_protocol
+from adb import shell_pool
+from adb import usb_exceptions
+
+
+COMMAND_RE = re.compile(br"echo ADB_BEGIN_''(\S+); \((.*)\) </dev/null; echo ADB_END_''(\S+):\$\?\n")
+
+
+class FakeShell(object):
+    """A ``shell:`` stream to a shell that echoes its input and ends lines with ``\\r\\n``, like in a terminal."""
+    def __init__(self, commands):
+        self.closed = False
+        self.commands = commands
+        self.timeout_ms = None
+        self.written = []
+        self._packets = []
+
+    def Write(self, data):
+        self.written.append(data)
+        self._packets.append(data.replace(b'\n', b'\r\n'))
+        match = COMMAND_RE.match(data)
+        if not match:
+            self._packets.append(b'$ ')
+            return
+
+        if match.group(2) == b'exit':
+            self._packets.append(None)
+            return
+        if match.group(2) not in self.commands:
+            # The command doesn't finish.
+            return
+
+        output, exit_code = self.commands[match.group(2)]
+        reply = b'ADB_BEGIN_%s\r\n%s' % (match.group(1), output.replace(b'\n', b'\r\n'))
+        reply += b'ADB_END_%s:%d\r\n$ ' % (match.group(3), exit_code)
+        # The output arrives in small pieces.
+        self._packets += [reply[i:i + 5] for i in range(0, len(reply), 5)]
+
+    def ReadUntil(self, *cmds):
+        if not self._packets:
+            raise usb_exceptions.ReadFailedError('Timed out', None)
+        data = self._packets.pop(0)
+        if data is None:
+            return b'CLSE', b''
+        return b'WRTE', data
+
+    def Close(self):
+        self.closed = True
+
+
+class FakeProtocol(object):
+    def __init__(self, commands):
+        self.commands = commands
+        self.shells = []
+
+    def Open(self, handle, destination, timeout_ms=None):
+        assert destination == b'shell:'
+        shell = FakeShell(self.commands)
+        shell.timeout_ms = timeout_ms
+        self.shells.append(shell)
+        return shell
+
+
+class ShellPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.protocol = FakeProtocol({
+            b'getprop ro.serialno': (b'1234\n', 0),
+            b'ls /nope': (b'ls: /nope: No such file or directory\n', 1),
+            b'printf abc': (b'abc', 0),
+        })
+        self.pool = shell_pool.ShellPool(None, size=2, timeout_ms=100, protocol_handler=self.protocol)
+
+    def testShell(self):
+        self.assertEqual(shell_pool.ShellResult('1234\r\n', 0), self.pool.Shell('getprop ro.serialno'))
+        self.assertEqual(shell_pool.ShellResult('ls: /nope: No such file or directory\r\n', 1), self.pool.Shell(b'ls /nope'))
+        self.assertEqual(shell_pool.ShellResult('abc', 0), self.pool.Shell('printf abc'))
+
+        # One shell was opened and set up, and then used for every command.
+        self.assertEqual(1, len(self.protocol.shells))
+        self.assertEqual(b'stty -echo -onlcr 2>/dev/null\n', self.protocol.shells[0].written[0])
+        self.assertEqual(4, len(self.protocol.shells[0].written))
+
+    def testMarkersAreUnique(self):
+        self.pool.Shell('printf abc')
+        self.pool.Shell('printf abc')
+        markers = [COMMAND_RE.match(data).group(1) for data in self.protocol.shells[0].written[1:]]
+        self.assertNotEqual(markers[0], markers[1])
+
+    def testFailedShellIsReplaced(self):
+        self.pool.Shell('printf abc')
+        with self.assertRaises(usb_exceptions.ReadFailedError):
+            self.pool.Shell('sleep 100')
+        self.assertTrue(self.protocol.shells[0].closed)
+
+        self.assertEqual(shell_pool.ShellResult('abc', 0), self.pool.Shell('printf abc'))
+        self.assertEqual(2, len(self.protocol.shells))
+
+    def testShellExits(self):
+        with self.assertRaises(adb_protocol.InvalidResponseError):
+            self.pool.Shell('exit')
+
+    def testConcurrentCommandsUseSeparateShells(self):
+        running = threading.Barrier(2)
+        original_open = self.protocol.Open
+
+        def Open(*args, **kwargs):
+            running.wait(timeout=5)
+            return original_open(*args, **kwargs)
+
+        self.protocol.Open = Open
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.pool.Shell('printf abc'))) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([shell_pool.ShellResult('abc', 0)] * 2, results)
+        self.assertEqual(2, len(self.protocol.shells))
+
+    def testClose(self):
+        self.pool.Shell('printf abc')
+        self.pool.Close()
+        self.assertTrue(self.protocol.shells[0].closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
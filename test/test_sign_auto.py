@@ -0,0 +1,60 @@
+"""Tests for adb.sign_auto."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from adb import adb_keygen
+from adb import sign_auto
+from adb.sign_cryptography import CryptographySigner
+from adb.sign_pythonrsa import PythonRSASigner
+
+
+class SignAutoTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.mkdtemp()
+        cls.rsa_key_path = os.path.join(cls.tempdir, 'adbkey')
+        adb_keygen.keygen(cls.rsa_key_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tempdir)
+
+    def tearDown(self):
+        sign_auto.ClearCache()
+
+    def testFastestBackendIsUsed(self):
+        self.assertEqual(['cryptography', 'rsa', 'pycryptodome'], sign_auto.AvailableBackends())
+        self.assertIsInstance(sign_auto.GetSigner(self.rsa_key_path), CryptographySigner)
+        self.assertIsInstance(sign_auto.GetSigner(self.rsa_key_path, 'rsa'), PythonRSASigner)
+
+        with self.assertRaises(ValueError):
+            sign_auto.GetSigner(self.rsa_key_path, 'abacus')
+
+    def testBackendsSignTheSame(self):
+        token = os.urandom(20)
+        self.assertEqual(sign_auto.GetSigner(self.rsa_key_path, 'rsa').Sign(token),
+                         sign_auto.GetSigner(self.rsa_key_path, 'cryptography').Sign(token))
+
+    def testKeyIsLoadedOnce(self):
+        signer = sign_auto.GetSigner(self.rsa_key_path)
+        self.assertIs(signer, sign_auto.GetSigner(self.rsa_key_path))
+        self.assertIsNot(signer, sign_auto.GetSigner(self.rsa_key_path, 'rsa'))
+
+        # The key is loaded again once its files change.
+        stat = os.stat(self.rsa_key_path)
+        os.utime(self.rsa_key_path, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNot(signer, sign_auto.GetSigner(self.rsa_key_path))
+
+    def testMissingKey(self):
+        with self.assertRaises(OSError):
+            sign_auto.GetSigner(os.path.join(self.tempdir, 'nokey'))
+
+    def testBenchmark(self):
+        results = sign_auto.Benchmark(self.rsa_key_path, rounds=1)
+        self.assertEqual(sorted(sign_auto.AvailableBackends()), sorted(results))
+        for load, sign in results.values():
+            self.assertGreater(load, 0)
+            self.assertGreater(sign, 0)
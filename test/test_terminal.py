@@ -0,0 +1,88 @@
+"""Tests for adb.terminal."""
+
+import unittest
+
+from adb import adb_protocol
+from adb import terminal
+
+
+class FakeShellConnection(object):
+    """An interactive ``shell:`` stream that replies to each command with ``packets``."""
+    def __init__(self, packets):
+        self.packets = list(packets)
+        self.written = []
+
+    def Write(self, data):
+        self.written.append(data)
+
+    def ReadUntil(self, *cmds):
+        return b'WRTE', self.packets.pop(0)
+
+
+class TerminalOutputCleanerTest(unittest.TestCase):
+    def Clean(self, chunks, **kwargs):
+        return b''.join(terminal.CleanTerminalOutput(chunks, **kwargs))
+
+    def testLineEndings(self):
+        self.assertEqual(b'a\nb\nc\n', self.Clean([b'a\r\nb\r\r\nc\n']))
+
+    def testBackspaces(self):
+        self.assertEqual(b'lsx\n', self.Clean([b'lss\x08x\r\n']))
+        self.assertEqual(b'ab\n', self.Clean([b'abcd\x08\x08\r\n']))
+        # A backspace can't erase the previous line.
+        self.assertEqual(b'a\nb\n', self.Clean([b'a\n\x08\x08b\n']))
+
+    def testCarriageReturnOverwrites(self):
+        self.assertEqual(b'xyzde\n', self.Clean([b'abcde\rxyz\n']))
+
+    def testChunkBoundaries(self):
+        data = b'echo hi\r\r\nhi\r\nab\x08\x08\x08cd\r\nshell@hammerhead:/ $ '
+        expected = self.Clean([data])
+        self.assertEqual(b'echo hi\nhi\ncd\nshell@hammerhead:/ $ ', expected)
+        for size in range(1, 8):
+            self.assertEqual(expected, self.Clean([data[i:i + size] for i in range(0, len(data), size)]))
+
+    def testDelimiterSplitAcrossChunks(self):
+        chunks = iter([b'out\r\nshell@ham', b'merhead:/ $ ', b'never read'])
+        self.assertEqual([b'out\n', b'shell@hammerhead:/ $ '], list(terminal.CleanTerminalOutput(chunks, delim=b'@hammerhead:')))
+        self.assertEqual(b'never read', next(chunks))
+
+    def testDelimiterErasedByBackspace(self):
+        cleaner = terminal.TerminalOutputCleaner(b'$ ')
+        cleaner.Feed(b'$\x08')
+        cleaner.Feed(b' ')
+        self.assertFalse(cleaner.found_delim)
+        cleaner.Feed(b'\x08$ ')
+        self.assertTrue(cleaner.found_delim)
+
+    def testRaw(self):
+        chunks = iter([b'a\r\nshell@ham', b'merhead:/ $ ', b'never read'])
+        self.assertEqual(b'a\r\nshell@hammerhead:/ $ ', self.Clean(chunks, delim=b'@hammerhead:', clean=False))
+        self.assertEqual(b'never read', next(chunks))
+
+    def testLongOutput(self):
+        line = b'x' * 100 + b'\x08' * 10 + b'\r\n'
+        output = self.Clean([line] * 10000)
+        self.assertEqual((b'x' * 90 + b'\n') * 10000, output)
+
+
+class InteractiveShellCommandTest(unittest.TestCase):
+    def testInteractiveShellCommand(self):
+        conn = FakeShellConnection([b'ls\r\r\n', b'a\r\nb\r\nshell@ham', b'merhead:/ $ '])
+        stdout = adb_protocol.AdbMessage.InteractiveShellCommand(conn, 'ls', delim='shell@hammerhead:/ $ ')
+        self.assertEqual([b'ls\r'], conn.written)
+        self.assertEqual(b'a\nb', stdout)
+
+    def testStreamingInteractiveShellCommand(self):
+        conn = FakeShellConnection([b'ls\r\r\na\r\n', b'b\r\nroot@hammerhead:/data # '])
+        output = list(adb_protocol.AdbMessage.StreamingInteractiveShellCommand(conn, 'ls', delim=b'shell@hammerhead:/ $ '))
+        self.assertEqual([b'a\n', b'b\n', b'root@hammerhead:/data # '], output)
+
+    def testPrompt(self):
+        conn = FakeShellConnection([b'shell@hammerhead:/ $ ', b'never read'])
+        self.assertEqual(b'shell@hammerhead:/ $', adb_protocol.AdbMessage.InteractiveShellCommand(conn))
+        self.assertEqual([], conn.written)
+
+
+if __name__ == '__main__':
+    unittest.main()